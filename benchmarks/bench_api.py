@@ -0,0 +1,68 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import datetime
+import json
+import pytest
+from whatson.webapp import create_app
+
+
+@pytest.fixture(scope="module")
+def client(seeded_connection):
+    # Measure the database and serialisation, not the response cache
+    app = create_app(seeded_connection, {"CACHE_SIZE": 0})
+    with app.test_client() as client:
+        yield client
+
+
+# With 100k shows or more, the current month holds thousands of shows
+@pytest.mark.benchmark(group="shows")
+def test_shows(benchmark, client):
+    today = datetime.date.today()
+    url = f"/api/shows?year={today.year}&month={today.month}"
+
+    response = benchmark(client.get, url)
+    assert response.status_code == 200
+
+
+@pytest.mark.benchmark(group="shows")
+def test_shows_serialised_in_python(benchmark, seeded_connection):
+    """The same month's shows, fetched as rows and serialised with `json` as
+    `/api/shows` used to, for comparison with `test_shows`
+    """
+    today = datetime.date.today()
+
+    def shows():
+        with seeded_connection.cursor() as cursor:
+            cursor.execute(
+                """SELECT shows.* FROM show_months
+                    JOIN shows ON shows.id = show_months.show_id
+                    WHERE show_months.year = %(year)s
+                    AND show_months.month = %(month)s
+                    ORDER BY shows.start_date ASC
+                    """,
+                {"year": today.year, "month": today.month},
+            )
+            rows = cursor.fetchall()
+
+        return json.dumps(
+            {
+                "status": "ok",
+                "shows": [
+                    {
+                        "name": row["title"],
+                        "theatre": row["theatre"],
+                        "image_url": row["image_url"],
+                        "link_url": row["link_url"],
+                        "start_date": row["start_date"].isoformat(),
+                        "end_date": row["end_date"].isoformat(),
+                    }
+                    for row in rows
+                ],
+            }
+        )
+
+    benchmark(shows)
+
+
+def test_months(benchmark, client):
+    response = benchmark(client.get, "/api/months")
+    assert response.status_code == 200
@@ -0,0 +1,246 @@
+# pylint: disable=missing-function-docstring
+"""
+Parsing dates with `DateParser` against the fetchers' old `strptime` code
+
+Records every date range the fetchers parse from the recorded pages, then
+times parsing them with the `strptime` code each fetcher used before
+`whatson.dates`, with a fresh `DateParser` whose cache starts empty, and with
+one whose cache is already filled. Checks that the old and new code give the
+same dates.
+"""
+import datetime
+import re
+import pytest
+from whatson import ingest
+from whatson.dates import DateParser
+
+DATE_REPLACER = re.compile(r"\b([0123]?[0-9])(st|th|nd|rd)\b")
+
+
+def strptime(text, fmt):
+    return datetime.datetime.strptime(text, fmt).date()
+
+
+def split(text, separator="-"):
+    return [part.strip() for part in text.split(separator)]
+
+
+def albany(date_str, year):
+    if "-" in date_str:
+        parts = split(date_str)
+        end_date = strptime(parts[1], "%d %B %Y")
+        date_month = strptime(parts[0], "%d %B")
+        return datetime.date(end_date.year, date_month.month, date_month.day), end_date
+
+    start_date = strptime(date_str, "%d %B %Y")
+    return start_date, start_date
+
+
+def belgrade(date_text, year):
+    date_text = DATE_REPLACER.sub(r"\1", date_text)
+
+    def parse_single_date(text):
+        try:
+            tmp_date = strptime(text, "%d %B")
+        except ValueError as exc:
+            if "day is out of range for month" in str(exc):
+                tmp_date = strptime(f"{text} {year}", "%d %B %Y")
+        return datetime.date(year, tmp_date.month, tmp_date.day)
+
+    if "-" in date_text:
+        parts = split(date_text)
+        start_date = parse_single_date(parts[0])
+        end_date = parse_single_date(parts[1])
+    else:
+        start_date = end_date = parse_single_date(date_text)
+
+    if end_date < start_date:
+        end_date = datetime.date(end_date.year + 1, end_date.month, end_date.day)
+    return start_date, end_date
+
+
+def hippodrome(date_text, year):
+    def parse_single_date(txt):
+        try:
+            return strptime(txt, "%a %d %b %Y")
+        except ValueError as exc:
+            if "does not match format" in str(exc):
+                return strptime(f"{txt} {year}", "%a %d %b %Y")
+            raise
+
+    if "-" in date_text or "&" in date_text:
+        parts = split(date_text, "-" if "-" in date_text else "&")
+        return parse_single_date(parts[0]), parse_single_date(parts[1])
+
+    start_date = parse_single_date(date_text)
+    return start_date, start_date
+
+
+def arena(date_text, year):
+    if "-" in date_text:
+        parts = split(date_text)
+        end_date = strptime(parts[1], "%d %B %Y")
+        try:
+            start_date = strptime(f"{parts[0]} {end_date.year}", "%d %B %Y")
+        except ValueError:
+            start_date = strptime(
+                f"{parts[0]} {end_date.month} {end_date.year}", "%d %m %Y"
+            )
+        return start_date, end_date
+
+    start_date = strptime(date_text, "%d %B %Y")
+    return start_date, start_date
+
+
+def artrix(date_text, year):
+    def parse_date_part(text, end_date=None):
+        text = DATE_REPLACER.sub(r"\1", text)
+        text = text.replace("Thurs", "Thu").replace("Tues", "Tue")
+        try:
+            return strptime(text, "%a %d %b %Y")
+        except ValueError as exc:
+            if "does not match format" not in str(exc):
+                raise
+        try:
+            return strptime(f"{text} {year}", "%a %d %b %Y")
+        except ValueError as exc:
+            if "does not match format" not in str(exc):
+                raise
+        return strptime(f"{text} {end_date.month} {year}", "%a %d %m %Y")
+
+    if "-" in date_text:
+        parts = split(date_text)
+        end_date = parse_date_part(parts[1])
+        return parse_date_part(parts[0], end_date=end_date), end_date
+
+    start_date = parse_date_part(date_text)
+    return start_date, start_date
+
+
+def alex(date_text, year):
+    if "-" in date_text:
+        parts = split(date_text)
+        end_date = strptime(parts[1], "%a %d %b %Y")
+        try:
+            start_date = strptime(parts[0], "%a %d %b %Y")
+        except ValueError as exc:
+            if "does not match format" not in str(exc):
+                raise
+            start_date = strptime(f"{parts[0]} {end_date.year}", "%a %d %b %Y")
+        return start_date, end_date
+
+    start_date = strptime(date_text, "%a %d %b %Y")
+    return start_date, start_date
+
+
+def warwick(date_text, year):
+    if "-" in date_text:
+        parts = split(date_text)
+        end_date = strptime(parts[1], "%a %d %b %Y")
+        try:
+            start_date = strptime(f"{parts[0]} {end_date.year}", "%a %d %b %Y")
+        except ValueError as exc:
+            if "does not match format" not in str(exc):
+                raise
+            start_date = strptime(
+                f"{parts[0]} {end_date.month} {end_date.year}", "%a %d %m %Y"
+            )
+        return start_date, end_date
+
+    try:
+        start_date = strptime(date_text, "%a %d %b %Y")
+    except ValueError as exc:
+        if "does not match format" not in str(exc):
+            raise
+        start_date = strptime(f"{date_text} {year}", "%a %d %b %Y")
+    return start_date, start_date
+
+
+# The old date parsing of each fetcher, by the fetcher's name
+OLD_PARSERS = {
+    ingest.AlbanyFetcher.name: albany,
+    ingest.BelgradeFetcher.name: belgrade,
+    ingest.HippodromeFetcher.name: hippodrome,
+    ingest.ResortsWorldFetcher.name: arena,
+    ingest.ArenaBirminghamFetcher.name: arena,
+    ingest.ArtrixFetcher.name: artrix,
+    ingest.AlexFetcher.name: alex,
+    ingest.WarwickArtsCentreFetcher.name: warwick,
+}
+
+# The arenas share a module level parser
+ARENAS = {ingest.ResortsWorldFetcher.name, ingest.ArenaBirminghamFetcher.name}
+
+
+class Recorder:
+    """Stands in for a fetcher's `DateParser`, recording the date ranges it is
+    asked to parse
+    """
+
+    def __init__(self, parser, calls):
+        self.parser = parser
+        self.calls = calls
+
+    def __getattr__(self, name):
+        return getattr(self.parser, name)
+
+    def parse_range(self, text, year):
+        self.calls.append((text, year))
+        return self.parser.parse_range(text, year)
+
+
+@pytest.fixture(scope="module")
+def recorded_dates(recorded_pages):
+    """The `DateParser` of each fetcher, and a list of the (text, year) of the
+    date ranges it parses from the recorded pages, by fetcher name
+    """
+    parsers = {}
+    calls = {}
+    for _, fetcher_cls, html in recorded_pages:
+        fetcher = fetcher_cls()
+        if fetcher.name not in OLD_PARSERS:
+            continue
+        dates = ingest.ARENA_DATES if fetcher.name in ARENAS else fetcher.dates
+        parsers[fetcher.name] = dates
+        recorder = Recorder(dates, calls.setdefault(fetcher.name, []))
+        fetcher.dates = recorder
+        original_arena_dates = ingest.ARENA_DATES
+        ingest.ARENA_DATES = recorder
+        try:
+            list(fetcher.parse_page(html))
+        finally:
+            ingest.ARENA_DATES = original_arena_dates
+    return {name: (parsers[name], calls[name]) for name in calls}
+
+
+def parse_all(parse, calls):
+    return [parse(text, year) for text, year in calls]
+
+
+@pytest.mark.parametrize("name", sorted(OLD_PARSERS))
+def test_strptime(benchmark, recorded_dates, name):
+    parser, calls = recorded_dates[name]
+    benchmark.group = f"dates: {name}"
+
+    dates = benchmark(parse_all, OLD_PARSERS[name], calls)
+    assert dates == parse_all(parser.parse_range, calls)
+
+
+@pytest.mark.parametrize("name", sorted(OLD_PARSERS))
+def test_date_parser_cold(benchmark, recorded_dates, name):
+    parser, calls = recorded_dates[name]
+    benchmark.group = f"dates: {name}"
+
+    def parse():
+        fresh = DateParser(*parser.formats, separators=parser.separators)
+        return parse_all(fresh.parse_range, calls)
+
+    assert benchmark(parse)
+
+
+@pytest.mark.parametrize("name", sorted(OLD_PARSERS))
+def test_date_parser_warm(benchmark, recorded_dates, name):
+    parser, calls = recorded_dates[name]
+    benchmark.group = f"dates: {name}"
+
+    assert benchmark(parse_all, parser.parse_range, calls)
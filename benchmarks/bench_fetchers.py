@@ -0,0 +1,55 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+from unittest import mock
+from urllib.parse import urlparse
+import pytest
+from whatson import ingest
+
+# The recorded pages each fetcher reads, in the order it requests them
+PAGES = {
+    ingest.AlbanyFetcher: ["albany.html"],
+    ingest.BelgradeFetcher: ["belgrade.html"],
+    ingest.SymphonyHallFetcher: ["symphony_hall_1.html", "symphony_hall_2.html"],
+    ingest.HippodromeFetcher: ["hippodrome_1.html", "hippodrome_2.html"],
+    ingest.ResortsWorldFetcher: ["resortsworld.html"],
+    ingest.ArenaBirminghamFetcher: ["arena_birmingham.html"],
+    ingest.AlexFetcher: ["alex.html"],
+}
+
+# Listings whose pages are requested concurrently, so are served by the query
+# string of the url. Any page past the end of the listings is empty.
+QUERY_PAGES = {
+    ingest.ArtrixFetcher: (
+        {"page=1": "artrix_1.html", "page=2": "artrix_2.html"},
+        "artrix_3.html",
+    ),
+    ingest.WarwickArtsCentreFetcher: (
+        {"start=0": "arts_centre_1.html", "start=10": "arts_centre_2.html"},
+        "arts_centre_3.html",
+    ),
+}
+
+
+def responder(read_response, fetcher_cls):
+    """Build a stand in for the fetch functions, serving recorded pages"""
+    if fetcher_cls in QUERY_PAGES:
+        pages, empty = QUERY_PAGES[fetcher_cls]
+        pages = {query: read_response(name) for query, name in pages.items()}
+        empty = read_response(empty)
+        return lambda url, *args, **kwargs: pages.get(urlparse(url).query, empty)
+
+    pages = [read_response(name) for name in PAGES[fetcher_cls]]
+    return lambda url, *args, **kwargs: pages.pop(0)
+
+
+@pytest.mark.parametrize(
+    "fetcher_cls", list(PAGES) + list(QUERY_PAGES), ids=lambda cls: cls.__name__
+)
+def test_fetch(benchmark, read_response, fetcher_cls):
+    def fetch():
+        respond = responder(read_response, fetcher_cls)
+        with mock.patch("whatson.ingest._fetch_html_requests", side_effect=respond):
+            with mock.patch("whatson.ingest._fetch_html_selenium", side_effect=respond):
+                return list(fetcher_cls().fetch())
+
+    shows = benchmark(fetch)
+    assert shows
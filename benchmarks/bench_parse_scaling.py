@@ -0,0 +1,54 @@
+# pylint: disable=missing-function-docstring
+"""
+Parsing the recorded pages in a pool of processes
+
+Parses every recorded page, `COPIES` times over, the way the ingest pipeline
+does with `--parse-workers`: in the ingest process, and in pools of processes
+of different sizes. Each pool is started before it is timed.
+"""
+import pytest
+from whatson import ingest
+
+# How many times over the recorded pages are parsed, so that a pool has enough
+# pages to share out
+COPIES = 4
+
+ROUNDS = 5
+
+
+@pytest.fixture(scope="module")
+def pages(recorded_pages):
+    return [(fetcher_cls, html) for _, fetcher_cls, html in recorded_pages] * COPIES
+
+
+def parse_in_process(pages):
+    fetchers = {}
+    nshows = 0
+    for fetcher_cls, html in pages:
+        fetcher = fetchers.setdefault(fetcher_cls, fetcher_cls())
+        nshows += len(ingest._parse_page(fetcher, html)[0])
+    return nshows
+
+
+@pytest.mark.benchmark(group="parse scaling")
+def test_parse_in_process(benchmark, pages):
+    assert benchmark.pedantic(parse_in_process, args=(pages,), rounds=ROUNDS) > 0
+
+
+@pytest.mark.benchmark(group="parse scaling")
+@pytest.mark.parametrize("workers", [1, 2, 4])
+def test_parse_in_pool(benchmark, pages, workers):
+    expected = parse_in_process(pages)
+
+    with ingest.parse_pool(workers) as pool:
+        # Start the processes before timing
+        list(pool.map(abs, range(workers)))
+
+        def parse():
+            futures = [
+                pool.submit(ingest._parse_page_remote, fetcher_cls, html)
+                for fetcher_cls, html in pages
+            ]
+            return sum(len(future.result()[0]) for future in futures)
+
+        assert benchmark.pedantic(parse, rounds=ROUNDS) == expected
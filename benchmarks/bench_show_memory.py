@@ -0,0 +1,69 @@
+# pylint: disable=missing-function-docstring
+"""
+Shows held as `Show` records rather than dicts
+
+Times building a record for each show extracted from the recorded pages, both
+as the dicts the fetchers used to yield and as `Show` records, and notes the
+memory each takes, measured with `tracemalloc`, and their size when pickled,
+as sent back from parse processes.
+"""
+import pickle
+import tracemalloc
+import pytest
+from whatson import ingest
+from whatson.models import Show
+
+
+def as_dict(show):
+    return {
+        "title": show.title,
+        "image_url": show.image_url,
+        "link_url": show.link_url,
+        "start_date": show.start_date,
+        "end_date": show.end_date,
+    }
+
+
+def as_show(show):
+    return Show(
+        title=show.title,
+        image_url=show.image_url,
+        link_url=show.link_url,
+        start_date=show.start_date,
+        end_date=show.end_date,
+    )
+
+
+@pytest.fixture(scope="module")
+def shows(recorded_pages):
+    shows = []
+    for _, fetcher_cls, html in recorded_pages:
+        shows.extend(ingest._parse_page(fetcher_cls(), html)[0])
+    return shows
+
+
+def allocated(build, shows):
+    """The bytes allocated by building a record from each of `shows`"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        records = [build(show) for show in shows]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    assert len(records) == len(shows)
+    return sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+
+@pytest.mark.benchmark(group="show records")
+@pytest.mark.parametrize("build", [as_dict, as_show], ids=["dict", "Show"])
+def test_build_records(benchmark, shows, build):
+    records = benchmark(lambda: [build(show) for show in shows])
+
+    benchmark.extra_info["bytes_per_show"] = allocated(build, shows) / len(shows)
+    benchmark.extra_info["pickled_bytes"] = len(pickle.dumps(records))
+
+
+def test_show_smaller_than_dict(shows):
+    assert allocated(as_show, shows) < allocated(as_dict, shows)
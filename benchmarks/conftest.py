@@ -0,0 +1,64 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import os
+import psycopg2
+from psycopg2.extras import RealDictCursor
+import pytest
+from whatson import ingest
+from whatson.db import reset_database
+from parsing import fetcher_for
+from seed import seed_shows
+
+RESPONSES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "testing", "responses"
+)
+
+
+# Every recorded page, by file name
+PAGE_NAMES = sorted(name for name in os.listdir(RESPONSES) if name.endswith(".html"))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def recorded_year():
+    # Dates without a year are assumed to be in the current year, so parse the
+    # recorded pages as if it were still the year they were saved. Session
+    # fixtures which parse the pages need this too, so it cannot be undone
+    # between tests with `monkeypatch`.
+    current_year = ingest.CURRENT_YEAR
+    ingest.CURRENT_YEAR = 2020
+    yield
+    ingest.CURRENT_YEAR = current_year
+
+
+@pytest.fixture(scope="session")
+def read_response():
+    def read(name):
+        with open(os.path.join(RESPONSES, name)) as infile:
+            return infile.read()
+
+    return read
+
+
+@pytest.fixture(scope="session")
+def recorded_pages(read_response):
+    """The file name, fetcher class and HTML of every recorded page"""
+    return [(name, fetcher_for(name), read_response(name)) for name in PAGE_NAMES]
+
+
+@pytest.fixture(
+    scope="module", params=[1000, 100000, 1000000], ids=["1k", "100k", "1M"]
+)
+def seeded_connection(request):
+    """A connection to `BENCHMARK_DATABASE_URL`, holding `request.param` shows.
+    The database is reset first, so do not point this at anything important.
+    """
+    url = os.getenv("BENCHMARK_DATABASE_URL")
+    if not url:
+        pytest.skip("no BENCHMARK_DATABASE_URL specified in environment")
+
+    conn = psycopg2.connect(url, cursor_factory=RealDictCursor)
+    reset_database(conn)
+    seed_shows(conn, request.param)
+    try:
+        yield conn
+    finally:
+        conn.close()
@@ -0,0 +1,138 @@
+"""
+Benchmark the `/api/shows` month query
+
+Seeds a scratch database (pointed to by `BENCHMARK_DATABASE_URL`) with
+synthetic shows, then prints the query plan and latency of the old
+`total_months` query, the date range overlap query, and the `show_months` join
+now used by the webapp.
+
+    BENCHMARK_DATABASE_URL=postgres://... python benchmarks/month_query.py --rows 100000
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import time
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from whatson.db import reset_database
+from seed import seed_shows
+
+OLD_QUERY = """SELECT * FROM shows
+    WHERE total_months(start_date) <= total_months(%(date_ref)s)
+    AND total_months(end_date) >= total_months(%(date_ref)s)
+    ORDER BY start_date ASC
+    """
+
+RANGE_QUERY = """SELECT * FROM shows
+    WHERE start_date < %(next_month)s
+    AND end_date >= %(month_start)s
+    ORDER BY start_date ASC
+    """
+
+SHOW_MONTHS_QUERY = """SELECT shows.* FROM show_months
+    JOIN shows ON shows.id = show_months.show_id
+    WHERE show_months.year = %(year)s
+    AND show_months.month = %(month)s
+    ORDER BY shows.start_date ASC
+    """
+
+
+def month_bounds(year, month):
+    """Return the first day of the given month, and the first day of the
+    following month, for querying shows running in that month
+    """
+    start = datetime.date(year, month, 1)
+    if month == 12:
+        end = datetime.date(year + 1, 1, 1)
+    else:
+        end = datetime.date(year, month + 1, 1)
+    return start, end
+
+
+def create_range_index(conn):
+    """The date range overlap query needs an index on the dates, which the
+    schema no longer creates as the webapp looks shows up by month instead
+    """
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS _idx_shows_start_date_end_date "
+                "ON shows (start_date, end_date)"
+            )
+
+
+def create_total_months(conn):
+    """The old query needs its helper function, which the schema no longer
+    creates
+    """
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """CREATE OR REPLACE FUNCTION total_months(date)
+                RETURNS int AS
+                    'select (extract(year from $1) * 12 + extract(month from $1))::int'
+                        language sql immutable
+                """
+            )
+
+
+def run(conn, name, query, params, iterations):
+    """Print the plan for `query`, then time `iterations` executions of it"""
+    with conn.cursor() as cursor:
+        cursor.execute("EXPLAIN ANALYZE " + query, params)
+        plan = "\n".join(row["QUERY PLAN"] for row in cursor.fetchall())
+
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            cursor.execute(query, params)
+            nrows = len(cursor.fetchall())
+            timings.append((time.perf_counter() - start) * 1000)
+
+    print(f"== {name} ({nrows} rows)")
+    print(plan)
+    print(
+        f"median {statistics.median(timings):.2f}ms, "
+        f"min {min(timings):.2f}ms, max {max(timings):.2f}ms"
+    )
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--year", type=int, default=2020)
+    parser.add_argument("--month", type=int, default=6)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        os.environ["BENCHMARK_DATABASE_URL"], cursor_factory=RealDictCursor
+    )
+    reset_database(conn)
+    seed_shows(conn, args.rows, first_date="DATE '2015-01-01'", days=3650)
+    create_total_months(conn)
+    create_range_index(conn)
+
+    month_start, next_month = month_bounds(args.year, args.month)
+    run(conn, "total_months", OLD_QUERY, {"date_ref": month_start}, args.iterations)
+    run(
+        conn,
+        "date range overlap",
+        RANGE_QUERY,
+        {"month_start": month_start, "next_month": next_month},
+        args.iterations,
+    )
+    run(
+        conn,
+        "show_months",
+        SHOW_MONTHS_QUERY,
+        {"year": args.year, "month": args.month},
+        args.iterations,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark HTML parsing of the recorded theatre pages
+
+Times building the whole page with BeautifulSoup against building only the
+parts each fetcher declares in `parse_only`, for every page under
+`testing/responses`.
+
+    python benchmarks/parsing.py
+"""
+
+import argparse
+import glob
+import os
+import timeit
+from bs4 import BeautifulSoup
+from whatson import ingest
+
+RESPONSES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "testing", "responses"
+)
+
+# Which fetcher parses each recorded page, by file name prefix
+FETCHERS = {
+    "albany": ingest.AlbanyFetcher,
+    "alex": ingest.AlexFetcher,
+    "arena_birmingham": ingest.ArenaBirminghamFetcher,
+    "artrix": ingest.ArtrixFetcher,
+    "arts_centre": ingest.WarwickArtsCentreFetcher,
+    "belgrade": ingest.BelgradeFetcher,
+    "hippodrome": ingest.HippodromeFetcher,
+    "resortsworld": ingest.ResortsWorldFetcher,
+    "symphony_hall": ingest.SymphonyHallFetcher,
+}
+
+
+def fetcher_for(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    for prefix, fetcher_cls in FETCHERS.items():
+        if name == prefix or name.startswith(prefix + "_"):
+            return fetcher_cls
+    raise ValueError(f"no fetcher for {path}")
+
+
+def best_of(fn, repeat, number):
+    return min(timeit.repeat(fn, repeat=repeat, number=number)) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'page':<24} {'full (ms)':>10} {'strained (ms)':>14} {'speedup':>8}")
+    for path in sorted(glob.glob(os.path.join(RESPONSES, "*.html"))):
+        with open(path) as infile:
+            html = infile.read()
+
+        fetcher = fetcher_for(path)()
+        full = best_of(lambda: BeautifulSoup(html, "lxml"), args.repeat, args.number)
+        strained = best_of(lambda: fetcher.parse(html), args.repeat, args.number)
+
+        name = os.path.basename(path)
+        print(f"{name:<24} {full:>10.2f} {strained:>14.2f} {full / strained:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Synthetic listings for the database benchmarks
+"""
+
+
+def seed_shows(conn, rows, first_date="CURRENT_DATE - 365", days=730, seed=0.5):
+    """Fill the `shows` table with `rows` shows starting at random over `days`
+    days from `first_date` (an SQL date expression), each running for up to
+    three months. The random numbers are seeded with `seed` (between -1 and 1),
+    so that every run benchmarks the same listings.
+    """
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT setseed(%s)", (seed,))
+            cursor.execute(
+                f"""INSERT INTO shows (theatre, title, image_url, link_url, start_date, end_date)
+                    SELECT
+                        'theatre ' || (i %% 50),
+                        'show ' || i,
+                        '',
+                        '',
+                        start_date,
+                        start_date + (random() * 90)::int
+                    FROM (
+                        SELECT i, {first_date} + (random() * %s)::int AS start_date
+                        FROM generate_series(1, %s) AS i
+                    ) AS series
+                    """,
+                (days, rows),
+            )
+            cursor.execute("ANALYZE shows")
+            cursor.execute("ANALYZE show_months")
@@ -2,12 +2,12 @@ module Main exposing (..)
 
 import Array
 import Browser
+import Dict exposing (Dict)
 import Html exposing (Html, a, div, h1, img, label, option, p, select, span, text)
 import Html.Attributes exposing (class, for, href, id, src, value)
 import Html.Events exposing (onInput)
 import Http
 import Json.Decode as D
-import Json.Encode as E
 import Set exposing (Set)
 
 
@@ -83,6 +83,7 @@ type alias Model =
     { availableMonths : List DateElement
     , selectedMonth : Maybe DateElement
     , shows : List Show
+    , season : Dict ( Int, Int ) Shows
     , sortSelection : SortSelection
     , theatres : Set String
     , filterTheatre : Maybe String
@@ -95,6 +96,7 @@ initModel =
     { availableMonths = []
     , selectedMonth = Nothing
     , shows = []
+    , season = Dict.empty
     , sortSelection = Date
     , theatres = Set.empty
     , filterTheatre = Nothing
@@ -121,19 +123,31 @@ compareDateElements a b =
             compare a.month b.month
 
 
+type alias MonthShows =
+    { date : DateElement
+    , shows : Shows
+    }
+
+
 init : () -> ( Model, Cmd Msg )
 init _ =
+    -- Load the shows for every month up front, so that choosing a month does
+    -- not need another request
     ( initModel
     , Http.get
-        { url = "/api/months"
-        , expect = Http.expectJson GotMonths monthsDecoder
+        { url = "/api/season"
+        , expect = Http.expectJson GotSeason seasonDecoder
         }
     )
 
 
-monthsDecoder : D.Decoder (List DateElement)
-monthsDecoder =
-    D.field "dates" (D.list decodeDateElement)
+seasonDecoder : D.Decoder (List MonthShows)
+seasonDecoder =
+    D.field "months" <|
+        D.list <|
+            D.map2 MonthShows
+                decodeDateElement
+                (D.field "shows" <| D.list showDecoder)
 
 
 decodeDateElement : D.Decoder DateElement
@@ -144,7 +158,7 @@ decodeDateElement =
 
 
 type Msg
-    = GotMonths (Result Http.Error (List DateElement))
+    = GotSeason (Result Http.Error (List MonthShows))
     | GotShows (Result Http.Error Shows)
     | SelectedMonth String
     | SelectedSort SortSelection
@@ -173,10 +187,21 @@ httpErrorToString e =
 update : Msg -> Model -> ( Model, Cmd Msg )
 update msg model =
     case msg of
-        GotMonths response ->
+        GotSeason response ->
             case response of
                 Ok months ->
-                    ( { model | availableMonths = List.sortWith compareDateElements months }, Cmd.none )
+                    let
+                        season =
+                            months
+                                |> List.map (\m -> ( ( m.date.year, m.date.month ), m.shows ))
+                                |> Dict.fromList
+                    in
+                    ( { model
+                        | availableMonths = List.sortWith compareDateElements <| List.map .date months
+                        , season = season
+                      }
+                    , Cmd.none
+                    )
 
                 Err e ->
                     ( { model | error = Just <| httpErrorToString e }, Cmd.none )
@@ -184,12 +209,7 @@ update msg model =
         GotShows response ->
             case response of
                 Ok shows ->
-                    let
-                        theatres =
-                            List.map .theatre shows
-                                |> Set.fromList
-                    in
-                    ( { model | shows = shows, theatres = theatres }, Cmd.none )
+                    ( withShows shows model, Cmd.none )
 
                 Err e ->
                     ( { model | error = Just <| httpErrorToString e }, Cmd.none )
@@ -207,7 +227,12 @@ update msg model =
                             newModel =
                                 { model | selectedMonth = selected }
                         in
-                        ( newModel, fetchShows newModel )
+                        case Maybe.andThen (\m -> Dict.get ( m.year, m.month ) model.season) selected of
+                            Just shows ->
+                                ( withShows shows newModel, Cmd.none )
+
+                            Nothing ->
+                                ( newModel, fetchShows newModel )
                     )
                 |> Maybe.withDefault ( model, Cmd.none )
 
@@ -218,25 +243,31 @@ update msg model =
             ( { model | filterTheatre = selectedTheatre }, Cmd.none )
 
 
-bodyFromModel : Model -> E.Value
-bodyFromModel model =
+withShows : Shows -> Model -> Model
+withShows shows model =
+    let
+        theatres =
+            List.map .theatre shows
+                |> Set.fromList
+    in
+    { model | shows = shows, theatres = theatres }
+
+
+queryFromModel : Model -> String
+queryFromModel model =
     model.selectedMonth
         |> Maybe.map
             (\m ->
-                E.object
-                    [ ( "year", E.int m.year )
-                    , ( "month", E.int m.month )
-                    ]
+                "?year=" ++ String.fromInt m.year ++ "&month=" ++ String.fromInt m.month
             )
-        |> Maybe.withDefault E.null
+        |> Maybe.withDefault ""
 
 
 fetchShows : Model -> Cmd Msg
 fetchShows model =
-    Http.post
-        { url = "/api/shows"
+    Http.get
+        { url = "/api/shows" ++ queryFromModel model
         , expect = Http.expectJson GotShows showsDecoder
-        , body = Http.jsonBody <| bodyFromModel model
         }
 
 
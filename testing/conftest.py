@@ -2,6 +2,9 @@ import pytest
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from whatson.db import reset_database
 import dotenv
 
@@ -31,3 +34,53 @@ def connection(dburl):
 def cursor(connection):
     cursor = connection.cursor()
     yield cursor
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Stand-in theatre site. `/flaky/<n>` fails `n` times before succeeding,
+    `/slow` takes a second to respond, and anything else succeeds after a
+    short delay.
+    """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            failures = server.requests.count(self.path)
+
+        try:
+            if self.path.startswith("/flaky/") and failures <= int(self.path[7:]):
+                self.send_response(503)
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                return
+
+            time.sleep(1 if self.path == "/slow" else 0.05)
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"ok")
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.in_flight = 0
+    httpd.max_in_flight = 0
+
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
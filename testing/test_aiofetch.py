@@ -0,0 +1,49 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import asyncio
+import pytest
+from whatson.scheduler import FetchPolicy, Scheduler
+
+pytest.importorskip("aiohttp")
+
+from whatson.aiofetch import AsyncClient  # pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def client():
+    client = AsyncClient(Scheduler(FetchPolicy(rate=1000, retries=3, backoff=0.01)))
+    try:
+        yield client
+    finally:
+        client.close()
+
+
+def test_fetch_retries_server_errors(server, client):
+    httpd, url = server
+
+    page = client.fetch(f"{url}/flaky/2")
+
+    assert page.body == "ok"
+    assert httpd.requests == ["/flaky/2"] * 3
+
+
+def test_fetches_many_pages_within_host_limits(server, client):
+    httpd, url = server
+    client.scheduler.configure(url, FetchPolicy(concurrency=3, rate=1000))
+
+    async def fetch_all():
+        return await asyncio.gather(
+            *(client.fetch_html(f"{url}/{i}") for i in range(9))
+        )
+
+    bodies = asyncio.run_coroutine_threadsafe(fetch_all(), client.loop).result()
+
+    assert bodies == ["ok"] * 9
+    assert httpd.max_in_flight == 3
+
+
+def test_submit_from_threads(server, client):
+    _, url = server
+
+    futures = [client.submit(f"{url}/{i}") for i in range(4)]
+
+    assert [future.result() for future in futures] == ["ok"] * 4
@@ -0,0 +1,65 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import threading
+import pytest
+from whatson.browser import BrowserPool
+
+
+class FakeDriver:
+    def __init__(self):
+        self.quit_called = False
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_pool_reuses_browsers():
+    pool = BrowserPool(size=2, factory=FakeDriver)
+
+    with pool.driver() as first:
+        pass
+    with pool.driver() as second:
+        pass
+
+    assert first is second
+
+
+def test_pool_runs_browsers_concurrently_up_to_size():
+    pool = BrowserPool(size=2, factory=FakeDriver)
+    started = threading.Barrier(2, timeout=5)
+    drivers = []
+
+    def use():
+        with pool.driver() as driver:
+            drivers.append(driver)
+            started.wait()
+
+    threads = [threading.Thread(target=use) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(map(id, drivers))) == 2
+
+
+def test_pool_discards_failed_browsers():
+    pool = BrowserPool(size=1, factory=FakeDriver)
+
+    with pytest.raises(RuntimeError):
+        with pool.driver() as broken:
+            raise RuntimeError("browser crashed")
+
+    with pool.driver() as replacement:
+        pass
+
+    assert broken.quit_called
+    assert replacement is not broken
+
+
+def test_pool_shutdown_quits_browsers():
+    pool = BrowserPool(size=1, factory=FakeDriver)
+    with pool.driver() as driver:
+        pass
+
+    pool.shutdown()
+    assert driver.quit_called
@@ -0,0 +1,67 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+from whatson.cache import DataVersion, LRUCache, ResponseCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    # Touch "a" so that "b" becomes the oldest entry
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(maxsize=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_response_cache_drops_entries_from_old_versions():
+    store = LRUCache()
+    cache = ResponseCache(store)
+    cache.set(1, ("shows", 2020, 1), b"old")
+    assert cache.get(1, ("shows", 2020, 1)) == b"old"
+
+    assert cache.get(2, ("shows", 2020, 1)) is None
+    assert len(store) == 0
+
+
+def test_data_version_reloads_after_ttl():
+    versions = iter([(1, None), (2, None)])
+    data_version = DataVersion(lambda: next(versions), ttl=60)
+
+    assert data_version.current() == (1, None)
+    assert data_version.current() == (1, None)
+
+    data_version.ttl = 0
+    assert data_version.current() == (2, None)
+
+
+def test_shared_response_cache_is_not_cleared():
+    store = LRUCache()
+    cache = ResponseCache(store, shared=True)
+    cache.set(1, ("shows", 2020, 1), b"old")
+
+    # Another process may still be serving version 1
+    assert cache.get(2, ("shows", 2020, 1)) is None
+    assert store.get((1, "shows", 2020, 1)) == b"old"
+
+
+def test_data_version_serves_old_version_while_reloading():
+    data_version = DataVersion(lambda: (1, None), ttl=0)
+    assert data_version.current() == (1, None)
+
+    def loader():
+        # A request arriving mid-reload gets the version already loaded
+        assert data_version.current() == (1, None)
+        return (2, None)
+
+    data_version.loader = loader
+    assert data_version.current() == (2, None)
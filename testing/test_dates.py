@@ -0,0 +1,73 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import datetime
+import pytest
+from whatson.dates import DateParser, DateParts
+
+D = datetime.date
+
+
+def test_parts():
+    parser = DateParser("%a %d %b %Y", "%a %d %b", "%d %m")
+
+    assert parser.parts("Thurs 2nd Jan 2020") == DateParts(2, 1, 2020)
+    assert parser.parts(" tuesday  7 january ") == DateParts(7, 1, None)
+    assert parser.parts("7 1") == DateParts(7, 1, None)
+    with pytest.raises(ValueError):
+        parser.parts("Tue 7 Smarch")
+    with pytest.raises(ValueError):
+        parser.parts("7 January 2020")
+
+
+def test_parts_cached():
+    parser = DateParser("%d %B %Y")
+
+    assert parser.parts("1 May 2020") is parser.parts("1 May 2020")
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            parser.parts("May 2020")
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    [
+        ("16 - 19 January 2020", (D(2020, 1, 16), D(2020, 1, 19))),
+        ("30 April - 3 May 2020", (D(2020, 4, 30), D(2020, 5, 3))),
+        ("28 December - 4 January 2020", (D(2019, 12, 28), D(2020, 1, 4))),
+        ("1 May 2019 - 4 January 2020", (D(2019, 5, 1), D(2020, 1, 4))),
+        ("4 June", (D(2021, 6, 4), D(2021, 6, 4))),
+        ("20 December - 4 January", (D(2021, 12, 20), D(2022, 1, 4))),
+        ("20 December 2020 - 4 January", (D(2020, 12, 20), D(2021, 1, 4))),
+        ("29 February - 1 March 2020", (D(2020, 2, 29), D(2020, 3, 1))),
+    ],
+)
+def test_parse_range(text, expected):
+    parser = DateParser("%d %B %Y", "%d %B", "%d")
+    assert parser.parse_range(text, 2021) == expected
+
+
+def test_parse_range_separators():
+    parser = DateParser("%a %d %b %Y", "%a %d %b", separators="-&")
+
+    assert parser.parse_range("Fri 3 Jan & Sat 4 Jan 2020", 2021) == (
+        D(2020, 1, 3),
+        D(2020, 1, 4),
+    )
+    assert parser.parse("Fri 3 Jan", 2020) == D(2020, 1, 3)
+    with pytest.raises(ValueError):
+        parser.parse_range("Fri 3 Jan - Sat 4", 2020)
+
+
+def test_year_from_weekday():
+    parser = DateParser("%a %d %b %Y", "%a %d %b")
+
+    assert parser.parse("Sat 2 Jan", 2020) == D(2021, 1, 2)
+    assert parser.parse("Fri 3 Jan", 2021) == D(2020, 1, 3)
+    assert parser.parse_range("Thu 31 Dec - Sat 2 Jan", 2021) == (
+        D(2020, 12, 31),
+        D(2021, 1, 2),
+    )
+
+    # A weekday which fits none of the years is ignored
+    assert parser.parse("Mon 2 Jan", 2020) == D(2020, 1, 2)
+    with pytest.raises(ValueError):
+        parser.parse("Sat 29 Feb", 2026)
@@ -0,0 +1,117 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import datetime
+import os
+import pytest
+from whatson.db import (
+    OLD,
+    ConnectionPool,
+    create_shadow_tables,
+    drop_tables,
+    migrate_database,
+    rollback_shadow_tables,
+    swap_shadow_tables,
+)
+from whatson.ingest import upload_shows
+from whatson.models import Show
+
+
+@pytest.fixture
+def pool(dburl):
+    pool = ConnectionPool(os.getenv("TEST_DATABASE_URL"), maxconn=2)
+    try:
+        yield pool
+    finally:
+        pool.closeall()
+
+
+def test_pool_checks_out_a_connection_per_block(pool):
+    with pool as outer:
+        with pool as inner:
+            assert outer is not inner
+
+
+def test_pool_replaces_broken_connections(pool):
+    with pytest.raises(Exception):
+        with pool as conn:
+            conn.close()
+            conn.cursor()
+
+    with pool as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 AS one")
+        assert cursor.fetchone()["one"] == 1
+
+
+def _show(title):
+    return Show(title, "", "", datetime.date(2020, 1, 1), datetime.date(2020, 2, 1))
+
+
+def _listed(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """SELECT DISTINCT shows.title FROM shows
+                JOIN show_months ON show_months.show_id = shows.id
+                ORDER BY shows.title"""
+        )
+        return [row["title"] for row in cursor.fetchall()]
+
+
+def test_swap_shadow_tables(connection):
+    upload_shows(connection, "swap", [_show("old")])
+
+    create_shadow_tables(connection)
+    upload_shows(connection, "swap", [_show("new")], table="shows_next")
+
+    # The rebuild is invisible until swapped in
+    assert _listed(connection) == ["old"]
+    swap_shadow_tables(connection)
+    assert _listed(connection) == ["new"]
+
+    # Writes after the swap keep the months table up to date
+    upload_shows(connection, "swap", [_show("new"), _show("newer")])
+    assert _listed(connection) == ["new", "newer"]
+
+    rollback_shadow_tables(connection)
+    assert _listed(connection) == ["old"]
+
+    # A second rebuild can reuse the same names
+    create_shadow_tables(connection)
+    swap_shadow_tables(connection)
+    assert _listed(connection) == []
+
+
+def test_rollback_without_rebuild(connection):
+    with connection:
+        drop_tables(connection.cursor(), OLD)
+
+    with pytest.raises(RuntimeError):
+        rollback_shadow_tables(connection)
+
+
+def test_migrate_database(connection):
+    upload_shows(connection, "migrate", [_show("listed")])
+
+    # The schema from before shows were indexed by month or had change tracking
+    with connection:
+        cursor = connection.cursor()
+        cursor.execute("DROP TRIGGER _trg_shows_show_months ON shows")
+        cursor.execute("DROP TABLE show_months")
+        cursor.execute("DROP TABLE data_version")
+        cursor.execute(
+            """ALTER TABLE shows
+                DROP COLUMN content_hash,
+                DROP COLUMN updated_at,
+                DROP COLUMN gone_at"""
+        )
+        cursor.execute("CREATE INDEX _idx_shows_end_date ON shows (end_date)")
+
+    migrate_database(connection)
+    assert _listed(connection) == ["listed"]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('_idx_shows_end_date') AS index")
+        assert cursor.fetchone()["index"] is None
+
+    # Running it again changes nothing
+    migrate_database(connection)
+    assert _listed(connection) == ["listed"]
+    assert upload_shows(connection, "migrate", [_show("listed")]).updated == 1
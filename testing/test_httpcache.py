@@ -0,0 +1,58 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+from whatson import httpcache
+
+
+class FakeResponse:
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        assert self.status_code < 400
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append((url, headers))
+        return self.responses.pop(0)
+
+
+def test_fetch_revalidates_cached_page(tmp_path):
+    cache = httpcache.HTTPCache(str(tmp_path))
+    session = FakeSession(
+        FakeResponse(200, "<html></html>", {"ETag": '"abc"'}), FakeResponse(304)
+    )
+
+    first = httpcache.fetch(session, "http://example.com", cache)
+    second = httpcache.fetch(session, "http://example.com", cache)
+
+    assert session.requests[1][1] == {"If-None-Match": '"abc"'}
+    assert second.body == "<html></html>"
+    assert second.digest == first.digest
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = httpcache.HTTPCache(str(tmp_path), max_bytes=600)
+    cache.put("http://example.com/1", "a" * 200)
+    cache.put("http://example.com/2", "b" * 200)
+    cache.put("http://example.com/3", "c" * 200)
+
+    assert cache.get("http://example.com/1") is None
+    assert cache.get("http://example.com/3").body == "c" * 200
+
+
+def test_fingerprints_persist(tmp_path):
+    httpcache.HTTPCache(str(tmp_path)).set_fingerprint("Albany", "abc")
+    assert httpcache.HTTPCache(str(tmp_path)).fingerprint("Albany") == "abc"
+
+
+def test_clear_fingerprints(tmp_path):
+    cache = httpcache.HTTPCache(str(tmp_path))
+    cache.set_fingerprint("Albany", "abc")
+    cache.clear_fingerprints()
+    assert cache.fingerprint("Albany") is None
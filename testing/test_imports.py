@@ -0,0 +1,53 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Generous ceiling on the cumulative import time of each entry point module,
+# to catch accidental heavyweight imports (e.g. selenium) creeping back in
+IMPORT_TIME_BUDGET_US = 1_500_000
+
+
+def _run_python(*args):
+    # Point at a database which cannot exist, so that anything trying to
+    # connect at import time fails loudly
+    env = dict(os.environ, DATABASE_URL="postgresql://nonexistent.invalid/whatson")
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+
+def _cumulative_import_time(stderr, module):
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative)
+
+    raise ValueError(f"no import time recorded for {module}")
+
+
+@pytest.mark.parametrize("module", ["whatson.ingest", "whatson.webapp", "whatson.wsgi"])
+def test_import_does_not_connect(module, record_property):
+    result = _run_python("-X", "importtime", "-c", f"import {module}")
+    assert result.returncode == 0, result.stderr
+
+    import_time = _cumulative_import_time(result.stderr, module)
+    record_property("import_time_us", import_time)
+    assert import_time < IMPORT_TIME_BUDGET_US
+
+
+def test_ingest_help_does_not_connect():
+    result = _run_python("-c", "from whatson.ingest import main; main()", "--help")
+    assert result.returncode == 0, result.stderr
+    assert "--workers" in result.stdout
@@ -1,6 +1,13 @@
-from whatson import ingest
+from whatson import httpcache, ingest, metrics
+from whatson.db import create_shadow_tables
+from whatson.models import Show
+from whatson.scheduler import FetchPolicy
 from unittest import mock
+from concurrent.futures import Future
+import argparse
 import datetime
+import time
+import pytest
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
@@ -12,8 +19,8 @@ def test_albany(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 29
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 1)
-    assert shows[-1]["title"] == "The Mersey Beatles 2020"
+    assert shows[0].start_date == datetime.date(2020, 1, 1)
+    assert shows[-1].title == "The Mersey Beatles 2020"
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
@@ -25,13 +32,24 @@ def test_belgrade(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 66
-    assert shows[0]["start_date"] == datetime.date(2019, 11, 27)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 11)
-    assert shows[0]["title"] == "Puss In Boots"
+    assert shows[0].start_date == datetime.date(2019, 11, 27)
+    assert shows[0].end_date == datetime.date(2020, 1, 11)
+    assert shows[0].title == "Puss In Boots"
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 11, 25)
-    assert shows[-1]["end_date"] == datetime.date(2021, 1, 9)
-    assert shows[-1]["title"] == "Beauty and the Beast"
+    assert shows[-1].start_date == datetime.date(2020, 11, 25)
+    assert shows[-1].end_date == datetime.date(2021, 1, 9)
+    assert shows[-1].title == "Beauty and the Beast"
+
+
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_belgrade_skips_undated_shows(client):
+    with open("testing/responses/belgrade.html") as infile:
+        client.return_value = infile.read().replace(
+            "18th January - 25th January", "Coming soon"
+        )
+
+    # Only the show without dates is lost, not the theatre
+    assert len(list(ingest.BelgradeFetcher().fetch())) == 65
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
@@ -48,17 +66,19 @@ def test_symphony_hall(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 24
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 5)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 12)
-    assert shows[0]["title"] == "We're Going On A Bear Hunt"
+    assert shows[0].start_date == datetime.date(2020, 1, 5)
+    assert shows[0].end_date == datetime.date(2020, 1, 12)
+    assert shows[0].title == "We're Going On A Bear Hunt"
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 1, 28)
-    assert shows[-1]["end_date"] == datetime.date(2020, 1, 28)
-    assert shows[-1]["title"] == "Echo Eternal Youth Arts Festival 2020: Horizons"
+    assert shows[-1].start_date == datetime.date(2020, 1, 28)
+    assert shows[-1].end_date == datetime.date(2020, 1, 28)
+    assert shows[-1].title == "Echo Eternal Youth Arts Festival 2020: Horizons"
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
-def test_hippodrome(client):
+def test_hippodrome(client, monkeypatch):
+    # The pages were saved in 2020, and give dates without a year
+    monkeypatch.setattr(ingest, "CURRENT_YEAR", 2020)
     with open("testing/responses/hippodrome_1.html") as infile:
         resp1 = infile.read()
 
@@ -71,17 +91,32 @@ def test_hippodrome(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 32
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 5)
-    assert shows[0]["end_date"] == datetime.date(2020, 2, 2)
-    assert shows[0]["title"] == "Snow White & the Seven Dwarfs"
+    assert shows[0].start_date == datetime.date(2020, 1, 5)
+    assert shows[0].end_date == datetime.date(2020, 2, 2)
+    assert shows[0].title == "Snow White & the Seven Dwarfs"
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 3, 27)
-    assert shows[-1]["end_date"] == datetime.date(2020, 3, 28)
-    assert shows[-1]["title"] == "DX - Mariposa"
+    assert shows[-1].start_date == datetime.date(2020, 3, 27)
+    assert shows[-1].end_date == datetime.date(2020, 3, 28)
+    assert shows[-1].title == "DX - Mariposa"
+
+
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_hippodrome_skips_impossible_dates(client, monkeypatch):
+    # There is no "Sat 29 Feb" in or either side of 2026, so that show is
+    # skipped, rather than the theatre failing
+    monkeypatch.setattr(ingest, "CURRENT_YEAR", 2026)
+    pages = []
+    for page in range(1, 3):
+        with open(f"testing/responses/hippodrome_{page}.html") as infile:
+            pages.append(infile.read())
+    client.side_effect = pages
+
+    assert len(list(ingest.HippodromeFetcher().fetch())) == 31
 
 
 @mock.patch("whatson.ingest._fetch_html_selenium")
-def test_resortsworld(client):
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_resortsworld(client, browser):
     with open("testing/responses/resortsworld.html") as infile:
         client.return_value = infile.read()
 
@@ -89,21 +124,41 @@ def test_resortsworld(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 28
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 31)
-    assert shows[0]["end_date"] == datetime.date(2020, 2, 1)
-    assert shows[0]["title"] == "The Arenacross Tour 2020"
+    assert shows[0].start_date == datetime.date(2020, 1, 31)
+    assert shows[0].end_date == datetime.date(2020, 2, 1)
+    assert shows[0].title == "The Arenacross Tour 2020"
     assert (
-        shows[0]["image_url"]
+        shows[0].image_url
         == "https://d1t1vb5tk5g2b3.cloudfront.net/media/1655/arenacross-2020-arenas.jpg?anchor=center&mode=crop&width=537&height=294&rnd=132185532740000000&quality=60"
     )
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 11, 21)
-    assert shows[-1]["end_date"] == datetime.date(2020, 11, 21)
-    assert shows[-1]["title"] == "Free Radio Hits Live 2020"
+    assert shows[-1].start_date == datetime.date(2020, 11, 21)
+    assert shows[-1].end_date == datetime.date(2020, 11, 21)
+    assert shows[-1].title == "Free Radio Hits Live 2020"
+
+    # The listings were read from the embedded JSON
+    browser.assert_not_called()
+
+
+@mock.patch("whatson.ingest._fetch_html_selenium")
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_resortsworld_without_embedded_json(client, browser):
+    client.return_value = "<html><body></body></html>"
+    with open("testing/responses/resortsworld.html") as infile:
+        browser.return_value = infile.read()
+
+    fetcher = ingest.ResortsWorldFetcher()
+    shows = list(fetcher.fetch())
+
+    browser.assert_called_once()
+    assert len(shows) == 28
+    assert shows[0].title == "The Arenacross Tour 2020"
+    assert shows[-1].title == "Free Radio Hits Live 2020"
 
 
 @mock.patch("whatson.ingest._fetch_html_selenium")
-def test_arena_bham(client):
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_arena_bham(client, browser):
     with open("testing/responses/arena_birmingham.html") as infile:
         client.return_value = infile.read()
 
@@ -111,21 +166,26 @@ def test_arena_bham(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 61
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 16)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 19)
-    assert shows[0]["title"] == "Strictly Come Dancing The Live Tour 2020"
+    assert shows[0].start_date == datetime.date(2020, 1, 16)
+    assert shows[0].end_date == datetime.date(2020, 1, 19)
+    assert shows[0].title == "Strictly Come Dancing The Live Tour 2020"
     assert (
-        shows[0]["image_url"]
+        shows[0].image_url
         == "https://d38sswc4c2k2dz.cloudfront.net/media/1815/scd-lineup-arenas.jpg?anchor=center&mode=crop&width=537&height=294&rnd=132197819540000000&quality=60"
     )
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 12, 11)
-    assert shows[-1]["end_date"] == datetime.date(2020, 12, 11)
-    assert shows[-1]["title"] == "Il Divo"
+    assert shows[-1].start_date == datetime.date(2020, 12, 11)
+    assert shows[-1].end_date == datetime.date(2020, 12, 11)
+    assert shows[-1].title == "Il Divo"
+    assert shows[-1].link_url == "https://www.arenabham.co.uk/whats-on/il-divo/"
+
+    browser.assert_not_called()
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
-def test_artrix(client):
+def test_artrix(client, monkeypatch):
+    # The pages were saved in 2020, and give dates without a year
+    monkeypatch.setattr(ingest, "CURRENT_YEAR", 2020)
     with open("testing/responses/artrix_1.html") as infile:
         resp1 = infile.read()
 
@@ -135,19 +195,22 @@ def test_artrix(client):
     with open("testing/responses/artrix_3.html") as infile:
         resp3 = infile.read()
 
-    client.side_effect = [resp1, resp2, resp3]
+    # Pages are fetched concurrently, so respond by url rather than call order.
+    # The third page is empty, as is every page after it.
+    pages = {"page=1": resp1, "page=2": resp2}
+    client.side_effect = lambda url: pages.get(url.split("?")[1], resp3)
 
     fetcher = ingest.ArtrixFetcher()
     shows = list(fetcher.fetch())
 
     assert len(shows) == 32
-    assert shows[0]["start_date"] == datetime.date(2019, 11, 5)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 5)
-    assert shows[0]["title"] == "KATHLEEN WATSON AND LYNNE SAWYER  - INSPIRE BY NATURE"
+    assert shows[0].start_date == datetime.date(2019, 11, 5)
+    assert shows[0].end_date == datetime.date(2020, 1, 5)
+    assert shows[0].title == "KATHLEEN WATSON AND LYNNE SAWYER  - INSPIRE BY NATURE"
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 1, 18)
-    assert shows[-1]["end_date"] == datetime.date(2020, 1, 18)
-    assert shows[-1]["title"] == "Polar Squad"
+    assert shows[-1].start_date == datetime.date(2020, 1, 18)
+    assert shows[-1].end_date == datetime.date(2020, 1, 18)
+    assert shows[-1].title == "Polar Squad"
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
@@ -159,13 +222,13 @@ def test_alex(client):
     shows = list(fetcher.fetch())
 
     assert len(shows) == 63
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 8)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 11)
-    assert shows[0]["title"] == "Ghost Stories"
+    assert shows[0].start_date == datetime.date(2020, 1, 8)
+    assert shows[0].end_date == datetime.date(2020, 1, 11)
+    assert shows[0].title == "Ghost Stories"
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 12, 8)
-    assert shows[-1]["end_date"] == datetime.date(2021, 1, 2)
-    assert shows[-1]["title"] == "Dreamgirls"
+    assert shows[-1].start_date == datetime.date(2020, 12, 8)
+    assert shows[-1].end_date == datetime.date(2021, 1, 2)
+    assert shows[-1].title == "Dreamgirls"
 
 
 @mock.patch("whatson.ingest._fetch_html_requests")
@@ -179,19 +242,312 @@ def test_arts_centre(client):
     with open("testing/responses/arts_centre_3.html") as infile:
         resp3 = infile.read()
 
-    client.side_effect = [resp1, resp2, resp3]
+    pages = {"start=0": resp1, "start=10": resp2}
+    client.side_effect = lambda url: pages.get(url.split("?")[1], resp3)
 
     fetcher = ingest.WarwickArtsCentreFetcher()
     shows = list(fetcher.fetch())
 
     assert len(shows) == 20
-    assert shows[0]["start_date"] == datetime.date(2020, 1, 9)
-    assert shows[0]["end_date"] == datetime.date(2020, 1, 12)
-    assert shows[0]["title"] == "Cinderella"
+    assert shows[0].start_date == datetime.date(2020, 1, 9)
+    assert shows[0].end_date == datetime.date(2020, 1, 12)
+    assert shows[0].title == "Cinderella"
 
-    assert shows[-1]["start_date"] == datetime.date(2020, 1, 26)
-    assert shows[-1]["end_date"] == datetime.date(2020, 1, 26)
+    assert shows[-1].start_date == datetime.date(2020, 1, 26)
+    assert shows[-1].end_date == datetime.date(2020, 1, 26)
     assert (
-        shows[-1]["title"]
+        shows[-1].title
         == "Warwick Masterclass 2020: Getting Creative with your Fancy Camera"
     )
+
+
+_SHOW = Show("show", "", "", datetime.date(2020, 1, 1), datetime.date(2020, 1, 1))
+
+
+class _FakeFetcher:
+    name = "Fake"
+    active = True
+
+    def fetch(self):
+        yield _SHOW
+
+
+class _BrokenFetcher:
+    name = "Broken"
+    active = True
+
+    def fetch(self):
+        raise ValueError("cannot parse page")
+
+
+class _InactiveFetcher(_FakeFetcher):
+    name = "Inactive"
+    active = False
+
+
+class _FetchOnlyFetcher(ingest.Fetcher):
+    name = "Fetch only"
+    root_url = url = "http://localhost/"
+    active = True
+
+    def fetch(self):
+        yield _SHOW
+
+
+# Not a real theatre, so keep it out of ingest
+ingest.Fetcher.fetchers.discard(_FetchOnlyFetcher)
+
+
+def test_pipeline_isolates_failures():
+    pipeline = ingest.Pipeline(workers=2)
+    results = {
+        result.name: result
+        for result in pipeline.run(
+            [_FakeFetcher, _BrokenFetcher, _InactiveFetcher, _FetchOnlyFetcher]
+        )
+    }
+
+    assert set(results) == {"Fake", "Broken", "Fetch only"}
+    assert results["Fake"].shows == [_SHOW]
+    assert results["Fake"].error is None
+    assert results["Fetch only"].shows == [_SHOW]
+    assert results["Broken"].shows == []
+    assert isinstance(results["Broken"].error, ValueError)
+    assert results["Broken"].elapsed >= 0
+
+
+class _PagedFetcher:
+    """Lists `npages` pages of two shows each, then empty pages"""
+
+    name = "Paged"
+    active = True
+    stop_on_empty_page = True
+    npages = 5
+    instances = []
+
+    def __init__(self):
+        self.instances.append(self)
+        self.fetched = 0
+        self.parsed = 0
+        self.max_unparsed = 0
+
+    def pages(self):
+        while True:
+            self.fetched += 1
+            self.max_unparsed = max(self.max_unparsed, self.fetched - self.parsed)
+            yield str(self.fetched)
+
+    def parse_page(self, html):
+        time.sleep(0.01)
+        self.parsed += 1
+        page = int(html)
+        if page > self.npages:
+            return
+        for i in range(2):
+            yield _SHOW._replace(title=f"show {page}.{i}")
+
+
+def test_pipeline_pages():
+    pipeline = ingest.Pipeline()
+    (result,) = list(pipeline.run([_PagedFetcher]))
+
+    assert result.error is None
+    assert [show.title for show in result.shows] == [
+        f"show {page}.{i}" for page in range(1, 6) for i in range(2)
+    ]
+
+    # The fetch stage is held back while pages wait to be parsed, so stops soon
+    # after the empty page at the end of the listings
+    (fetcher,) = _PagedFetcher.instances
+    assert fetcher.max_unparsed <= ingest.PREFETCH_PAGES + 1
+    assert fetcher.fetched <= 6 + ingest.PREFETCH_PAGES
+    assert pipeline.parsed.items >= 6
+    assert pipeline.fetched.items == fetcher.fetched
+
+
+@pytest.mark.parametrize("parse_workers", [0, 2])
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_pipeline_matches_fetch(client, parse_workers, monkeypatch):
+    # Parse processes must be given a year other than the current one
+    monkeypatch.setattr(ingest, "CURRENT_YEAR", 2020)
+    pages = {}
+    for page in range(1, 4):
+        with open(f"testing/responses/artrix_{page}.html") as infile:
+            pages[f"page={page}"] = infile.read()
+    client.side_effect = lambda url: pages.get(url.split("?")[1], pages["page=3"])
+
+    expected = list(ingest.ArtrixFetcher().fetch())
+    pipeline = ingest.Pipeline(parse_workers=parse_workers)
+    (result,) = list(pipeline.run([ingest.ArtrixFetcher]))
+
+    assert result.shows == expected
+    assert result.fingerprint == ingest._fingerprint(
+        [httpcache.digest(pages[f"page={page}"]) for page in range(1, 4)]
+    )
+    assert result.stats.counts["shows"] == len(expected)
+    assert result.stats.stages["parse"] > 0
+
+
+class _InvalidShowFetcher:
+    name = "Invalid"
+    active = True
+
+    def pages(self):
+        yield ""
+
+    def parse_page(self, html):
+        yield _SHOW._replace(title=" ")
+        yield _SHOW._replace(end_date=datetime.date(2019, 12, 31))
+        yield _SHOW
+
+
+def test_pipeline_skips_invalid_shows():
+    (result,) = list(ingest.Pipeline().run([_InvalidShowFetcher]))
+
+    assert result.error is None
+    assert result.shows == [_SHOW]
+    assert result.stats.counts["errors"] == 2
+
+
+class _FakeAsyncClient:
+    """Serves pages by the query string of their url"""
+
+    def __init__(self, pages, default):
+        self.pages = pages
+        self.default = default
+        self.urls = []
+
+    def _body(self, url):
+        self.urls.append(url)
+        return self.pages.get(url.partition("?")[2], self.default)
+
+    def fetch(self, url):
+        body = self._body(url)
+        return httpcache.CachedPage(url, body, httpcache.digest(body))
+
+    def submit(self, url):
+        future = Future()
+        future.set_result(self._body(url))
+        return future
+
+
+def test_async_client_adapter(monkeypatch):
+    with open("testing/responses/albany.html") as infile:
+        albany = infile.read()
+    pages = {}
+    for page in range(1, 4):
+        with open(f"testing/responses/artrix_{page}.html") as infile:
+            pages[f"page={page}"] = infile.read()
+
+    client = _FakeAsyncClient(pages, albany)
+    monkeypatch.setattr(ingest, "ASYNC_CLIENT", client)
+
+    # Single pages are fetched through the blocking adapter, and paginated
+    # listings are requested ahead on the client's loop
+    assert len(list(ingest.AlbanyFetcher().fetch())) == 29
+    assert len(list(ingest.ArtrixFetcher().fetch())) == 32
+    assert client.urls[0] == ingest.AlbanyFetcher.url
+    assert ingest.ArtrixFetcher.url + "?page=3" in client.urls
+
+
+def test_prefetch_reuses_sessions(server):
+    _, url = server
+    urls = [f"{url}/{page}" for page in range(3)]
+    ingest.close_clients()
+
+    # Every listing's pages are fetched by the same threads, and so sessions
+    for _ in range(2):
+        assert list(ingest._prefetch_pages(urls)) == ["ok"] * len(urls)
+        assert list(ingest._follow_pages(url, lambda html: None)) == ["ok"]
+    assert len(ingest._SESSIONS) <= ingest.PREFETCH_WORKERS
+
+    sessions = list(ingest._SESSIONS)
+    with mock.patch("requests.Session.close") as close:
+        ingest.close_clients()
+    assert close.call_count == len(sessions)
+    assert not ingest._SESSIONS
+
+
+def test_fetch_policy_configured_with_class():
+    policy = FetchPolicy(concurrency=1, rate=1.0)
+
+    class PoliteFetcher(ingest.Fetcher):
+        name = "Polite"
+        root_url = url = "http://polite.invalid/"
+        active = True
+        fetch_policy = policy
+
+    ingest.Fetcher.fetchers.discard(PoliteFetcher)
+    assert ingest.SCHEDULER.policy(PoliteFetcher.url) == policy
+
+    # Creating a fetcher, as every parse process does, leaves the policy alone
+    ingest.SCHEDULER.configure(PoliteFetcher.url, FetchPolicy())
+    PoliteFetcher()
+    assert ingest.SCHEDULER.policy(PoliteFetcher.url) == FetchPolicy()
+
+
+def test_rebuild_records_fingerprints_once_swapped(connection, tmp_path, monkeypatch):
+    cache = httpcache.HTTPCache(str(tmp_path))
+    monkeypatch.setattr(ingest, "HTTP_CACHE", cache)
+    monkeypatch.setattr(ingest, "DB", connection)
+    monkeypatch.setattr(ingest.Fetcher, "fetchers", {_FakeFetcher})
+    args = argparse.Namespace(workers=1, parse_workers=0, rebuild=True, reset=False)
+
+    # A rebuild which fails leaves the live shows, and their fingerprints
+    create_shadow_tables(connection)
+    with mock.patch("whatson.ingest.swap_shadow_tables", side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            ingest.run_ingest(args, metrics.RunReport())
+    assert cache.fingerprint(_FakeFetcher.name) is None
+
+    create_shadow_tables(connection)
+    ingest.run_ingest(args, metrics.RunReport())
+    assert cache.fingerprint(_FakeFetcher.name) is not None
+
+
+def test_upload_shows_upserts(connection):
+    show = Show(
+        title="Upload Test",
+        image_url="image.jpg",
+        link_url="link",
+        start_date=datetime.date(2020, 1, 1),
+        end_date=datetime.date(2020, 1, 2),
+    )
+    other = show._replace(title="Other Upload Test")
+
+    counts = ingest.upload_shows(connection, "upload", [show, other, show])
+    assert counts == ingest.UploadResult(inserted=2, updated=0, unchanged=0)
+
+    changed = show._replace(end_date=datetime.date(2020, 1, 3))
+    counts = ingest.upload_shows(connection, "upload", [changed, other])
+    assert counts == ingest.UploadResult(inserted=0, updated=1, unchanged=1)
+
+    # Shows missing from the listings are marked as gone, and brought back if
+    # they reappear
+    counts = ingest.upload_shows(connection, "upload", [changed])
+    assert counts == ingest.UploadResult(0, 0, 1, expired=1)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT title FROM shows WHERE theatre = 'upload' AND gone_at IS NULL"
+        )
+        assert [row["title"] for row in cursor.fetchall()] == ["Upload Test"]
+
+    counts = ingest.upload_shows(connection, "upload", [changed, other])
+    assert counts == ingest.UploadResult(inserted=0, updated=1, unchanged=1)
+
+    # An empty listing does not expire anything
+    counts = ingest.upload_shows(connection, "upload", [])
+    assert counts == ingest.UploadResult(0, 0, 0)
+
+
+def test_show_hash():
+    show = Show(
+        title="Hash Test",
+        image_url="image.jpg",
+        link_url="link",
+        start_date=datetime.date(2020, 1, 1),
+        end_date=datetime.date(2020, 1, 2),
+    )
+    assert ingest.show_hash(show) == ingest.show_hash(Show(*show))
+    assert ingest.show_hash(show) != ingest.show_hash(show._replace(link_url="other"))
@@ -0,0 +1,132 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import json
+import os
+from unittest import mock
+from whatson import ingest, metrics
+
+
+def test_stage_without_current_fetcher():
+    # Timing outside of a fetcher is a no-op
+    with metrics.stage("network"):
+        pass
+    metrics.count("pages")
+
+
+def test_stage_and_count():
+    stats = metrics.FetcherStats("Test")
+    token = metrics.CURRENT.set(stats)
+    try:
+        with metrics.stage("parse"):
+            pass
+        metrics.count("pages")
+        metrics.count("bytes", 100)
+    finally:
+        metrics.CURRENT.reset(token)
+
+    assert stats.stages["parse"] > 0
+    assert stats.stages["network"] == 0
+    assert stats.counts["pages"] == 1
+    assert stats.counts["bytes"] == 100
+
+
+@mock.patch("whatson.ingest._fetch_html_requests")
+def test_pipeline_stats(client):
+    with open("testing/responses/albany.html") as infile:
+        client.return_value = infile.read()
+
+    (result,) = list(ingest.Pipeline().run([ingest.AlbanyFetcher]))
+
+    stats = result.stats
+    assert stats.name == "Albany"
+    assert stats.counts["shows"] == len(result.shows)
+    assert stats.counts["errors"] == 0
+    assert stats.stages["parse"] > 0
+    assert stats.stages["dates"] > 0
+    assert stats.elapsed == result.elapsed
+
+
+def test_pipeline_counts_errors():
+    class Broken:  # pylint: disable=too-few-public-methods
+        name = "Broken"
+        active = True
+
+        def fetch(self):
+            raise RuntimeError("boom")
+
+    (result,) = list(ingest.Pipeline().run([Broken]))
+    assert result.stats.counts["errors"] == 1
+
+    # A fetcher run whole spends all of its time extracting
+    assert result.stats.elapsed > 0
+    assert abs(sum(result.stats.stages.values()) - result.stats.elapsed) < 1e-6
+
+
+def test_report_exports(tmp_path):
+    stats = metrics.FetcherStats('The "Albany"')
+    stats.add_time("network", 1.5)
+    stats.count("shows", 3)
+
+    parsed = metrics.Throughput("parse", "pages")
+    parsed.add(4)
+    parsed.busy = 2.0
+
+    report = metrics.RunReport()
+    report.add(stats)
+    report.add_stage(parsed)
+
+    report.write_json(tmp_path / "report.json")
+    with open(tmp_path / "report.json") as infile:
+        data = json.load(infile)
+    assert data["fetchers"][0]["stages"]["network"] == 1.5
+    assert data["fetchers"][0]["counts"]["shows"] == 3
+    assert data["pipeline"]["parse"]["rate"] == 2.0
+
+    report.write_prometheus(tmp_path / "whatson.prom")
+    with open(tmp_path / "whatson.prom") as infile:
+        text = infile.read()
+    assert (
+        'whatson_ingest_stage_seconds{theatre="The \\"Albany\\"",stage="network"} '
+        "1.500000"
+    ) in text
+    assert 'whatson_ingest_shows{theatre="The \\"Albany\\""} 3' in text
+    assert 'whatson_ingest_pipeline_items{stage="parse"} 4\n' in text
+
+    summary = report.summary()
+    assert "network" in summary
+    assert 'The "Albany"' in summary
+    assert "parse" in summary
+
+
+def test_registry_histogram():
+    registry = metrics.Registry()
+    registry.describe("latency_seconds", "histogram", "Latency")
+    registry.observe("latency_seconds", 0.003, path="/")
+    registry.observe("latency_seconds", 0.2, path="/")
+    registry.observe("latency_seconds", 60, path="/")
+
+    text = registry.prometheus()
+    assert "# TYPE latency_seconds histogram" in text
+    assert 'latency_seconds_bucket{path="/",le="0.001"} 0' in text
+    assert 'latency_seconds_bucket{path="/",le="0.005"} 1' in text
+    assert 'latency_seconds_bucket{path="/",le="5.0"} 2' in text
+    assert 'latency_seconds_bucket{path="/",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{path="/"} 3' in text
+
+
+def test_registry_adds_up_processes(tmp_path):
+    # Two workers writing to the same directory
+    registries = [metrics.Registry(str(tmp_path), 60) for _ in range(2)]
+    for registry in registries:
+        registry.describe("requests_total", "counter", "Requests")
+        registry.describe("latency_seconds", "histogram", "Latency")
+        registry.inc("requests_total", path="/")
+        registry.observe("latency_seconds", 0.2, path="/")
+
+    # Stand in for the other worker's process having written its file
+    registries[0].flush()
+    os.replace(tmp_path / f"{os.getpid()}.json", tmp_path / f"{os.getpid() + 1}.json")
+
+    text = registries[1].prometheus()
+    assert 'requests_total{path="/"} 2\n' in text
+    assert 'latency_seconds_bucket{path="/",le="0.25"} 2' in text
+    assert 'latency_seconds_count{path="/"} 2' in text
@@ -0,0 +1,34 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import datetime
+import pickle
+import pytest
+from whatson.models import Show, ValidationError
+
+START = datetime.date(2020, 1, 1)
+END = datetime.date(2020, 1, 5)
+
+
+def test_show():
+    show = Show("Title", "image.jpg", "link", START, END)
+
+    assert show.title == "Title"
+    assert show.end_date == END
+    assert pickle.loads(pickle.dumps(show)) == show
+    with pytest.raises(AttributeError):
+        show.extra = 1
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        (" ", "image.jpg", "link", START, END),
+        (None, "image.jpg", "link", START, END),
+        ("Title", None, "link", START, END),
+        ("Title", "image.jpg", "link", "2020-01-01", END),
+        ("Title", "image.jpg", "link", START, datetime.datetime(2020, 1, 5)),
+        ("Title", "image.jpg", "link", END, START),
+    ],
+)
+def test_invalid_show(fields):
+    with pytest.raises(ValidationError):
+        Show(*fields)
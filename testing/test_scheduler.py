@@ -0,0 +1,80 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+from whatson.scheduler import FetchPolicy, Scheduler, retry_after
+
+
+def test_retries_server_errors(server):
+    httpd, url = server
+    scheduler = Scheduler(FetchPolicy(retries=3, backoff=0.01))
+
+    response = scheduler.get(requests.Session(), f"{url}/flaky/2")
+
+    assert response.status_code == 200
+    assert httpd.requests == ["/flaky/2"] * 3
+
+
+def test_gives_up_after_retries(server):
+    httpd, url = server
+    scheduler = Scheduler(FetchPolicy(retries=1, backoff=0.01))
+
+    response = scheduler.get(requests.Session(), f"{url}/flaky/5")
+
+    assert response.status_code == 503
+    assert len(httpd.requests) == 2
+
+
+def test_times_out(server):
+    _, url = server
+    scheduler = Scheduler(FetchPolicy(read_timeout=0.1, retries=1, backoff=0.01))
+
+    with pytest.raises(requests.Timeout):
+        scheduler.get(requests.Session(), f"{url}/slow")
+
+
+def test_limits_concurrency_per_host(server):
+    httpd, url = server
+    scheduler = Scheduler()
+    scheduler.configure(url, FetchPolicy(concurrency=2, rate=1000))
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(
+            executor.map(
+                lambda i: scheduler.get(requests.Session(), f"{url}/{i}"), range(6)
+            )
+        )
+
+    assert httpd.max_in_flight == 2
+
+
+def test_limits_rate_per_host(server):
+    _, url = server
+    scheduler = Scheduler()
+    scheduler.configure(url, FetchPolicy(concurrency=5, rate=20))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        list(
+            executor.map(
+                lambda i: scheduler.get(requests.Session(), f"{url}/{i}"), range(5)
+            )
+        )
+
+    # Five requests at 20 per second start over at least 0.2s
+    assert time.perf_counter() - start >= 0.2
+
+
+def test_retry_after():
+    class Response:  # pylint: disable=too-few-public-methods
+        def __init__(self, value):
+            self.headers = {"Retry-After": value} if value is not None else {}
+
+    assert retry_after(Response("120")) == 120
+    assert retry_after(Response(None)) is None
+    assert retry_after(Response("soon")) is None
+
+    now = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    assert retry_after(Response("Wed, 01 Jan 2020 00:00:30 GMT"), now=now) == 30
@@ -1,13 +1,15 @@
 # pylint: disable=missing-module-docstring,missing-function-docstring
+import gzip
 import pytest
-from whatson.webapp import create_app, interpolate_months
+from whatson.webapp import create_app, interpolate_months, parse_month
+from whatson.db import bump_data_version
 import datetime
 from unittest import mock
 
 
 @pytest.fixture(scope="module")
 def client(connection):
-    app = create_app(connection)
+    app = create_app(connection, {"CACHE_SIZE": 0})
     with app.test_client() as client:
         yield client
 
@@ -60,6 +62,138 @@ def test_only_getting_valid_months(client, cursor):
     assert {"year": today.year + 1, "month": 1} in data["dates"]
 
 
+def test_shows_running_through_a_month(client, cursor):
+    # Listed in every month of its run, not only those it starts or ends in
+    cursor.execute(
+        """INSERT INTO shows (theatre, title, image_url, link_url, start_date, end_date)
+            VALUES (%s, %s, %s, %s, %s, %s)""",
+        (
+            "test",
+            "long run",
+            "",
+            "",
+            datetime.date(2030, 1, 20),
+            datetime.date(2030, 4, 2),
+        ),
+    )
+
+    for month in (1, 2, 3, 4):
+        data = client.get(f"/api/shows?year=2030&month={month}").get_json()
+        assert [show["name"] for show in data["shows"]] == ["long run"]
+
+    data = client.get("/api/shows?year=2030&month=5").get_json()
+    assert data == {"status": "ok", "shows": []}
+
+    # The fields and date format the frontend decodes
+    data = client.get("/api/shows?year=2030&month=1").get_json()
+    assert data["status"] == "ok"
+    assert data["shows"] == [
+        {
+            "name": "long run",
+            "theatre": "test",
+            "image_url": "",
+            "link_url": "",
+            "start_date": "2030-01-20",
+            "end_date": "2030-04-02",
+        }
+    ]
+
+    # Moving the show moves its months
+    cursor.execute(
+        "UPDATE shows SET end_date = %s WHERE title = %s",
+        (datetime.date(2030, 2, 1), "long run"),
+    )
+    data = client.get("/api/shows?year=2030&month=3").get_json()
+    assert data["shows"] == []
+
+
+def test_shows_in_range(client, cursor):
+    cursor.executemany(
+        """INSERT INTO shows (theatre, title, image_url, link_url, start_date, end_date)
+            VALUES (%s, %s, %s, %s, %s, %s)""",
+        [
+            (
+                "test",
+                "winter",
+                "",
+                "",
+                datetime.date(2031, 1, 5),
+                datetime.date(2031, 1, 9),
+            ),
+            (
+                "test",
+                "spring",
+                "",
+                "",
+                datetime.date(2031, 3, 5),
+                datetime.date(2031, 4, 9),
+            ),
+        ],
+    )
+
+    data = client.get("/api/shows?from=2031-01&to=2031-04").get_json()
+    assert data["status"] == "ok"
+    assert [
+        (month["year"], month["month"], [show["name"] for show in month["shows"]])
+        for month in data["months"]
+    ] == [
+        (2031, 1, ["winter"]),
+        (2031, 2, []),
+        (2031, 3, ["spring"]),
+        (2031, 4, ["spring"]),
+    ]
+
+    # Bad ranges are the client's mistake
+    rv = client.get("/api/shows?from=2031-01&to=2040-01")
+    assert rv.status_code == 400
+    assert rv.get_json()["status"] == "error"
+    assert client.get("/api/shows?from=2031-13").status_code == 400
+    assert client.get("/api/shows?from=2031-02&to=2031-01").status_code == 400
+
+
+def test_season(client):
+    data = client.get("/api/season").get_json()
+    assert data["status"] == "ok"
+
+    # The season covers the same months as `/api/months`
+    dates = client.get("/api/months").get_json()["dates"]
+    assert [
+        {"year": month["year"], "month": month["month"]} for month in data["months"]
+    ] == dates
+
+
+def test_compressed_responses(connection):
+    app = create_app(connection, {"COMPRESS_MIN_SIZE": 0})
+    with app.test_client() as client:
+        plain = client.get("/api/season")
+        rv = client.get("/api/season", headers={"Accept-Encoding": "gzip"})
+        # The compressed body is cached alongside the plain one
+        again = client.get("/api/season", headers={"Accept-Encoding": "gzip"})
+
+    assert rv.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in rv.headers["Vary"]
+    assert "max-age" in rv.headers["Cache-Control"]
+    assert rv.headers["ETag"] != plain.headers["ETag"]
+    assert gzip.decompress(rv.get_data()) == plain.get_data()
+    assert again.get_data() == rv.get_data()
+
+
+def test_months_revalidation(connection):
+    app = create_app(connection, {"DATA_VERSION_TTL": 0})
+    with app.test_client() as client:
+        rv = client.get("/api/months")
+        etag = rv.headers["ETag"]
+
+        rv = client.get("/api/months", headers={"If-None-Match": etag})
+        assert rv.status_code == 304
+
+        # New data invalidates the cached response
+        bump_data_version(connection)
+        rv = client.get("/api/months", headers={"If-None-Match": etag})
+        assert rv.status_code == 200
+        assert rv.headers["ETag"] != etag
+
+
 def test_something():
     start = {"year": 2019, "month": 11}
     end = {"year": 2020, "month": 8}
@@ -78,3 +212,60 @@ def test_something():
         {"year": 2020, "month": 7},
         {"year": 2020, "month": 8},
     ]
+
+
+def test_parse_month():
+    assert parse_month("2020-01") == {"year": 2020, "month": 1}
+    for text in ("2020-13", "2020-1", "January"):
+        with pytest.raises(ValueError):
+            parse_month(text)
+
+
+def test_metrics(connection, caplog):
+    app = create_app(connection, {"CACHE_SIZE": 0, "SLOW_REQUEST_SECONDS": 0})
+    with app.test_client() as client:
+        client.get("/api/months")
+        text = client.get("/metrics").get_data(as_text=True)
+
+    assert 'whatson_requests_total{path="/api/months",status="200"} 1' in text
+    assert 'whatson_query_duration_seconds_count{path="/api/months"} 1' in text
+    assert 'whatson_serialise_duration_seconds_count{path="/api/months"} 1' in text
+
+    # Every request is slow with a threshold of 0
+    assert "slow request GET /api/months" in caplog.text
+    assert "FROM show_months" in caplog.text
+
+
+def test_metrics_count_shows_returned_as_json(connection, cursor):
+    date = datetime.date(2091, 3, 1)
+    for title in ("first", "second"):
+        cursor.execute(
+            """INSERT INTO shows (theatre, title, image_url, link_url, start_date, end_date)
+                VALUES (%s, %s, %s, %s, %s, %s)""",
+            ("test", title, "", "", date, date),
+        )
+
+    app = create_app(connection, {"CACHE_SIZE": 0})
+    with app.test_client() as client:
+        client.get("/api/shows?year=2091&month=3")
+        text = client.get("/metrics").get_data(as_text=True)
+
+    assert 'whatson_query_rows_total{path="/api/shows"} 2\n' in text
+
+
+def test_metrics_endpoint_without_database():
+    app = create_app(mock.Mock())
+    with app.test_client() as client:
+        client.get("/")
+        rv = client.get("/metrics")
+
+    assert rv.status_code == 200
+    assert 'whatson_requests_total{path="/",status="200"} 1' in rv.get_data(
+        as_text=True
+    )
+
+
+def test_metrics_disabled():
+    app = create_app(mock.Mock(), {"METRICS_ENABLED": False})
+    with app.test_client() as client:
+        assert client.get("/metrics").status_code == 404
@@ -0,0 +1,188 @@
+"""
+Whatson async fetching
+
+Fetches pages with aiohttp on a single event loop, running in a background
+thread, sharing one pool of connections between every request, and without a
+thread (and its stack) for each page requested ahead of time. Requests follow
+the same per-host limits, timeouts and retries as the `Scheduler`, and
+revalidate pages in the HTTP cache in the same way.
+
+Fetchers are generators which run on the ingest pipeline's threads, so the
+loop is only their transport, and no more theatres are fetched at once than
+there are threads. `AsyncClient` has blocking `fetch` and `submit` methods
+which hand their requests to the loop.
+Needs aiohttp (`poetry install -E async`).
+"""
+
+import asyncio
+import contextlib
+import logging
+import threading
+from urllib.parse import urlsplit
+from . import httpcache
+from .scheduler import RETRY_STATUSES, backoff, retry_after
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+LOG = logging.getLogger("whatson.aiofetch")
+
+
+class AsyncHostLimiter:
+    """Concurrency and rate limits for the requests to a single host. Only for
+    use on the event loop it was created on.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self._slots = asyncio.Semaphore(policy.concurrency)
+        self._next_start = 0.0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Wait until a request may be made, and hold its slot for the block"""
+        async with self._slots:
+            now = asyncio.get_event_loop().time()
+            start = max(now, self._next_start)
+            self._next_start = start + 1 / self.policy.rate
+
+            if start > now:
+                await asyncio.sleep(start - now)
+            yield
+
+
+class AsyncClient:
+    """Fetches pages on an event loop in a background thread. The limits for
+    each host are taken from `scheduler`, and pages are revalidated against
+    `cache` if given.
+    """
+
+    def __init__(
+        self, scheduler, cache=None, user_agent="whatson/0.1.0", max_connections=200
+    ):
+        if aiohttp is None:
+            raise RuntimeError("fetching asynchronously needs aiohttp installed")
+
+        self.scheduler = scheduler
+        self.cache = cache
+        self.user_agent = user_agent
+        self.max_connections = max_connections
+        self._session = None
+        self._limiters = {}
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="aiofetch", daemon=True
+        )
+        self._thread.start()
+
+    def _limiter(self, url):
+        host = urlsplit(url).netloc
+        policy = self.scheduler.policy(url)
+        limiter = self._limiters.get(host)
+        if limiter is None or limiter.policy != policy:
+            limiter = self._limiters[host] = AsyncHostLimiter(policy)
+        return limiter
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                headers={"User-Agent": self.user_agent},
+            )
+        return self._session
+
+    async def _get(self, url, headers):
+        """GET `url` within the limits for its host, retrying failures. Returns
+        the status, headers and body of the last response, or raises the last
+        connection error or timeout once the retries are used up.
+        """
+        limiter = self._limiter(url)
+        policy = limiter.policy
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=policy.connect_timeout, sock_read=policy.read_timeout
+        )
+
+        attempt = 0
+        while True:
+            last_attempt = attempt >= policy.retries
+            try:
+                async with limiter.slot():
+                    async with self._get_session().get(
+                        url, headers=headers, timeout=timeout
+                    ) as response:
+                        if response.status not in RETRY_STATUSES or last_attempt:
+                            response.raise_for_status()
+                            body = await response.text()
+                            return response.status, response.headers, body
+
+                        delay = retry_after(response)
+                        if delay is None:
+                            delay = backoff(policy, attempt)
+                        delay = min(delay, policy.max_backoff)
+                        LOG.warning(
+                            "%s: status %d, retrying in %.1fs",
+                            url,
+                            response.status,
+                            delay,
+                        )
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+                if last_attempt:
+                    raise
+                delay = backoff(policy, attempt)
+                LOG.warning("%s: %r, retrying in %.1fs", url, exc, delay)
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def fetch_page(self, url):
+        """Fetch `url`, revalidating any copy in the cache. Returns the
+        `CachedPage` for the response.
+        """
+        loop = asyncio.get_event_loop()
+        cached = None
+        if self.cache is not None:
+            cached = await loop.run_in_executor(None, self.cache.get, url)
+
+        status, headers, body = await self._get(
+            url, httpcache.conditional_headers(cached)
+        )
+        if cached is not None and status == 304:
+            LOG.debug("%s not modified", url)
+            return cached
+
+        return await loop.run_in_executor(
+            None, httpcache.store, self.cache, url, body, headers
+        )
+
+    async def fetch_html(self, url):
+        """Fetch the HTML of `url`"""
+        page = await self.fetch_page(url)
+        return page.body
+
+    def submit(self, url):
+        """Start fetching `url` on the loop, returning a
+        `concurrent.futures.Future` of its HTML
+        """
+        return asyncio.run_coroutine_threadsafe(self.fetch_html(url), self.loop)
+
+    def fetch(self, url):
+        """Fetch `url` from another thread, blocking until the `CachedPage` for
+        the response is ready
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.fetch_page(url), self.loop
+        ).result()
+
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def close(self):
+        """Close the connections and stop the loop"""
+        asyncio.run_coroutine_threadsafe(self._close_session(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
@@ -0,0 +1,125 @@
+"""
+Whatson browser
+
+A pool of headless Chrome instances, for fetching the theatre pages which are
+rendered by javascript.
+"""
+
+import contextlib
+import logging
+import queue
+import threading
+
+LOG = logging.getLogger("whatson.browser")
+
+
+def create_driver():
+    """Start a new headless Chrome instance"""
+    # Selenium is slow to import and only needed by a couple of theatres
+    from selenium import webdriver  # pylint: disable=import-outside-toplevel
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--no-sandbox")
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    return webdriver.Chrome(chrome_options=options)
+
+
+def wait_for(driver, selector, timeout):
+    """Block until an element matching the CSS `selector` is on the page"""
+    # pylint: disable=import-outside-toplevel
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    WebDriverWait(driver, timeout).until(
+        expected_conditions.presence_of_element_located((By.CSS_SELECTOR, selector))
+    )
+
+
+class BrowserPool:
+    """Up to `size` browsers, started on demand by `factory` and shared
+    between threads. Each browser is used by one thread at a time.
+    """
+
+    def __init__(self, size=1, factory=create_driver):
+        self.size = size
+        self.factory = factory
+        self._idle = queue.LifoQueue()
+        self._drivers = set()
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                if len(self._drivers) < self.size:
+                    # Hold the slot while the browser starts up, outside of
+                    # the lock
+                    placeholder = object()
+                    self._drivers.add(placeholder)
+                    break
+
+            # Wait for a browser to be returned. Browsers which fail are not
+            # returned, so check for a free slot again every so often.
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+
+        LOG.debug("starting browser %d of %d", len(self._drivers), self.size)
+        try:
+            driver = self.factory()
+        finally:
+            with self._lock:
+                self._drivers.discard(placeholder)
+
+        with self._lock:
+            self._drivers.add(driver)
+        return driver
+
+    def _discard(self, driver):
+        with self._lock:
+            self._drivers.discard(driver)
+
+        try:
+            driver.quit()
+        except Exception:  # pylint: disable=broad-except
+            LOG.exception("cannot shut down browser")
+
+    @contextlib.contextmanager
+    def driver(self):
+        """Check a browser out of the pool for the duration of the block. A
+        browser which raised an error is shut down rather than reused.
+        """
+        driver = self._checkout()
+        try:
+            yield driver
+        except BaseException:
+            self._discard(driver)
+            raise
+        else:
+            self._idle.put(driver)
+
+    def page_source(self, url, ready_selector=None, timeout=10):
+        """Load `url` and return the rendered HTML, once an element matching
+        `ready_selector` (if given) has appeared
+        """
+        with self.driver() as driver:
+            driver.get(url)
+            if ready_selector is not None:
+                wait_for(driver, ready_selector, timeout)
+            return driver.page_source
+
+    def shutdown(self):
+        """Shut down every browser which is not currently checked out"""
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
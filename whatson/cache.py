@@ -0,0 +1,120 @@
+"""
+Whatson cache
+
+In-process caching of API responses. The listings only change when
+`whatson-ingest` runs, which bumps the data version stored in the database, so
+cached entries are tied to the version they were built from.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe mapping holding at most `maxsize` entries, discarding the
+    least recently used entry when full
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self._entries[key]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResponseCache:
+    """Cache of response bodies keyed by data version
+
+    `store` is anything with `get`, `set` and `clear` methods, by default an
+    `LRUCache`. The data version is part of every key, so a store shared
+    between processes never serves a body from an older version. A local store
+    is cleared as soon as a newer version is seen. Pass `shared=True` for a
+    store which other processes use, which is left for its own eviction to
+    empty, as clearing it would throw away their entries too.
+    """
+
+    def __init__(self, store=None, shared=False):
+        self.store = store if store is not None else LRUCache()
+        self.shared = shared
+        self.version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if self.shared:
+            return
+
+        with self._lock:
+            if version != self.version:
+                self.store.clear()
+                self.version = version
+
+    def get(self, version, key):
+        self._check_version(version)
+        return self.store.get((version,) + key)
+
+    def set(self, version, key, value):
+        self._check_version(version)
+        self.store.set((version,) + key, value)
+
+
+class DataVersion:
+    """The current data version, as returned by `loader`, re-read at most once
+    every `ttl` seconds
+
+    The loader is called outside the lock. While one thread re-reads an expired
+    version the others carry on with the old one rather than waiting for it.
+    """
+
+    def __init__(self, loader, ttl=5.0):
+        self.loader = loader
+        self.ttl = ttl
+        self._value = None
+        self._loaded_at = None
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def current(self):
+        with self._lock:
+            now = time.monotonic()
+            fresh = self._loaded_at is not None and now - self._loaded_at < self.ttl
+            if fresh or (self._loading and self._loaded_at is not None):
+                return self._value
+            self._loading = True
+
+        try:
+            value = self.loader()
+        except Exception:
+            with self._lock:
+                self._loading = False
+            raise
+
+        with self._lock:
+            self._value = value
+            self._loaded_at = now
+            self._loading = False
+        return value
@@ -0,0 +1,214 @@
+"""
+Whatson dates
+
+Parses the dates in theatres' listings. Each theatre has a table of formats,
+tried in order, which are compiled to regular expressions rather than tried one
+after another with `strptime`, so a date which does not match a format costs a
+failed match rather than a raised and caught exception. Listings repeat the
+same dates many times, so what each string matched is cached.
+
+Dates often leave out the year, or the month and year of the start of a run,
+which `DateParser.parse_range` fills in the same way for every theatre. A date
+which gives its weekday is put in the year, out of the current one and those
+either side, in which it falls on that day.
+"""
+
+import datetime
+import re
+from typing import NamedTuple, Optional
+from . import metrics
+from .cache import LRUCache
+
+MONTH_NAMES = (
+    "january",
+    "february",
+    "march",
+    "april",
+    "may",
+    "june",
+    "july",
+    "august",
+    "september",
+    "october",
+    "november",
+    "december",
+)
+
+# Full and abbreviated month names, in lower case
+MONTHS = {name: number for number, name in enumerate(MONTH_NAMES, 1)}
+MONTHS.update({name[:3]: number for name, number in list(MONTHS.items())})
+MONTHS["sept"] = 9
+
+WEEKDAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+# Weekdays by their first three letters, in lower case, as numbered by
+# `datetime.date.weekday`
+WEEKDAYS = {name: number for number, name in enumerate(WEEKDAY_NAMES)}
+
+# Weekdays, including listings' own abbreviations like "Tues" and "Thurs"
+WEEKDAY = (
+    r"(?P<weekday>(?:mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun)(?:[a-z]*day)?)\.?"
+)
+
+# What each `strptime` directive matches. Days may have an ordinal suffix, and
+# `%b` and `%B` both match full and abbreviated month names.
+DIRECTIVES = {
+    "a": WEEKDAY,
+    "d": r"(?P<day>[0-3]?[0-9])(?:st|nd|rd|th)?",
+    "b": r"(?P<month_name>[a-z]+)\.?",
+    "B": r"(?P<month_name>[a-z]+)\.?",
+    "m": r"(?P<month>[01]?[0-9])",
+    "Y": r"(?P<year>[0-9]{4})",
+}
+
+
+class DateParts(NamedTuple):
+    """The parts of a date found in some text, any of which may be missing"""
+
+    day: Optional[int]
+    month: Optional[int]
+    year: Optional[int]
+
+
+def compile_format(fmt):
+    """Compile a `strptime` style format, made up of the directives in
+    `DIRECTIVES`, to a regular expression. Spaces match any whitespace.
+    """
+    pattern = ""
+    for literal, directive in re.findall(r"([^%]*)(?:%(.))?", fmt):
+        pattern += r"\s+".join(re.escape(part) for part in literal.split(" "))
+        if directive:
+            pattern += DIRECTIVES[directive]
+    return re.compile(pattern, re.IGNORECASE)
+
+
+# Marks text which matched none of a parser's formats in its cache
+_NO_MATCH = object()
+
+
+class DateParser:
+    """Parses dates in any of `formats`, tried in order. Runs of dates are
+    split on any of the characters in `separators`.
+    """
+
+    def __init__(self, *formats, separators="-", cache_size=1024):
+        self.formats = formats
+        self.separators = separators
+        self._patterns = [compile_format(fmt) for fmt in formats]
+        self._separators = re.compile(f"[{re.escape(separators)}]")
+        self._cache = LRUCache(cache_size)
+
+    def _lookup(self, text):
+        """The parts of the date in `text`, and its weekday if it gives one"""
+        text = text.strip()
+        found = self._cache.get(text)
+        if found is None:
+            found = self._match(text)
+            self._cache.set(text, found)
+
+        if found is _NO_MATCH:
+            raise ValueError(f"{text!r} does not match any of {self.formats}")
+        return found
+
+    def _parts(self, text):
+        return self._lookup(text)[0]
+
+    def _match(self, text):
+        for pattern in self._patterns:
+            match = pattern.fullmatch(text)
+            if match is None:
+                continue
+
+            fields = match.groupdict()
+            month = fields.get("month")
+            if fields.get("month_name") is not None:
+                month = MONTHS.get(fields["month_name"].lower())
+                if month is None:
+                    continue
+
+            parts = DateParts(
+                *(
+                    None if value is None else int(value)
+                    for value in (fields.get("day"), month, fields.get("year"))
+                )
+            )
+            weekday = fields.get("weekday")
+            if weekday is not None:
+                weekday = WEEKDAYS[weekday[:3].lower()]
+            return parts, weekday
+        return _NO_MATCH
+
+    def parts(self, text):
+        """The parts of the date in `text`, from the first format it matches.
+        Raises `ValueError` if it matches none of them.
+        """
+        with metrics.stage("dates"):
+            return self._parts(text)
+
+    def parse(self, text, year):
+        """The date in `text`, taking it to be in `year` if it does not say"""
+        with metrics.stage("dates"):
+            parts, weekday = self._lookup(text)
+            return _date(_year(parts, weekday, year), parts.month, parts.day, text)
+
+    def parse_range(self, text, year):
+        """The start and end dates of a run, given in `text` as one date or as
+        two separated by one of the separators. The start is assumed to be in
+        the same month and year as the end if it does not say, or in the year
+        before if that would put it after the end. Years which neither date
+        gives are taken to be `year` for the start, or the year either side
+        which puts it on its weekday, with the end in the year after if that
+        would put it before the start.
+        """
+        with metrics.stage("dates"):
+            pieces = self._separators.split(text)
+            if len(pieces) == 1:
+                parts, weekday = self._lookup(text)
+                date_year = _year(parts, weekday, year)
+                date = _date(date_year, parts.month, parts.day, text)
+                return date, date
+
+            start, start_weekday = self._lookup(pieces[0])
+            end = self._parts(pieces[1])
+            if end.month is None:
+                raise ValueError(f"{text!r} does not give the month its run ends")
+            start_month = start.month or end.month
+
+            if end.year is not None:
+                end_date = _date(end.year, end.month, end.day, text)
+                start_date = _date(start.year or end.year, start_month, start.day, text)
+                if start.year is None and start_date > end_date:
+                    start_date = _date(end.year - 1, start_month, start.day, text)
+                return start_date, end_date
+
+            start_year = _year(start._replace(month=start_month), start_weekday, year)
+            start_date = _date(start_year, start_month, start.day, text)
+            end_date = _date(start_date.year, end.month, end.day, text)
+            if end_date < start_date:
+                end_date = _date(start_date.year + 1, end.month, end.day, text)
+            return start_date, end_date
+
+
+def _year(parts, weekday, year):
+    """The year of the date `parts`: the one it gives, or else `year`, unless
+    the date falls on `weekday` only in the year after or before
+    """
+    if parts.year is not None:
+        return parts.year
+    if weekday is None or parts.month is None or parts.day is None:
+        return year
+
+    for candidate in (year, year + 1, year - 1):
+        try:
+            if datetime.date(candidate, parts.month, parts.day).weekday() == weekday:
+                return candidate
+        except ValueError:
+            # e.g. the 29th of February outside a leap year
+            continue
+    return year
+
+
+def _date(year, month, day, text):
+    if month is None or day is None:
+        raise ValueError(f"{text!r} is missing its day or month")
+    return datetime.date(year, month, day)
@@ -6,46 +6,428 @@ This module handles talking to Postgres via `psycopg2`.
 
 import logging
 import os
+import threading
+import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 from dotenv import load_dotenv
 
-load_dotenv()
-
 LOG = logging.getLogger("whatson.db")
 LOG.setLevel(logging.DEBUG)
 
 
-DB = psycopg2.connect(os.environ["DATABASE_URL"], cursor_factory=RealDictCursor)
+class ConnectionPool:
+    """A pool of connections which can be used wherever a single connection is
+
+    `with pool as conn:` checks a connection out of the pool for the duration
+    of the block, committing (or rolling back on error) at the end, exactly as
+    `with conn:` does for a plain connection, and then returns it to the pool.
+
+    Connections which have been idle for longer than `health_check_interval`
+    seconds are pinged before being handed out, and broken connections are
+    closed and replaced rather than returned to the pool.
+
+    Nothing connects to the database until the first connection is checked
+    out. Any settings not given are then read from the environment (and a
+    `.env` file): `DATABASE_URL`, `DATABASE_POOL_MIN` and `DATABASE_POOL_MAX`.
+    """
+
+    def __init__(
+        self,
+        dsn=None,
+        minconn=None,
+        maxconn=None,
+        health_check_interval=30.0,
+        timeout=30.0,
+    ):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self._pool = None
+        self._slots = None
+        self._create_lock = threading.Lock()
+        self._last_used = {}
+        self._local = threading.local()
+
+    def _connect(self):
+        with self._create_lock:
+            if self._pool is not None:
+                return
+
+            load_dotenv()
+            if self.dsn is None:
+                self.dsn = os.environ["DATABASE_URL"]
+            if self.minconn is None:
+                self.minconn = int(os.getenv("DATABASE_POOL_MIN", "1"))
+            if self.maxconn is None:
+                self.maxconn = int(os.getenv("DATABASE_POOL_MAX", "10"))
+
+            # `ThreadedConnectionPool` raises rather than waiting when every
+            # connection is in use, so callers queue here for a free slot instead
+            self._slots = threading.BoundedSemaphore(self.maxconn)
+            self._pool = ThreadedConnectionPool(
+                self.minconn, self.maxconn, self.dsn, cursor_factory=RealDictCursor
+            )
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None:
+            if time.monotonic() - last_used < self.health_check_interval:
+                return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            LOG.warning("discarding unhealthy database connection")
+            return False
+        return True
+
+    def getconn(self):
+        """Check a healthy connection out of the pool"""
+        if self._pool is None:
+            self._connect()
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError("timed out waiting for a database connection")
+
+        try:
+            # Every connection in the pool may have gone bad at once, e.g. if
+            # the database was restarted, so try replacing each of them
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._healthy(conn):
+                    return conn
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        self._slots.release()
+        raise PoolError("cannot get a healthy database connection")
+
+    def putconn(self, conn, broken=False):
+        """Return a connection to the pool, closing it if it is broken"""
+        try:
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def closeall(self):
+        if self._pool is not None:
+            self._pool.closeall()
+
+    def __enter__(self):
+        conn = self.getconn()
+        self._stack().append(conn)
+        return conn.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        conn = self._stack().pop()
+        broken = isinstance(
+            exc_value, (psycopg2.OperationalError, psycopg2.InterfaceError)
+        )
+        try:
+            conn.__exit__(exc_type, exc_value, traceback)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            if exc_value is None:
+                raise
+        finally:
+            self.putconn(conn, broken=broken)
+
+    def _stack(self):
+        # Connections checked out by nested `with` blocks on this thread
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+DB = ConnectionPool()
+
+
+# Indexes on the tables created by `create_tables`, named after their table so
+# that they can be renamed along with it
+INDEXES = {
+    "shows": (
+        "{}_pkey",
+        "_idx_{}_theatre_title",
+    ),
+    "show_months": ("{}_pkey", "_idx_{}_year_month"),
+}
+
+
+def create_tables(cursor, suffix=""):
+    """Create the `shows` and `show_months` tables, with `suffix` appended to
+    their names
+    """
+    shows = f"shows{suffix}"
+    cursor.execute(
+        f"""CREATE TABLE {shows} (
+            id SERIAL,
+            theatre VARCHAR(255) NOT NULL,
+            title VARCHAR(255) NOT NULL,
+            image_url TEXT NOT NULL,
+            link_url TEXT NOT NULL,
+            start_date DATE NOT NULL,
+            end_date DATE NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            -- Hash of the details above, to tell whether a show has changed
+            content_hash CHAR(64),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            -- When the show was last missing from its theatre's listings
+            gone_at TIMESTAMPTZ,
+            CONSTRAINT {shows}_pkey PRIMARY KEY (id)
+            )"""
+    )
+    _create_show_indexes(cursor, shows)
+    _create_show_months(cursor, suffix)
+
+
+def _create_show_indexes(cursor, shows):
+    cursor.execute(
+        f"""CREATE UNIQUE INDEX IF NOT EXISTS _idx_{shows}_theatre_title
+            ON {shows} (theatre, title)
+            """
+    )
+
+
+def _create_show_months(cursor, suffix):
+    shows = f"shows{suffix}"
+    show_months = f"show_months{suffix}"
+
+    # Every month in which each show is running, kept up to date by a trigger
+    # on `shows`, so that the webapp can look shows up by month without
+    # scanning or interpolating date ranges. Shows which have gone from the
+    # listings have no months.
+    cursor.execute(
+        f"""CREATE TABLE IF NOT EXISTS {show_months} (
+            show_id INT NOT NULL REFERENCES {shows} (id) ON DELETE CASCADE,
+            theatre VARCHAR(255) NOT NULL,
+            year SMALLINT NOT NULL,
+            month SMALLINT NOT NULL,
+            CONSTRAINT {show_months}_pkey PRIMARY KEY (show_id, year, month)
+            )"""
+    )
+    cursor.execute(
+        f"""CREATE INDEX IF NOT EXISTS _idx_{show_months}_year_month
+            ON {show_months} (year, month, show_id)
+            """
+    )
+
+    # The months table is found from the name of the shows table, so that the
+    # same function serves shadow tables, and carries on working when they are
+    # renamed
+    cursor.execute(
+        """CREATE OR REPLACE FUNCTION update_show_months() RETURNS trigger AS $$
+            DECLARE
+                months_table TEXT := replace(TG_TABLE_NAME, 'shows', 'show_months');
+            BEGIN
+                EXECUTE format('DELETE FROM %I WHERE show_id = $1', months_table)
+                    USING NEW.id;
+                IF NEW.gone_at IS NOT NULL THEN
+                    RETURN NULL;
+                END IF;
+
+                EXECUTE format(
+                    'INSERT INTO %I (show_id, theatre, year, month)
+                        SELECT
+                            $1,
+                            $2,
+                            EXTRACT(YEAR FROM month)::int,
+                            EXTRACT(MONTH FROM month)::int
+                        FROM generate_series(
+                            date_trunc(''month'', $3::timestamp),
+                            $4::timestamp,
+                            interval ''1 month''
+                        ) AS month',
+                    months_table
+                ) USING NEW.id, NEW.theatre, NEW.start_date, NEW.end_date;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """
+    )
+    cursor.execute(f"DROP TRIGGER IF EXISTS _trg_shows_show_months ON {shows}")
+    cursor.execute(
+        f"""CREATE TRIGGER _trg_shows_show_months
+            AFTER INSERT OR UPDATE OF theatre, start_date, end_date, gone_at
+            ON {shows}
+            FOR EACH ROW EXECUTE PROCEDURE update_show_months()
+            """
+    )
+
+
+def drop_tables(cursor, suffix=""):
+    cursor.execute(f"DROP TABLE IF EXISTS show_months{suffix}")
+    cursor.execute(f"DROP TABLE IF EXISTS shows{suffix}")
+
+
+def _create_data_version(cursor):
+    # Single row table holding the version of the listings, bumped whenever
+    # they change so that the webapp knows to drop its cached responses
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS data_version (
+            id INT PRIMARY KEY CHECK (id = 1),
+            version BIGINT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL
+            )"""
+    )
 
 
 def reset_database(db):
     """Resets the database to its basic schema"""
     with db as conn:
         cursor = conn.cursor()
-        cursor.execute("DROP TABLE IF EXISTS shows")
-        cursor.execute(
-            """CREATE TABLE shows (
-                id SERIAL PRIMARY KEY,
-                theatre VARCHAR(255) NOT NULL,
-                title VARCHAR(255) NOT NULL,
-                image_url TEXT NOT NULL,
-                link_url TEXT NOT NULL,
-                start_date DATE NOT NULL,
-                end_date DATE NOT NULL,
-                created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
-                )"""
-        )
+        drop_tables(cursor)
+        create_tables(cursor)
+        _create_data_version(cursor)
+
+    bump_data_version(db)
+
+
+def migrate_database(db):
+    """Bring a database created by an earlier version up to the current schema,
+    keeping its shows. Does nothing to a database which is already up to date.
+    """
+    with db as conn:
+        cursor = conn.cursor()
         cursor.execute(
-            """CREATE UNIQUE INDEX _idx_shows_theatre_title
-                ON shows (theatre, title)
+            """SELECT
+                to_regclass('shows') IS NOT NULL AS shows,
+                to_regclass('show_months') IS NOT NULL AS show_months
                 """
         )
+        exists = cursor.fetchone()
+
+        if not exists["shows"]:
+            create_tables(cursor)
+        else:
+            cursor.execute(
+                """ALTER TABLE shows
+                    ADD COLUMN IF NOT EXISTS content_hash CHAR(64),
+                    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL
+                        DEFAULT CURRENT_TIMESTAMP,
+                    ADD COLUMN IF NOT EXISTS gone_at TIMESTAMPTZ
+                    """
+            )
+            _create_show_indexes(cursor, "shows")
+            _create_show_months(cursor, "")
+
+            # Indexes for date range queries, which shows are no longer looked
+            # up by, that only slowed down writes
+            for suffix in ("", NEXT, OLD):
+                for index in ("start_date_end_date", "end_date"):
+                    cursor.execute(f"DROP INDEX IF EXISTS _idx_shows{suffix}_{index}")
+
+            if not exists["show_months"]:
+                # Fire the trigger for every show, to fill in their months
+                cursor.execute("UPDATE shows SET end_date = end_date")
+
+        _create_data_version(cursor)
+
+
+# Suffixes of the tables a rebuild writes to, and of the tables it replaced
+NEXT = "_next"
+OLD = "_old"
+
+
+def create_shadow_tables(db):
+    """Create empty `shows_next` and `show_months_next` tables, for a rebuild to
+    write to while the current tables carry on being served
+    """
+    with db as conn:
+        cursor = conn.cursor()
+        drop_tables(cursor, NEXT)
+        create_tables(cursor, NEXT)
+
+
+def _rename_tables(cursor, from_suffix, to_suffix):
+    for table, indexes in INDEXES.items():
+        for index in indexes:
+            cursor.execute(
+                f"""ALTER INDEX {index.format(table + from_suffix)}
+                    RENAME TO {index.format(table + to_suffix)}
+                    """
+            )
+        cursor.execute(f"ALTER TABLE {table}{from_suffix} RENAME TO {table}{to_suffix}")
+    cursor.execute(
+        f"ALTER SEQUENCE shows{from_suffix}_id_seq RENAME TO shows{to_suffix}_id_seq"
+    )
+
 
+def swap_shadow_tables(db):
+    """Replace the current tables with the ones written by a rebuild, in a
+    single transaction, so that readers see either the old or the new shows.
+    The replaced tables are kept until the next rebuild, for
+    `rollback_shadow_tables`.
+    """
+    with db as conn:
+        cursor = conn.cursor()
+        drop_tables(cursor, OLD)
+        _rename_tables(cursor, "", OLD)
+        _rename_tables(cursor, NEXT, "")
+
+    bump_data_version(db)
+
+
+def rollback_shadow_tables(db):
+    """Put back the tables replaced by the last rebuild. The tables written by
+    the rebuild become the shadow tables again. Raises `RuntimeError` if there
+    are no replaced tables to put back.
+    """
+    with db as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT to_regclass(%s) AS old", (f"shows{OLD}",))
+        if cursor.fetchone()["old"] is None:
+            raise RuntimeError(f"no shows{OLD} table, as nothing has been rebuilt")
+
+        drop_tables(cursor, NEXT)
+        _rename_tables(cursor, "", NEXT)
+        _rename_tables(cursor, OLD, "")
+
+    bump_data_version(db)
+
+
+def bump_data_version(db):
+    """Record that the contents of the `shows` table have changed"""
+    with db as conn:
+        cursor = conn.cursor()
         cursor.execute(
-            """CREATE OR REPLACE FUNCTION total_months(date)
-            RETURNS int AS
-                'select (extract(year from $1) * 12 + extract(month from $1))::int'
-                    language sql immutable
-            """
+            """INSERT INTO data_version (id, version, updated_at)
+                VALUES (1, 1, CURRENT_TIMESTAMP)
+                ON CONFLICT (id) DO UPDATE SET
+                    version = data_version.version + 1,
+                    updated_at = CURRENT_TIMESTAMP
+                """
         )
+
+
+def get_data_version(db):
+    """Return the current data version and when it was last changed, or
+    `(0, None)` if it has never been set
+    """
+    with db as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT version, updated_at FROM data_version WHERE id = 1")
+        row = cursor.fetchone()
+
+    if row is None:
+        return 0, None
+    return row["version"], row["updated_at"]
@@ -0,0 +1,174 @@
+"""
+Whatson HTTP cache
+
+An on-disk cache of the listing pages fetched during ingest. Cached pages are
+revalidated with conditional requests, so that pages which have not changed
+since the last run are not downloaded again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import NamedTuple, Optional
+
+LOG = logging.getLogger("whatson.httpcache")
+
+
+class CachedPage(NamedTuple):
+    """A page stored in the cache, with the validators the server sent for it"""
+
+    url: str
+    body: str
+    digest: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+def digest(body):
+    """Hash of a page body, used to spot pages which are unchanged even though
+    the server does not support conditional requests
+    """
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def _write_json(path, data):
+    # Write to a temporary file first, so that readers never see a partial file
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as outfile:
+        json.dump(data, outfile)
+    os.replace(tmp_path, path)
+
+
+class HTTPCache:
+    """Cache of page bodies under `directory`, holding at most `max_bytes` of
+    pages. The least recently used pages are evicted first.
+
+    The cache also remembers a fingerprint of the pages each theatre's shows
+    were last successfully written from, so that writes can be skipped when
+    none of a theatre's pages have changed.
+    """
+
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._pages_dir = os.path.join(directory, "pages")
+        self._fingerprints_path = os.path.join(directory, "fingerprints.json")
+        self._lock = threading.Lock()
+        os.makedirs(self._pages_dir, exist_ok=True)
+
+    def _path(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self._pages_dir, f"{key}.json")
+
+    def get(self, url):
+        """Return the cached page for `url`, or `None`"""
+        path = self._path(url)
+        try:
+            with open(path) as infile:
+                page = CachedPage(**json.load(infile))
+        except (OSError, ValueError, TypeError):
+            return None
+
+        # Mark the page as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return page
+
+    def put(self, url, body, etag=None, last_modified=None):
+        """Store a page, returning the `CachedPage`"""
+        page = CachedPage(url, body, digest(body), etag, last_modified)
+        _write_json(self._path(url), page._asdict())
+        self._evict()
+        return page
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self._pages_dir):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+
+                LOG.debug("evicting %s from the cache", path)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def _fingerprints(self):
+        try:
+            with open(self._fingerprints_path) as infile:
+                return json.load(infile)
+        except (OSError, ValueError):
+            return {}
+
+    def fingerprint(self, name):
+        """The fingerprint last recorded for `name`, or `None`"""
+        with self._lock:
+            return self._fingerprints().get(name)
+
+    def set_fingerprint(self, name, fingerprint):
+        with self._lock:
+            fingerprints = self._fingerprints()
+            fingerprints[name] = fingerprint
+            _write_json(self._fingerprints_path, fingerprints)
+
+    def clear_fingerprints(self):
+        """Forget every fingerprint, e.g. once the shows they were written from
+        are no longer in the database
+        """
+        with self._lock:
+            _write_json(self._fingerprints_path, {})
+
+
+def conditional_headers(cached):
+    """Headers asking the server to send the page only if it has changed since
+    `cached` was stored
+    """
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+    return headers
+
+
+def store(cache, url, body, headers):
+    """The `CachedPage` for a response, stored in `cache` unless it is `None`"""
+    if cache is None:
+        return CachedPage(url, body, digest(body))
+
+    return cache.put(
+        url,
+        body,
+        etag=headers.get("ETag"),
+        last_modified=headers.get("Last-Modified"),
+    )
+
+
+def fetch(session, url, cache=None):
+    """GET `url` with `session`, revalidating any copy in `cache`. Returns the
+    `CachedPage` for the response.
+    """
+    cached = cache.get(url) if cache is not None else None
+
+    response = session.get(url, headers=conditional_headers(cached))
+    if cached is not None and response.status_code == 304:
+        LOG.debug("%s not modified", url)
+        return cached
+
+    response.raise_for_status()
+    return store(cache, url, response.text, response.headers)
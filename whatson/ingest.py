@@ -8,18 +8,42 @@ variable.
 
 import json
 import argparse
+import collections
+import contextvars
+import itertools
+import hashlib
+import os
+import queue
 from html import unescape
 import configparser
 import datetime
 import logging
-from urllib.parse import urlencode
+import multiprocessing
+from urllib.parse import urlencode, urljoin
 import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple, Optional
 from bs4.element import Tag
-from bs4 import BeautifulSoup
-from psycopg2.errors import UniqueViolation  # pylint: disable=no-name-in-module
-from selenium import webdriver
+from bs4 import BeautifulSoup, SoupStrainer
+from psycopg2.extras import execute_values
 import requests
-from .db import DB, reset_database
+from . import aiofetch, httpcache, metrics
+from .browser import BrowserPool
+from .dates import DateParser
+from .models import Show, ShowFields, ValidationError
+from .scheduler import FetchPolicy, Scheduler
+from .db import (
+    DB,
+    NEXT,
+    bump_data_version,
+    create_shadow_tables,
+    migrate_database,
+    reset_database,
+    rollback_shadow_tables,
+    swap_shadow_tables,
+)
 
 LOG = logging.getLogger("whatson")
 LOG.setLevel(logging.WARNING)
@@ -27,77 +51,319 @@ LOG.setLevel(logging.WARNING)
 # Database management
 
 
-def upload(theatre, show):
-    """Given a show extracted from the theatre page, upload the show to the database"""
-    LOG.debug("uploading %s - %s", show["title"], theatre)
-    with DB as conn:
-        cursor = conn.cursor()
-        try:
+class UploadResult(NamedTuple):
+    """Counts of what happened to a batch of shows when written to the database"""
+
+    inserted: int
+    updated: int
+    unchanged: int
+    expired: int = 0
+
+
+def show_hash(show):
+    """Hash of the details of a show, for spotting shows which have changed"""
+    details = (
+        show.title,
+        show.image_url,
+        show.link_url,
+        show.start_date.isoformat(),
+        show.end_date.isoformat(),
+    )
+    return hashlib.sha256("\x1f".join(details).encode("utf-8")).hexdigest()
+
+
+def upload_shows(db, theatre, shows, table="shows"):
+    """Write all of the shows extracted for a theatre to `table` in a single
+    transaction. Only new shows, and shows whose details have changed, are
+    written. Shows of the theatre's which are no longer listed are marked as
+    gone.
+    """
+    # A show listed twice on the same page would make `ON CONFLICT DO UPDATE`
+    # touch the same row twice, which postgres refuses, so keep the first.
+    rows = {}
+    for show in shows:
+        if show.title in rows:
+            LOG.debug("duplicate show %s found, skipping", show.title)
+            continue
+
+        rows[show.title] = (theatre, *show, show_hash(show))
+
+    # An empty listing is much more likely to be a broken page than every show
+    # having been cancelled, so it never expires anything
+    if not rows:
+        return UploadResult(0, 0, 0)
+
+    LOG.debug("uploading %d shows for %s", len(rows), theatre)
+    with db as conn:
+        with conn.cursor() as cursor:
             cursor.execute(
-                """INSERT INTO shows (theatre, title, image_url, link_url, start_date, end_date)
-                    VALUES (%s, %s, %s, %s, %s, %s)""",
-                (
-                    theatre,
-                    show["title"],
-                    show["image_url"],
-                    show["link_url"],
-                    show["start_date"],
-                    show["end_date"],
-                ),
+                f"""SELECT title, content_hash, gone_at IS NULL AS listed
+                    FROM {table} WHERE theatre = %s""",
+                (theatre,),
             )
-        except UniqueViolation:
-            # We have added this show already
-            LOG.debug("duplicate show %s found, skipping", show["title"])
-            return
-        except:
-            LOG.exception("unhandled exception")
-            raise
+            existing = {row["title"]: row for row in cursor.fetchall()}
+
+            changed = [
+                row
+                for title, row in rows.items()
+                if title not in existing
+                or existing[title]["content_hash"] != row[-1]
+                or not existing[title]["listed"]
+            ]
+            if changed:
+                execute_values(
+                    cursor,
+                    f"""INSERT INTO {table} (theatre, title, image_url, link_url, start_date, end_date, content_hash)
+                        VALUES %s
+                        ON CONFLICT (theatre, title) DO UPDATE SET
+                            image_url = EXCLUDED.image_url,
+                            link_url = EXCLUDED.link_url,
+                            start_date = EXCLUDED.start_date,
+                            end_date = EXCLUDED.end_date,
+                            content_hash = EXCLUDED.content_hash,
+                            updated_at = CURRENT_TIMESTAMP,
+                            gone_at = NULL""",
+                    changed,
+                    page_size=len(changed),
+                )
+
+            cursor.execute(
+                f"""UPDATE {table} SET gone_at = CURRENT_TIMESTAMP
+                    WHERE theatre = %s
+                    AND gone_at IS NULL
+                    AND NOT (title = ANY(%s))""",
+                (theatre, list(rows)),
+            )
+            expired = cursor.rowcount
+
+    inserted = sum(1 for row in changed if row[1] not in existing)
+    return UploadResult(
+        inserted, len(changed) - inserted, len(rows) - len(changed), expired
+    )
+
+
+SHOW_COLUMNS = """theatre, title, image_url, link_url, start_date, end_date,
+    created_at, content_hash, updated_at, gone_at"""
+
+
+def copy_shows(db, theatre, source, target):
+    """Copy a theatre's shows from the table `source` to `target`"""
+    with db as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""INSERT INTO {target} ({SHOW_COLUMNS})
+                    SELECT {SHOW_COLUMNS} FROM {source} WHERE theatre = %s""",
+                (theatre,),
+            )
+            return cursor.rowcount
 
 
 # Show fetching
-CLIENT = requests.Session()
-CLIENT.headers["User-Agent"] = "whatson/0.1.0"
 
+# Rate limits, timeouts and retries for every request, by host
+SCHEDULER = Scheduler()
+
+# `requests.Session` is not safe to share between threads, so each fetcher
+# thread gets its own session, created on first use and kept, along with its
+# connections, until `close_clients`.
+CLIENTS = threading.local()
+_SESSIONS = []
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _client():
+    """Return the session belonging to the current thread, which makes its
+    requests through `SCHEDULER`
+    """
+    client = getattr(CLIENTS, "session", None)
+    if client is None:
+        session = requests.Session()
+        session.headers["User-Agent"] = "whatson/0.1.0"
+        with _SESSIONS_LOCK:
+            _SESSIONS.append(session)
+        client = CLIENTS.session = SCHEDULER.session(session)
+    return client
+
+
+# Browsers for the theatres which build their listings with javascript
+BROWSERS = BrowserPool(size=2)
+
+
+# On-disk cache of the pages fetched with requests, set up by `main`
+HTTP_CACHE = None
+
+# Client which fetches pages on an event loop rather than with `requests`, set
+# up by `main` when asked for
+ASYNC_CLIENT = None
 
-# Lazy initialisation
-# XXX this will cause a race condition if we use multiple threads around this (mutex?)
-DRIVER = None
+# Digests of the pages fetched by the fetcher running in the current context
+PAGE_DIGESTS = contextvars.ContextVar("page_digests", default=None)
+
+
+def _record_page(html, page_digest=None):
+    digests = PAGE_DIGESTS.get()
+    if digests is not None:
+        digests.append(page_digest or httpcache.digest(html))
+
+    metrics.count("pages")
+    metrics.count("bytes", len(html.encode("utf-8")))
 
 
 def _fetch_html_requests(url):
     LOG.debug("fetching from url %s", url)
 
-    response = CLIENT.get(url)
-    response.raise_for_status()
-    return response.text
-
+    with metrics.stage("network"):
+        if ASYNC_CLIENT is not None:
+            page = ASYNC_CLIENT.fetch(url)
+        else:
+            page = httpcache.fetch(_client(), url, HTTP_CACHE)
+    _record_page(page.body, page.digest)
+    return page.body
 
-def _fetch_html_selenium(url):
-    global DRIVER
 
+def _fetch_html_selenium(url, ready_selector=None):
     LOG.debug("fetching from url %s", url)
 
-    # Lazy initialisation of driver
-    if DRIVER is None:
-        options = webdriver.ChromeOptions()
-        options.add_argument("--no-sandbox")
-        options.add_argument("--headless")
-        options.add_argument("--disable-gpu")
-        DRIVER = webdriver.Chrome(chrome_options=options)
-        DRIVER.implicitly_wait(3)
+    with metrics.stage("render"):
+        html = BROWSERS.page_source(url, ready_selector=ready_selector)
+    _record_page(html)
+    return html
 
-    DRIVER.get(url)
-    return DRIVER.page_source
 
+# Number of pages of a paginated listing to request ahead of the one being
+# parsed
+PREFETCH_PAGES = 3
 
-# Regex replacer to remove 1st/2nd/3rd/4th etc.
-DATE_REPLACER = re.compile(r"\b([0123]?[0-9])(st|th|nd|rd)\b")
+# Threads fetching pages ahead of time, shared by every listing so that their
+# sessions are reused rather than created for each one. Sized by `main` to
+# give every fetcher thread its lookahead.
+PREFETCH_WORKERS = PREFETCH_PAGES
+_PREFETCHER = None
+
+
+def _prefetcher():
+    global _PREFETCHER  # pylint: disable=global-statement
+    with _SESSIONS_LOCK:
+        if _PREFETCHER is None:
+            _PREFETCHER = ThreadPoolExecutor(
+                max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch"
+            )
+        return _PREFETCHER
+
+
+def close_clients():
+    """Stop the prefetch threads and close every thread's session"""
+    global _PREFETCHER  # pylint: disable=global-statement
+    with _SESSIONS_LOCK:
+        executor, _PREFETCHER = _PREFETCHER, None
+        sessions = list(_SESSIONS)
+        del _SESSIONS[:]
+
+    if executor is not None:
+        executor.shutdown()
+    for session in sessions:
+        session.close()
+
+
+def _start_fetch(url):
+    """Start fetching `url` in the background, returning a future of its HTML.
+    With the async client the request runs on its event loop, rather than
+    taking up one of the prefetch threads.
+    """
+    if ASYNC_CLIENT is not None:
+        return ASYNC_CLIENT.submit(url)
+    return _prefetcher().submit(_fetch_html_requests, url)
+
+
+def _prefetch_pages(urls, lookahead=PREFETCH_PAGES):
+    """Fetch the pages in the iterable `urls` in order, keeping up to
+    `lookahead` requests in flight, and yield their HTML. Stopping iteration
+    (e.g. on finding an empty page) cancels any speculative requests which
+    have not started yet.
+    """
+    urls = iter(urls)
+    pending = collections.deque()
+    try:
+        while True:
+            for url in itertools.islice(urls, lookahead - len(pending)):
+                pending.append(_start_fetch(url))
+
+            if not pending:
+                return
+
+            # Pages are fetched on other threads, so only the time spent
+            # waiting for them counts, and they are only recorded once they
+            # are used. Speculative fetches past the end of the listings do
+            # not count.
+            with metrics.stage("network"):
+                html = pending.popleft().result()
+            _record_page(html)
+            yield html
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _follow_pages(url, next_url):
+    """Yield the HTML of the pages of a listing starting from `url`, where
+    `next_url(html)` gives the URL of the page after `html`, or `None` on the
+    last page. Each following page is fetched while the current one is being
+    processed.
+    """
+    future = _start_fetch(url)
+    try:
+        while future is not None:
+            with metrics.stage("network"):
+                html = future.result()
+            _record_page(html)
+
+            url = next_url(html)
+            future = _start_fetch(url) if url else None
+
+            yield html
+    finally:
+        if future is not None:
+            future.cancel()
+
+
+# The year of dates which do not give one, and which cannot be inferred from
+# the dates around them
 CURRENT_YEAR = datetime.date.today().year
 
 
-def weekday_replacer(text):
-    """Replace Thurs -> Thu, Tues -> Tue"""
-    return text.replace("Thurs", "Thu").replace("Tues", "Tue")
+def _css_class(*names):
+    """Match elements with any of the CSS classes `names` in a `SoupStrainer`.
+    While parsing, strainers may see the whole space separated `class`
+    attribute rather than each class, so match with a regex.
+    """
+    pattern = "|".join(re.escape(name) for name in names)
+    return re.compile(rf"(^|\s)({pattern})(\s|$)")
+
+
+def _checked_shows(fetcher, html):
+    """Yield the shows `fetcher` extracts from a page as `Show` records. A show
+    whose details do not make sense is logged and skipped, rather than losing
+    the rest of the theatre's listings.
+    """
+    for fields in fetcher.parse_page(html):
+        try:
+            yield Show(*fields)
+        except ValidationError as exc:
+            LOG.warning("%s: skipping show: %s", fetcher.name, exc)
+            metrics.count("errors")
+
+
+def _show_dates(dates, text, year):
+    """The start and end dates of a run, parsed from `text` by the `DateParser`
+    `dates`, or `None` if they do not parse. That is logged and counted as an
+    error, and the fetcher skips the show rather than losing the page.
+    """
+    try:
+        return dates.parse_range(text, year)
+    except ValueError as exc:
+        LOG.warning("skipping show: cannot parse date text %r: %s", text, exc)
+        metrics.count("errors")
+        return None
 
 
 class FetcherList(type):
@@ -107,11 +373,14 @@ class FetcherList(type):
         c = super().__new__(cls, name, bases, dct)
         if name != "Fetcher":
             c.fetchers.add(c)
-        return c
 
-
-class ValidationError(ValueError):
-    pass
+            # Policies are set once, as the class is defined, rather than by
+            # each instance, which could replace a host's limiter while its
+            # requests are in flight
+            for url in (c.root_url, c.url):
+                if url is not None:
+                    SCHEDULER.configure(url, c.fetch_policy)
+        return c
 
 
 class Fetcher(metaclass=FetcherList):
@@ -120,6 +389,18 @@ class Fetcher(metaclass=FetcherList):
     name = None
     active = None
 
+    # CSS selector for an element which is only present once a page loaded by
+    # `_fetch_html_selenium` has finished rendering
+    ready_selector = None
+
+    # The parts of the page which the fetcher reads. Only these elements (and
+    # their children) are built into the tree by `parse`, which is much quicker
+    # than building the whole page.
+    parse_only = None
+
+    # Limits, timeouts and retries for requests to the theatre's site
+    fetch_policy = FetchPolicy()
+
     def __init__(self):
         self.fetchers = self.__class__.fetchers
 
@@ -136,6 +417,38 @@ class Fetcher(metaclass=FetcherList):
         if self.active is None:
             raise ValidationError(f"{self}: self.active is None")
 
+    # Whether a page without any shows marks the end of the listings, for
+    # fetchers which keep requesting pages until they run out
+    stop_on_empty_page = False
+
+    def parse(self, html, parse_only=None):
+        """Parse the parts of a page given by `parse_only`, or the fetcher's
+        `parse_only` if not given
+        """
+        with metrics.stage("parse"):
+            return BeautifulSoup(html, "lxml", parse_only=parse_only or self.parse_only)
+
+    def pages(self):
+        """Yield the HTML of each page of the theatre's listings"""
+        yield _fetch_html_requests(self.url)
+
+    def parse_page(self, html):
+        """Yield the details of each show listed on a page, as `ShowFields`"""
+        raise NotImplementedError
+
+    def fetch(self):
+        """Fetch every page of the theatre's listings and yield their shows"""
+        pages = self.pages()
+        try:
+            for html in pages:
+                shows = list(_checked_shows(self, html))
+                if not shows and self.stop_on_empty_page:
+                    LOG.debug("reached end of pages")
+                    break
+                yield from shows
+        finally:
+            pages.close()
+
 
 class AlbanyFetcher(Fetcher):
 
@@ -143,11 +456,12 @@ class AlbanyFetcher(Fetcher):
     root_url = "https://albanytheatre.co.uk/"
     url = "https://albanytheatre.co.uk/whats-on/"
     active = True
+    parse_only = SoupStrainer("div", class_=_css_class("query_block_content"))
+    dates = DateParser("%d %B %Y", "%d %B")
 
-    def fetch(self):
-        """Fetch shows from the Albany Theatre"""
-        html = _fetch_html_requests(self.url)
-        soup = BeautifulSoup(html, "lxml")
+    def parse_page(self, html):
+        """Extract the shows from the Albany Theatre's listings"""
+        soup = self.parse(html)
 
         container = soup.find("div", class_="query_block_content")
         for elem in container.children:
@@ -166,28 +480,18 @@ class AlbanyFetcher(Fetcher):
             link_url = elem.find("h4").find("a").attrs["href"]
             link_url = "".join([self.root_url, link_url])
 
-            # Parse date string
-            if "-" in date_str:
-                # Two separate dates
-                parts = [part.strip() for part in date_str.split("-")]
-                end_date = datetime.datetime.strptime(parts[1], "%d %B %Y").date()
-
-                date_month = datetime.datetime.strptime(parts[0], "%d %B").date()
-                start_date = datetime.date(
-                    end_date.year, date_month.month, date_month.day
-                )
-            else:
-                # One date therefore start_date = end_date
-                start_date = datetime.datetime.strptime(date_str, "%d %B %Y").date()
-                end_date = start_date
-
-            yield {
-                "title": title,
-                "image_url": image_url,
-                "link_url": link_url,
-                "start_date": start_date,
-                "end_date": end_date,
-            }
+            run = _show_dates(self.dates, date_str, CURRENT_YEAR)
+            if run is None:
+                continue
+            start_date, end_date = run
+
+            yield ShowFields(
+                title=title,
+                image_url=image_url,
+                link_url=link_url,
+                start_date=start_date,
+                end_date=end_date,
+            )
 
 
 class BelgradeFetcher(Fetcher):
@@ -196,11 +500,15 @@ class BelgradeFetcher(Fetcher):
     root_url = "http://www.belgrade.co.uk/"
     url = "http://www.belgrade.co.uk/whats-on/"
     active = True
+    parse_only = SoupStrainer(
+        "div", class_=_css_class("list-productions"), id="secondary-content"
+    )
+    panel_dates = DateParser("%B %Y")
+    dates = DateParser("%d %B", "%d %B %Y")
 
-    def fetch(self):
-        """Fetch shows from the Belgrade Theatre"""
-        html = _fetch_html_requests(self.url)
-        soup = BeautifulSoup(html, "lxml")
+    def parse_page(self, html):
+        """Extract the shows from the Belgrade Theatre's listings"""
+        soup = self.parse(html)
 
         container = soup.find("div", class_="list-productions", id="secondary-content")
 
@@ -217,9 +525,7 @@ class BelgradeFetcher(Fetcher):
             if elem.name == "h2":
                 # Month/Year section
                 date_text = elem.text.lower()
-                tmp_date = datetime.datetime.strptime(date_text, "%B %Y").date()
-                month = tmp_date.month
-                year = tmp_date.year
+                _, month, year = self.panel_dates.parts(date_text)
 
                 LOG.info("found month/year panel, month = %s, year = %s", month, year)
                 continue
@@ -246,47 +552,21 @@ class BelgradeFetcher(Fetcher):
             )
             image_url = "".join([self.root_url, image_url])
 
-            # Parse the date from this panel. First we replace instances of e.g.
-            # 1st -> 1 so that strptime can parse the day and month
-            date_text = DATE_REPLACER.sub(r"\1", date_text)
-
-            def parse_single_date(text):
-                try:
-                    tmp_date = datetime.datetime.strptime(text, "%d %B").date()
-                except ValueError as exc:
-                    if "day is out of range for month" in str(exc):
-                        # Leap year? Try parsing with the current year
-                        text = f"{text} {year}"
-                        tmp_date = datetime.datetime.strptime(text, "%d %B %Y").date()
-                return datetime.datetime(year, tmp_date.month, tmp_date.day).date()
-
-            if "-" in date_text:
-                # Separate start and end dates
-                parts = [part.strip() for part in date_text.split("-")]
-                start_date = parse_single_date(parts[0])
-                end_date = parse_single_date(parts[1])
-            else:
-                # Single date
-                start_date = parse_single_date(date_text)
-                end_date = start_date
-
-            # Check if the start date and end date make sense. The start date must
-            # be the same as the date panel. If this is not the case, something is
-            # up. Therefore if the end date is before the start date then we must
-            # add one to the end date year.
+            # The dates are in the year of the panel, unless the run continues
+            # into the next one
+            run = _show_dates(self.dates, date_text, year)
+            if run is None:
+                continue
+            start_date, end_date = run
             assert start_date.year == year
-            if end_date < start_date:
-                end_date = datetime.date(
-                    end_date.year + 1, end_date.month, end_date.day
-                )
 
-            yield {
-                "title": title,
-                "image_url": image_url,
-                "link_url": link_url,
-                "start_date": start_date,
-                "end_date": end_date,
-            }
+            yield ShowFields(
+                title=title,
+                image_url=image_url,
+                link_url=link_url,
+                start_date=start_date,
+                end_date=end_date,
+            )
 
 
 class SymphonyHallFetcher(Fetcher):
@@ -295,71 +575,66 @@ class SymphonyHallFetcher(Fetcher):
     root_url = "https://www.thsh.co.uk/"
     url = "https://www.thsh.co.uk/whats-on/"
     active = True
+    parse_only = SoupStrainer("ul", class_=_css_class("grid"))
+    next_page_only = SoupStrainer("a", class_=_css_class("pagination__link--next"))
+
+    def next_page_url(self, html):
+        soup = self.parse(html, parse_only=self.next_page_only)
+        next_link = soup.find("a", class_="pagination__link--next")
+        if next_link and "disabled" not in next_link.attrs["class"]:
+            return next_link.attrs["href"]
+        return None
+
+    def pages(self):
+        return _follow_pages(self.url, self.next_page_url)
+
+    def parse_page(self, html):
+        """Extract the shows from a page of Symphony Hall's listings"""
+        soup = self.parse(html)
+        container = soup.find("ul", class_="grid cf")
+        assert len(container.contents) <= 16
+        for elem in container.contents:
+            # The title is in capitals so we must turn this into a nicer
+            # format. Note we should treat each word separately rather than
+            # calling the `.title` method as this does not support embedded
+            # apostrophes (https://stackoverflow.com/a/1549644)
+            raw_title = elem.find("h3").text
+            title = " ".join(w.capitalize() for w in raw_title.split())
+
+            link_url = elem.find("a", class_="event-block").attrs["href"]
+            image_url = (
+                elem.find("img", class_="o-image__full").attrs["data-srcset"].split()[0]
+            )
 
-    def fetch(self):
-        """Fetch shows from Symphony Hall"""
-        url = self.url
-
-        # Loop over all pages
-        while True:
-            html = _fetch_html_requests(url)
-            soup = BeautifulSoup(html, "lxml")
-
-            container = soup.find("ul", class_="grid cf")
-            assert len(container.contents) <= 16
-            for elem in container.contents:
-                # The title is in capitals so we must turn this into a nicer
-                # format. Note we should treat each word separately rather than
-                # calling the `.title` method as this does not support embedded
-                # apostrophes (https://stackoverflow.com/a/1549644)
-                raw_title = elem.find("h3").text
-                title = " ".join(w.capitalize() for w in raw_title.split())
-
-                link_url = elem.find("a", class_="event-block").attrs["href"]
-                image_url = (
-                    elem.find("img", class_="o-image__full")
-                    .attrs["data-srcset"]
-                    .split()[0]
-                )
-
-                date_container = elem.find("span", class_="event-block__time")
-                times = date_container.find_all("time")
-                if len(times) == 1:
-                    # Simple case, only a single time available
-                    start_date = datetime.datetime.fromisoformat(
-                        times[0].attrs["datetime"]
-                    ).date()
-                    end_date = start_date
-                elif len(times) == 2:
-                    # We have start time and end time
-                    assert times[0].attrs["itemprop"] == "startDate"
-                    assert times[1].attrs["itemprop"] == "endDate"
-
-                    start_date = datetime.datetime.fromisoformat(
-                        times[0].attrs["datetime"]
-                    ).date()
-                    end_date = datetime.datetime.fromisoformat(
-                        times[1].attrs["datetime"]
-                    ).date()
-                else:
-                    raise NotImplementedError(
-                        f"cannot parse dates from {date_container}"
-                    )
-
-                yield {
-                    "title": title,
-                    "image_url": image_url,
-                    "link_url": link_url,
-                    "start_date": start_date,
-                    "end_date": end_date,
-                }
-
-            # Handle pagination
-            next_link = soup.find("a", class_="pagination__link--next")
-            if next_link and "disabled" not in next_link.attrs["class"]:
-                url = next_link.attrs["href"]
+            date_container = elem.find("span", class_="event-block__time")
+            times = date_container.find_all("time")
+            if len(times) == 1:
+                # Simple case, only a single time available
+                start_date = datetime.datetime.fromisoformat(
+                    times[0].attrs["datetime"]
+                ).date()
+                end_date = start_date
+            elif len(times) == 2:
+                # We have start time and end time
+                assert times[0].attrs["itemprop"] == "startDate"
+                assert times[1].attrs["itemprop"] == "endDate"
+
+                start_date = datetime.datetime.fromisoformat(
+                    times[0].attrs["datetime"]
+                ).date()
+                end_date = datetime.datetime.fromisoformat(
+                    times[1].attrs["datetime"]
+                ).date()
             else:
-                break
+                raise NotImplementedError(f"cannot parse dates from {date_container}")
+
+            yield ShowFields(
+                title=title,
+                image_url=image_url,
+                link_url=link_url,
+                start_date=start_date,
+                end_date=end_date,
+            )
 
 
 class HippodromeFetcher(Fetcher):
@@ -368,72 +643,109 @@ class HippodromeFetcher(Fetcher):
     root_url = "https://www.birminghamhippodrome.com/"
     url = "https://www.birminghamhippodrome.com/whats-on/"
     active = True
+    parse_only = SoupStrainer("ul", class_=_css_class("main-events-list"))
+    next_page_only = SoupStrainer("a", class_=_css_class("next"))
+    dates = DateParser("%a %d %b %Y", "%a %d %b", separators="-&")
 
-    def fetch(self):
-        """Fetch shows from the Hippodrome Theatre"""
-        url = self.url
+    def next_page_url(self, html):
+        soup = self.parse(html, parse_only=self.next_page_only)
+        next_link = soup.find("a", class_="next")
+        if next_link:
+            return next_link.attrs["href"]
+        return None
+
+    def pages(self):
+        return _follow_pages(self.url, self.next_page_url)
+
+    def parse_page(self, html):
+        """Extract the shows from a page of the Hippodrome Theatre's listings"""
+        soup = self.parse(html)
+        container = soup.find("ul", class_="main-events-list")
+
+        for elem in container.find_all("li", class_="events-list-item"):
+            item = elem.find("div", class_="performance-listing")
+
+            try:
+                image_url = elem.find("a", class_="block").find("img").attrs["src"]
+            except AttributeError:
+                image_url = ""
+
+            link_url = item.find("a", class_="block").attrs["href"]
+
+            details = item.find("div", class_="event-details")
+            title = details.find("h5", class_="performance-listing-title").text
+
+            date_text = details.find("p", class_="performance-listing-date").text
+
+            run = _show_dates(self.dates, date_text, CURRENT_YEAR)
+            if run is None:
+                continue
+            start_date, end_date = run
+
+            yield ShowFields(
+                title=title,
+                image_url=image_url,
+                link_url=link_url,
+                start_date=start_date,
+                end_date=end_date,
+            )
 
-        while True:
-            html = _fetch_html_requests(url)
-            soup = BeautifulSoup(html, "lxml")
-            container = soup.find("ul", class_="main-events-list")
-
-            for elem in container.find_all("li", class_="events-list-item"):
-                item = elem.find("div", class_="performance-listing")
-
-                try:
-                    image_url = elem.find("a", class_="block").find("img").attrs["src"]
-                except AttributeError:
-                    image_url = ""
-
-                link_url = item.find("a", class_="block").attrs["href"]
-
-                details = item.find("div", class_="event-details")
-                title = details.find("h5", class_="performance-listing-title").text
-
-                date_text = details.find("p", class_="performance-listing-date").text
-
-                def parse_single_date(txt):
-                    # Try parsing with the year
-                    try:
-                        dtime = datetime.datetime.strptime(txt, "%a %d %b %Y").date()
-                    except ValueError as exc:
-                        if "does not match format" in str(exc):
-                            # We do not have the year, so assume the current year
-                            full_date_text = f"{txt} {CURRENT_YEAR}"
-                            dtime = datetime.datetime.strptime(
-                                full_date_text, "%a %d %b %Y"
-                            ).date()
-                        else:
-                            raise
-
-                    return dtime
-
-                if "-" in date_text or "&" in date_text:
-                    if "-" in date_text:
-                        parts = [part.strip() for part in date_text.split("-")]
-                    elif "&" in date_text:
-                        parts = [part.strip() for part in date_text.split("&")]
-
-                    start_date = parse_single_date(parts[0])
-                    end_date = parse_single_date(parts[1])
-                else:
-                    start_date = parse_single_date(date_text)
-                    end_date = start_date
-
-                yield {
-                    "title": title,
-                    "image_url": image_url,
-                    "link_url": link_url,
-                    "start_date": start_date,
-                    "end_date": end_date,
-                }
-
-            next_link = soup.find("a", class_="next")
-            if next_link:
-                url = next_link.attrs["href"]
-            else:
-                break
+
+# The arenas run by the NEC group embed their full listings in their pages as
+# HTML escaped JSON, in the value of a hidden input
+ALL_EVENTS_TAG = re.compile(r"<input[^>]*\bid=\"all-events\"[^>]*>")
+ALL_EVENTS_VALUE = re.compile(r"\bvalue=\"([^\"]*)\"")
+
+
+def _extract_all_events(html):
+    """Decode the `all-events` JSON from an arena page without parsing the rest
+    of the HTML, returning `None` if it is not present
+    """
+    tag = ALL_EVENTS_TAG.search(html)
+    if tag is None:
+        return None
+
+    value = ALL_EVENTS_VALUE.search(tag.group(0))
+    if value is None:
+        return None
+
+    return json.loads(unescape(value.group(1)))
+
+
+# The arenas' dates, e.g. "16 - 19 January 2020" or "30 April - 3 May 2020"
+ARENA_DATES = DateParser("%d %B %Y", "%d %B", "%d")
+
+
+def _shows_from_all_events(data, root_url):
+    """Build shows from the decoded `all-events` JSON. The JSON also lists the
+    events at the group's other venues, which are marked as external.
+    """
+    for item in data["events"]:
+        if item["isExternal"]:
+            continue
+
+        run = _show_dates(ARENA_DATES, item["dateString"], CURRENT_YEAR)
+        if run is None:
+            continue
+        start_date, end_date = run
+
+        yield ShowFields(
+            title=item["eventName"],
+            image_url=item["thumbnailUrl"],
+            link_url=urljoin(root_url, item["url"]),
+            start_date=start_date,
+            end_date=end_date,
+        )
+
+
+def _fetch_arena_page(fetcher):
+    """Fetch an arena's listings. They are embedded in the page, so only start a
+    browser to render the page if they are missing.
+    """
+    html = _fetch_html_requests(fetcher.url)
+    if ALL_EVENTS_TAG.search(html) is None:
+        html = _fetch_html_selenium(fetcher.url, ready_selector=fetcher.ready_selector)
+    return html
 
 
 class ResortsWorldFetcher(Fetcher):
@@ -442,26 +754,21 @@ class ResortsWorldFetcher(Fetcher):
     root_url = "https://www.resortsworldarena.co.uk/"
     url = "https://www.resortsworldarena.co.uk/whats-on/"
     active = True
+    ready_selector = "#home-results .event-card"
+    parse_only = SoupStrainer("div", id="home-results")
 
-    def fetch(self):
-        html = _fetch_html_selenium(self.url)
-        soup = BeautifulSoup(html, "lxml")
-
-        # First build up a mapping of event name to image url. This is JSON after
-        # HTML escaping so we must:
-        #
-        # * fetch the text
-        # * unencode the text
-        # * parse into JSON
-        # * create a dictionary
-
-        data_mapping_encoded = soup.find("input", id="all-events").attrs["value"]
-        data_mapping = json.loads(unescape(data_mapping_encoded))
-
-        image_mapping = {
-            item["eventName"].lower(): item["thumbnailUrl"]
-            for item in data_mapping["events"]
-        }
+    def pages(self):
+        yield _fetch_arena_page(self)
+
+    def parse_page(self, html):
+        data = _extract_all_events(html)
+        if data is not None:
+            yield from _shows_from_all_events(data, self.root_url)
+            return
+
+        # Without the JSON there are only the rendered event cards, which do
+        # not include images
+        soup = self.parse(html)
 
         container = soup.find("div", id="home-results")
         if not container:
@@ -474,38 +781,20 @@ class ResortsWorldFetcher(Fetcher):
         for event in events:
             link_tag = event.find("a", class_="eventhref")
             title = link_tag.find("span", class_="title").text
-            link_url = "".join([self.root_url, link_tag.attrs["href"]])
-            image_url = image_mapping[title.lower()]
+            link_url = urljoin(self.root_url, link_tag.attrs["href"])
             date_text = event.find("span", class_="date").text
-
-            if "-" in date_text:
-                parts = [part.strip() for part in date_text.split("-")]
-                end_date = datetime.datetime.strptime(parts[1], "%d %B %Y").date()
-
-                try:
-                    # Assume day month no year
-                    augmented_date = f"{parts[0]} {end_date.year}"
-                    start_date = datetime.datetime.strptime(
-                        augmented_date, "%d %B %Y"
-                    ).date()
-                except ValueError:
-                    # Assume day no month no year
-                    augmented_date = f"{parts[0]} {end_date.month} {end_date.year}"
-                    start_date = datetime.datetime.strptime(
-                        augmented_date, "%d %m %Y"
-                    ).date()
-
-            else:
-                start_date = datetime.datetime.strptime(date_text, "%d %B %Y").date()
-                end_date = start_date
-
-            yield {
-                "title": title,
-                "image_url": image_url,
-                "link_url": link_url,
-                "start_date": start_date,
-                "end_date": end_date,
-            }
+            run = _show_dates(ARENA_DATES, date_text, CURRENT_YEAR)
+            if run is None:
+                continue
+            start_date, end_date = run
+
+            yield ShowFields(
+                title=title,
+                image_url="",
+                link_url=link_url,
+                start_date=start_date,
+                end_date=end_date,
+            )
 
 
 class ArenaBirminghamFetcher(Fetcher):
@@ -514,26 +803,21 @@ class ArenaBirminghamFetcher(Fetcher):
     root_url = "https://www.arenabham.co.uk/"
     url = "https://www.arenabham.co.uk/whats-on/"
     active = True
+    ready_selector = ".content-area .events-wrap .event-card"
+    parse_only = SoupStrainer("div", class_=_css_class("content-area"))
 
-    def fetch(self):
-        html = _fetch_html_selenium(self.url)
-        soup = BeautifulSoup(html, "lxml")
-
-        # First build up a mapping of event name to image url. This is JSON after
-        # HTML escaping so we must:
-        #
-        # * fetch the text
-        # * unencode the text
-        # * parse into JSON
-        # * create a dictionary
-
-        data_mapping_encoded = soup.find("input", id="all-events").attrs["value"]
-        data_mapping = json.loads(unescape(data_mapping_encoded))
-
-        image_mapping = {
-            item["eventName"].lower(): item["thumbnailUrl"]
-            for item in data_mapping["events"]
-        }
+    def pages(self):
+        yield _fetch_arena_page(self)
+
+    def parse_page(self, html):
+        data = _extract_all_events(html)
+        if data is not None:
+            yield from _shows_from_all_events(data, self.root_url)
+            return
+
+        # Without the JSON there are only the rendered event cards, which do
+        # not include images
+        soup = self.parse(html)
 
         supercontainer = soup.find("div", class_="content-area")
         if supercontainer is None:
@@ -546,47 +830,25 @@ class ArenaBirminghamFetcher(Fetcher):
 
         for event in events:
             link_tag = event.find("a", class_="eventhref")
-            link_url = "".join([self.root_url, link_tag.attrs["href"]])
+            link_url = urljoin(self.root_url, link_tag.attrs["href"])
 
             title = event.find("span", class_="title").text
 
-            image_url = image_mapping[title.lower()]
-
             date_text = (
                 event.find("div", class_="information").find("span", class_="date").text
             )
-
-            if "-" in date_text:
-                parts = [part.strip() for part in date_text.split("-")]
-                end_date = datetime.datetime.strptime(parts[1], "%d %B %Y").date()
-
-                # Assume the start date is the full format
-                try:
-                    augmented_date = f"{parts[0]} {end_date.year}"
-                    tmp_date = datetime.datetime.strptime(
-                        augmented_date, "%d %B %Y"
-                    ).date()
-                except ValueError as exc:
-                    if "does not match format" in str(exc):
-                        augmented_date = f"{parts[0]} {end_date.month} {end_date.year}"
-                        start_date = datetime.datetime.strptime(
-                            augmented_date, "%d %m %Y"
-                        ).date()
-                    else:
-                        LOG.warning("unhandled exception: %s", exc)
-                        raise exc
-
-            else:
-                start_date = datetime.datetime.strptime(date_text, "%d %B %Y").date()
-                end_date = start_date
-
-            yield {
-                "title": title,
-                "image_url": image_url,
-                "link_url": link_url,
-                "start_date": start_date,
-                "end_date": end_date,
-            }
+            run = _show_dates(ARENA_DATES, date_text, CURRENT_YEAR)
+            if run is None:
+                continue
+            start_date, end_date = run
+
+            yield ShowFields(
+                title=title,
+                image_url="",
+                link_url=link_url,
+                start_date=start_date,
+                end_date=end_date,
+            )
 
 
 class ArtrixFetcher(Fetcher):
@@ -595,74 +857,46 @@ class ArtrixFetcher(Fetcher):
     root_url = "https://www.artrix.co.uk/"
     url = "https://www.artrix.co.uk/whats-on/"
     active = True
+    parse_only = SoupStrainer("ul", id="gridview-new")
+    # A small site, which is asked for several pages at once
+    fetch_policy = FetchPolicy(concurrency=2, rate=2.0)
+    # Pages are requested until one comes back empty
+    stop_on_empty_page = True
+    dates = DateParser("%a %d %b %Y", "%a %d %b", "%a %d")
+
+    def pages(self):
+        urls = (
+            self.url + "?" + urlencode({"page": page}) for page in itertools.count(1)
+        )
+        return _prefetch_pages(urls)
+
+    def parse_page(self, html):
+        soup = self.parse(html)
+
+        container = soup.find("ul", id="gridview-new")
+        events = container.find_all("li", class_="Exhib")
+        for event in events:
+            link_tag = event.find("div", class_="imgBox_Intrment").find("a")
+            link_url = "".join([self.root_url, link_tag.attrs["href"]])
 
-    def fetch(self):
-        page = 1
+            image_url = "".join([self.root_url, link_tag.find("img").attrs["src"]])
 
-        # Loop over all pages
-        while True:
-            params = urlencode({"page": page})
-            url = self.url + "?" + params
-
-            html = _fetch_html_requests(url)
-            soup = BeautifulSoup(html, "lxml")
-
-            container = soup.find("ul", id="gridview-new")
-            events = container.find_all("li", class_="Exhib")
-            if not events:
-                # We must have reached the end of the pages
-                break
-
-            for event in events:
-                link_tag = event.find("div", class_="imgBox_Intrment").find("a")
-                link_url = "".join([self.root_url, link_tag.attrs["href"]])
-
-                image_url = "".join([self.root_url, link_tag.find("img").attrs["src"]])
-
-                title = event.find("div", class_="intrment_info").find("a").text
-
-                date_text = event.find("div", class_="postDate_l").text
-
-                def parse_date_part(text, end_date=None):
-                    text = weekday_replacer(DATE_REPLACER.sub(r"\1", text))
-                    try:
-                        date = datetime.datetime.strptime(text, "%a %d %b %Y").date()
-                    except ValueError as exc:
-                        if "does not match format" in str(exc):
-                            # No year available
-                            try:
-                                date = datetime.datetime.strptime(
-                                    f"{text} {CURRENT_YEAR}", "%a %d %b %Y"
-                                ).date()
-                            except ValueError as exc:
-                                if "does not match format" in str(exc):
-                                    # no month available, we must get the month from the end date
-                                    date = datetime.datetime.strptime(
-                                        f"{text} {end_date.month} {CURRENT_YEAR}",
-                                        "%a %d %m %Y",
-                                    ).date()
-
-                    return date
-
-                if "-" in date_text:
-                    parts = [part.strip() for part in date_text.split("-")]
-
-                    end_date = parse_date_part(parts[1])
-                    start_date = parse_date_part(parts[0], end_date=end_date)
-                else:
-                    start_date = parse_date_part(date_text)
-                    end_date = start_date
+            title = event.find("div", class_="intrment_info").find("a").text
 
-                yield {
-                    "title": title,
-                    "image_url": image_url,
-                    "link_url": link_url,
-                    "start_date": start_date,
-                    "end_date": end_date,
-                }
+            date_text = event.find("div", class_="postDate_l").text
 
-            # Handle pagination
-            page += 1
+            run = _show_dates(self.dates, date_text, CURRENT_YEAR)
+            if run is None:
+                continue
+            start_date, end_date = run
+
+            yield ShowFields(
+                title=title,
+                image_url=image_url,
+                link_url=link_url,
+                start_date=start_date,
+                end_date=end_date,
+            )
 
 
 class AlexFetcher(Fetcher):
@@ -671,10 +905,11 @@ class AlexFetcher(Fetcher):
     root_url = "https://www.atgtickets.com/"
     url = "https://www.atgtickets.com/venues/the-alexandra-theatre-birmingham/"
     active = True
+    parse_only = SoupStrainer("section", class_=re.compile(r"WhatsOnPanel.*"))
+    dates = DateParser("%a %d %b %Y", "%a %d %b")
 
-    def fetch(self):
-        html = _fetch_html_requests(self.url)
-        soup = BeautifulSoup(html, "lxml")
+    def parse_page(self, html):
+        soup = self.parse(html)
 
         container = soup.find("section", {"class": re.compile(r"WhatsOnPanel.*")})
         for event in container.contents:
@@ -693,30 +928,18 @@ class AlexFetcher(Fetcher):
 
             date_text = card_details_tag.find("div").text
 
-            if "-" in date_text:
-                parts = [p.strip() for p in date_text.split("-")]
-                end_date = datetime.datetime.strptime(parts[1], "%a %d %b %Y").date()
-                try:
-                    start_date = datetime.datetime.strptime(
-                        parts[0], "%a %d %b %Y"
-                    ).date()
-                except ValueError as exc:
-                    if "does not match format" in str(exc):
-                        start_date = datetime.datetime.strptime(
-                            f"{parts[0]} {end_date.year}", "%a %d %b %Y"
-                        ).date()
-
-            else:
-                start_date = datetime.datetime.strptime(date_text, "%a %d %b %Y").date()
-                end_date = start_date
-
-            yield {
-                "title": title,
-                "image_url": image_url,
-                "link_url": link_url,
-                "start_date": start_date,
-                "end_date": end_date,
-            }
+            run = _show_dates(self.dates, date_text, CURRENT_YEAR)
+            if run is None:
+                continue
+            start_date, end_date = run
+
+            yield ShowFields(
+                title=title,
+                image_url=image_url,
+                link_url=link_url,
+                start_date=start_date,
+                end_date=end_date,
+            )
 
 
 class WarwickArtsCentreFetcher(Fetcher):
@@ -725,10 +948,20 @@ class WarwickArtsCentreFetcher(Fetcher):
     root_url = "https://www.warwickartscentre.co.uk/"
     url = "https://www.warwickartscentre.co.uk/whats-on/list"
     active = True
-
-    def fetch(self):
-        start_idx = 0
-
+    parse_only = SoupStrainer("div", class_=_css_class("area-production-list"))
+    # Many pages of listings, fetched several at once
+    fetch_policy = FetchPolicy(concurrency=2, rate=2.0)
+    stop_on_empty_page = True
+    dates = DateParser("%a %d %b %Y", "%a %d %b", "%a %d")
+
+    def pages(self):
+        urls = (
+            self.url + "?" + urlencode({"start": start_idx})
+            for start_idx in itertools.count(0, 10)
+        )
+        return _prefetch_pages(urls)
+
+    def parse_page(self, html):
         def fix_date_text(txt):
             """Given a date text, strip out any unrequired terms
             """
@@ -761,75 +994,34 @@ class WarwickArtsCentreFetcher(Fetcher):
 
             return newstr.strip()
 
-        while True:
+        soup = self.parse(html)
+
+        container = soup.find("div", class_="area-production-list")
+        events = container.find_all("article", class_="unit-production-entry")
+        for event in events:
+
+            image_tag = event.find("a", class_="media")
+            link_url = "".join([self.root_url, image_tag.attrs["href"]])
+            image_url = image_tag.find("img").attrs["src"]
 
-            params = urlencode({"start": start_idx})
-            url = self.url + "?" + params
-
-            html = _fetch_html_requests(url)
-            soup = BeautifulSoup(html, "lxml")
-
-            container = soup.find("div", class_="area-production-list")
-            events = container.find_all("article", class_="unit-production-entry")
-
-            if not events:
-                LOG.debug("reached end of pages")
-                break
-
-            for event in events:
-
-                image_tag = event.find("a", class_="media")
-                link_url = "".join([self.root_url, image_tag.attrs["href"]])
-                image_url = image_tag.find("img").attrs["src"]
-
-                title = event.find("div", class_="body").find("h2").text
-
-                date_text = event.find("p", class_="date").text.strip()
-                LOG.debug(date_text)
-                date_text = fix_date_text(date_text)
-
-                try:
-                    if "-" in date_text:
-                        parts = [p.strip() for p in date_text.split("-")]
-                        end_date = datetime.datetime.strptime(
-                            parts[1], "%a %d %b %Y"
-                        ).date()
-                        try:
-                            start_date = datetime.datetime.strptime(
-                                f"{parts[0]} {end_date.year}", "%a %d %b %Y"
-                            ).date()
-                        except ValueError as exc:
-                            if "does not match format" in str(exc):
-                                start_date = datetime.datetime.strptime(
-                                    f"{parts[0]} {end_date.month} {end_date.year}",
-                                    "%a %d %m %Y",
-                                ).date()
-
-                    else:
-                        try:
-                            start_date = datetime.datetime.strptime(
-                                date_text, "%a %d %b %Y"
-                            ).date()
-                        except ValueError as exc:
-                            if "does not match format" in str(exc):
-                                start_date = datetime.datetime.strptime(
-                                    f"{date_text} {CURRENT_YEAR}", "%a %d %b %Y"
-                                ).date()
-
-                        end_date = start_date
-
-                    yield {
-                        "title": title,
-                        "image_url": image_url,
-                        "link_url": link_url,
-                        "start_date": start_date,
-                        "end_date": end_date,
-                    }
-                except ValueError:
-                    LOG.warning("cannot parse date text %s", date_text)
-                    continue
-
-            start_idx += 10
+            title = event.find("div", class_="body").find("h2").text
+
+            date_text = event.find("p", class_="date").text.strip()
+            LOG.debug(date_text)
+            date_text = fix_date_text(date_text)
+
+            run = _show_dates(self.dates, date_text, CURRENT_YEAR)
+            if run is None:
+                continue
+            start_date, end_date = run
+
+            yield ShowFields(
+                title=title,
+                image_url=image_url,
+                link_url=link_url,
+                start_date=start_date,
+                end_date=end_date,
+            )
 
 
 def load_config(fptr):
@@ -848,8 +1040,349 @@ def load_config(fptr):
         }
 
 
+class FetchResult(NamedTuple):
+    """The outcome of running a single fetcher"""
+
+    name: str
+    shows: list
+    elapsed: float
+    error: Optional[BaseException] = None
+    # Hash of the contents of every page fetched, for spotting theatres whose
+    # listings have not changed
+    fingerprint: Optional[str] = None
+    stats: Optional[metrics.FetcherStats] = None
+
+
+def _fingerprint(digests):
+    return hashlib.sha256("\n".join(digests).encode("utf-8")).hexdigest()
+
+
+def _parse_page(fetcher, html):
+    """Extract the shows from a page, returning them along with the
+    `FetcherStats` of doing so. Time not spent building the tree or parsing
+    dates counts as extracting.
+    """
+    stats = metrics.FetcherStats(fetcher.name)
+    token = metrics.CURRENT.set(stats)
+    start = time.perf_counter()
+    try:
+        shows = list(_checked_shows(fetcher, html))
+    finally:
+        metrics.CURRENT.reset(token)
+
+    other = sum(stats.stages.values())
+    stats.add_time("extract", max(0.0, time.perf_counter() - start - other))
+    return shows, stats
+
+
+# Fetchers used by this parse process, by class
+PARSERS = {}
+
+
+def _start_parser(year):
+    """Set up a parse process. It does not share this process' globals, so is
+    given the year which dates without one are assumed to be in.
+    """
+    global CURRENT_YEAR  # pylint: disable=global-statement
+    CURRENT_YEAR = year
+
+
+def parse_pool(workers):
+    """A pool of `workers` processes for `_parse_page_remote`. By the time
+    pages are parsed, this process is running fetch threads, and maybe an event
+    loop and browsers, whose locks a forked worker could inherit while they
+    are held, so workers are started from a fresh process instead.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_start_parser,
+        initargs=(CURRENT_YEAR,),
+    )
+
+
+def _parse_page_remote(fetcher_cls, html):
+    """`_parse_page`, in a parse process. The stats are sent back as plain
+    dicts, to keep what is pickled small.
+    """
+    fetcher = PARSERS.get(fetcher_cls)
+    if fetcher is None:
+        fetcher = PARSERS[fetcher_cls] = fetcher_cls()
+
+    shows, stats = _parse_page(fetcher, html)
+    return shows, stats.stages, stats.counts
+
+
+def _only_fetches(fetcher):
+    """Whether a fetcher implements `fetch` without `parse_page`, and so has to
+    be run whole rather than page by page
+    """
+    parse_page = getattr(type(fetcher), "parse_page", Fetcher.parse_page)
+    return parse_page is Fetcher.parse_page
+
+
+# Pages waiting to be parsed, from every theatre, and theatres waiting to be
+# written. Each stage blocks once the one after it falls this far behind, so
+# the number of pages and shows held in memory stays bounded.
+PAGE_QUEUE_SIZE = 8
+RESULT_QUEUE_SIZE = 4
+
+
+class _Job:
+    """A fetcher's progress through the pipeline"""
+
+    def __init__(self, fetcher_cls):
+        self.fetcher_cls = fetcher_cls
+        self.fetcher = None
+        # Whether the fetcher only implements `fetch`
+        self.whole = False
+        self.stats = metrics.FetcherStats(fetcher_cls.name)
+        self.start = time.perf_counter()
+        self.error = None
+        self.digests = []
+        # The number of digests recorded once each page had been fetched
+        self.page_digests = []
+        # The shows on each page by number, the number of pages once they have
+        # all been fetched, and the first empty page of a listing which ends
+        # with one
+        self.pages = {}
+        self.npages = None
+        self.last_page = None
+        # Pages fetched but not yet parsed, so that one theatre cannot fill the
+        # queue or fetch far past the end of its listings
+        self.unparsed = threading.Semaphore(PREFETCH_PAGES)
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+
+    def fail(self, exc):
+        LOG.exception("fetcher %s failed", self.fetcher_cls.name)
+        with self.lock:
+            if self.error is None:
+                self.error = exc
+                self.stats.count("errors")
+        self.stop.set()
+
+
+class Pipeline:
+    """Runs fetchers as overlapping stages, joined by bounded queues:
+
+    * fetch: `workers` threads download each theatre's pages
+    * parse: extracts the shows from each page, on a thread in this process,
+      or in a pool of `parse_workers` processes if there are any, since
+      parsing is CPU bound
+    * write: the caller, which is given a `FetchResult` for each theatre as soon
+      as all of its pages have been parsed
+
+    so that the network, the CPU and the database are all kept busy at once.
+    Fetchers which only implement `fetch` run entirely in the fetch stage.
+    """
+
+    def __init__(self, workers=1, parse_workers=0):
+        self.workers = max(1, workers)
+        self.parse_workers = max(0, parse_workers)
+        self.fetched = metrics.Throughput("fetch", "pages")
+        self.parsed = metrics.Throughput("parse", "pages")
+        self.written = metrics.Throughput("write", "shows")
+        self._pages = queue.Queue(PAGE_QUEUE_SIZE)
+        self._results = queue.Queue(RESULT_QUEUE_SIZE)
+        self._closed = threading.Event()
+
+    @property
+    def stages(self):
+        return (self.fetched, self.parsed, self.written)
+
+    def run(self, fetcher_classes):
+        """Run the active fetchers, yielding a `FetchResult` for each as it
+        completes
+        """
+        jobs = [_Job(cls) for cls in fetcher_classes if cls.active is not False]
+
+        pool = None
+        if self.parse_workers:
+            pool = parse_pool(self.parse_workers)
+
+        # Each parse thread hands its pages to the pool, if there is one, so
+        # there is one thread for each process
+        parsers = [
+            threading.Thread(
+                target=self._parse, args=(pool,), name=f"parse-{i}", daemon=True
+            )
+            for i in range(max(1, self.parse_workers))
+        ]
+        for thread in parsers:
+            thread.start()
+
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for job in jobs:
+                executor.submit(self._fetch, job)
+            for _ in jobs:
+                yield self._results.get()
+        finally:
+            # Unblocks the stages if the caller stopped early
+            self._closed.set()
+            executor.shutdown()
+            for _ in parsers:
+                self._pages.put(None)
+            for thread in parsers:
+                thread.join()
+            if pool is not None:
+                pool.shutdown()
+
+    def _put(self, target, item):
+        """Put `item` on a queue, waiting while it is full unless the pipeline
+        is shut down. Returns whether it was queued.
+        """
+        while not self._closed.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _acquire(self, semaphore):
+        while not self._closed.is_set():
+            if semaphore.acquire(timeout=0.1):
+                return True
+        return False
+
+    def _fetch(self, job):
+        LOG.info("fetching using %s", job.fetcher_cls.name)
+        job.start = time.perf_counter()
+        digests_token = PAGE_DIGESTS.set(job.digests)
+        stats_token = metrics.CURRENT.set(job.stats)
+        npages = 0
+        try:
+            job.fetcher = job.fetcher_cls()
+            if _only_fetches(job.fetcher):
+                job.whole = True
+                with self.fetched.timed():
+                    job.pages[0] = list(job.fetcher.fetch())
+                npages = 1
+                return
+
+            pages = job.fetcher.pages()
+            try:
+                while self._acquire(job.unparsed):
+                    if job.stop.is_set():
+                        break
+                    with self.fetched.timed():
+                        html = next(pages, None)
+                    if html is None:
+                        break
+
+                    self.fetched.add()
+                    job.page_digests.append(len(job.digests))
+                    if not self._put(self._pages, (job, npages, html)):
+                        break
+                    npages += 1
+            finally:
+                pages.close()
+        except Exception as exc:  # pylint: disable=broad-except
+            job.fail(exc)
+        finally:
+            metrics.CURRENT.reset(stats_token)
+            PAGE_DIGESTS.reset(digests_token)
+            with job.lock:
+                job.npages = npages
+                done = len(job.pages) == npages
+            if done:
+                self._finish(job)
+
+    def _parse(self, pool):
+        while True:
+            item = self._pages.get()
+            if item is None:
+                return
+
+            job, index, html = item
+            shows = []
+            if job.last_page is None or index < job.last_page:
+                shows = self._extract(job, html, pool)
+                if not shows and getattr(job.fetcher, "stop_on_empty_page", False):
+                    with job.lock:
+                        if job.last_page is None or index < job.last_page:
+                            job.last_page = index
+                    job.stop.set()
+
+            job.unparsed.release()
+            with job.lock:
+                job.pages[index] = shows
+                done = len(job.pages) == job.npages
+            if done:
+                self._finish(job)
+
+    def _extract(self, job, html, pool):
+        try:
+            with self.parsed.timed():
+                if pool is None:
+                    shows, stats = _parse_page(job.fetcher, html)
+                    stages, counts = stats.stages, stats.counts
+                else:
+                    shows, stages, counts = pool.submit(
+                        _parse_page_remote, job.fetcher_cls, html
+                    ).result()
+        except Exception as exc:  # pylint: disable=broad-except
+            job.fail(exc)
+            return []
+        finally:
+            self.parsed.add()
+
+        job.stats.merge(stages, counts)
+        return shows
+
+    def _finish(self, job):
+        """Gather the shows from the pages of a finished job and pass them on to
+        the write stage
+        """
+        name = job.fetcher_cls.name
+        stats = job.stats
+        stats.elapsed = time.perf_counter() - job.start
+        if job.whole:
+            # Everything which was not fetching counts as extracting
+            stats.add_time(
+                "extract", max(0.0, stats.elapsed - sum(stats.stages.values()))
+            )
+
+        if job.error is not None:
+            result = FetchResult(name, [], stats.elapsed, error=job.error, stats=stats)
+        else:
+            # Pages fetched speculatively past the end of a listing are ignored
+            npages = job.npages if job.last_page is None else job.last_page + 1
+            shows = [show for index in range(npages) for show in job.pages[index]]
+            digests = job.digests
+            if job.page_digests:
+                digests = digests[: job.page_digests[npages - 1]]
+
+            stats.count("shows", len(shows))
+            stats.count("duplicates", len(shows) - len({show.title for show in shows}))
+            result = FetchResult(
+                name,
+                shows,
+                stats.elapsed,
+                fingerprint=_fingerprint(digests),
+                stats=stats,
+            )
+
+        job.pages.clear()
+        self._put(self._results, result)
+
+
+def default_cache_dir():
+    cache_home = os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "whatson")
+
+
 def main():
     """The entrypoint, called by `whatson-ingest`"""
+    # pylint: disable=global-statement
+    global HTTP_CACHE, ASYNC_CLIENT, PREFETCH_WORKERS
+
     logging.basicConfig(level=logging.INFO)
 
     # Set up the command line parser
@@ -862,23 +1395,216 @@ def main():
         default=False,
         help="Clear database contents before ingesting",
     )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        default=False,
+        help="Write every theatre's shows to new tables, and swap them in once "
+        "finished",
+    )
+    parser.add_argument(
+        "--rollback",
+        action="store_true",
+        default=False,
+        help="Put back the tables replaced by the last --rebuild, and exit",
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        default=False,
+        help="Bring the database schema up to date, which every run does first, "
+        "and exit",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of theatres to fetch concurrently",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=0,
+        help="Number of processes to parse pages in. With 0, pages are parsed "
+        "in the ingest process",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        default=False,
+        help="Fetch pages with aiohttp, all on one event loop",
+    )
+    parser.add_argument(
+        "--browsers",
+        type=int,
+        default=BROWSERS.size,
+        help="Maximum number of headless browsers to run at once",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir(),
+        help="Directory to cache fetched pages in (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=100,
+        help="Maximum size of the page cache in MB",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Fetch every page in full, and write every theatre's shows",
+    )
+    parser.add_argument(
+        "--report", help="Write timings and counts for the run to this JSON file"
+    )
+    parser.add_argument(
+        "--prometheus",
+        help="Write timings and counts for the run to this file, in the Prometheus "
+        "text format",
+    )
     parser.add_argument("-v", "--verbose", action="store_true", default=False)
     args = parser.parse_args()
 
     if args.verbose:
         LOG.setLevel(logging.INFO)
 
+    if args.rollback:
+        try:
+            rollback_shadow_tables(DB)
+        except RuntimeError as exc:
+            parser.exit(1, f"cannot roll back: {exc}\n")
+
+        # The fingerprints are of the pages the rolled back shows came from, so
+        # the next run must write every theatre
+        httpcache.HTTPCache(args.cache_dir).clear_fingerprints()
+        return
+
     if args.reset:
         reset_database(DB)
+    else:
+        migrate_database(DB)
+        if args.migrate:
+            return
 
-    # Run the ingestion
+    if args.rebuild:
+        create_shadow_tables(DB)
+
+    if not args.no_cache:
+        HTTP_CACHE = httpcache.HTTPCache(
+            args.cache_dir, max_bytes=args.cache_size * 1024 * 1024
+        )
+
+    if args.use_async:
+        ASYNC_CLIENT = aiofetch.AsyncClient(SCHEDULER, HTTP_CACHE)
+
+    BROWSERS.size = args.browsers
+    PREFETCH_WORKERS = max(1, args.workers) * PREFETCH_PAGES
+    report = metrics.RunReport()
+    try:
+        run_ingest(args, report)
+    finally:
+        BROWSERS.shutdown()
+        close_clients()
+        if ASYNC_CLIENT is not None:
+            ASYNC_CLIENT.close()
+
+        if args.report:
+            report.write_json(args.report)
+        if args.prometheus:
+            report.write_prometheus(args.prometheus)
+        print(report.summary())
+
+
+def run_ingest(args, report):
+    """Run every active fetcher and write the results to the database, adding
+    each fetcher's stats to `report`
+    """
+    # Fetching and parsing happen on the pipeline's threads, but all of the
+    # database access stays on this thread, which is the write stage.
+    pipeline = Pipeline(workers=args.workers, parse_workers=args.parse_workers)
+    for throughput in pipeline.stages:
+        report.add_stage(throughput)
+
+    # A rebuild writes to the shadow tables, which are swapped in at the end
+    table = f"shows{NEXT}" if args.rebuild else "shows"
+
+    # The pages written to the shadow tables, which are only recorded once the
+    # tables are swapped in, so that a rebuild which fails before then leaves
+    # the fingerprints of the shows still being served
+    rebuilt = {}
+
+    changed = False
+    for result in pipeline.run(Fetcher.fetchers):
+        report.add(result.stats)
+        if result.error is not None:
+            LOG.warning(
+                "%s: failed after %.2fs: %s", result.name, result.elapsed, result.error
+            )
+            if args.rebuild:
+                # Keep serving what we had rather than losing the theatre
+                copied = copy_shows(DB, result.name, "shows", table)
+                LOG.info("%s: kept %d existing shows", result.name, copied)
+            continue
+
+        LOG.info(
+            "%s: fetched %d shows in %.2fs",
+            result.name,
+            len(result.shows),
+            result.elapsed,
+        )
+
+        if args.rebuild and not result.shows:
+            # An empty listing never expires anything, which in a rebuild means
+            # carrying the theatre's shows over to the new tables
+            copied = copy_shows(DB, result.name, "shows", table)
+            LOG.info("%s: listed nothing, kept %d existing shows", result.name, copied)
+            continue
 
-    for fetcher_cls in Fetcher.fetchers:
-        LOG.info("fetching using %s", fetcher_cls.name)
-        if fetcher_cls.active is False:
+        # After a reset, or in a rebuild, the table is empty, so everything must
+        # be written
+        if (
+            HTTP_CACHE is not None
+            and not args.reset
+            and not args.rebuild
+            and HTTP_CACHE.fingerprint(result.name) == result.fingerprint
+        ):
+            LOG.info("%s: no pages have changed, skipping upload", result.name)
             continue
 
-        fetcher = fetcher_cls()
-        shows = fetcher.fetch()
-        for show in shows:
-            upload(fetcher.name, show)
+        start = time.perf_counter()
+        with pipeline.written.timed():
+            counts = upload_shows(DB, result.name, result.shows, table=table)
+        pipeline.written.add(len(result.shows))
+        upload_time = time.perf_counter() - start
+        result.stats.add_time("upload", upload_time)
+        result.stats.elapsed += upload_time
+
+        LOG.info(
+            "%s: %d inserted, %d updated, %d unchanged, %d gone",
+            result.name,
+            counts.inserted,
+            counts.updated,
+            counts.unchanged,
+            counts.expired,
+        )
+        changed = changed or counts.inserted + counts.updated + counts.expired > 0
+
+        if args.rebuild:
+            rebuilt[result.name] = result.fingerprint
+        elif HTTP_CACHE is not None:
+            HTTP_CACHE.set_fingerprint(result.name, result.fingerprint)
+
+    if args.rebuild:
+        LOG.info("swapping in the rebuilt tables")
+        swap_shadow_tables(DB)
+        if HTTP_CACHE is not None:
+            for name, fingerprint in rebuilt.items():
+                HTTP_CACHE.set_fingerprint(name, fingerprint)
+    elif changed:
+        # Let the webapp know that its cached responses are out of date
+        bump_data_version(DB)
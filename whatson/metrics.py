@@ -0,0 +1,417 @@
+"""
+Whatson metrics
+
+Timings and counts for each stage of an ingest run, the throughput of the
+ingest pipeline, and their export as a JSON report, a Prometheus text file, or
+a table for the terminal. Also histograms and counters for the webapp, served
+in the Prometheus text format.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+
+# The stages of fetching a theatre's listings:
+#
+# * network: waiting for pages to download
+# * render: waiting for the browser to render pages
+# * parse: building HTML trees
+# * dates: parsing the dates of shows
+# * extract: everything else the fetcher does, i.e. finding the shows in the
+#   parsed pages
+# * upload: writing the shows to the database
+STAGES = ("network", "render", "parse", "dates", "extract", "upload")
+
+COUNTERS = ("pages", "bytes", "shows", "duplicates", "errors")
+
+
+class FetcherStats:
+    """Time spent in each stage, and running counts, for a single fetcher"""
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] += seconds
+
+    def count(self, counter, amount=1):
+        with self._lock:
+            self.counts[counter] += amount
+
+    def merge(self, stages, counts):
+        """Add the times and counts recorded elsewhere, e.g. in another process"""
+        with self._lock:
+            for name, seconds in stages.items():
+                self.stages[name] += seconds
+            for name, amount in counts.items():
+                self.counts[name] += amount
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "elapsed": self.elapsed,
+            "stages": dict(self.stages),
+            "counts": dict(self.counts),
+        }
+
+
+# Stats for the fetcher running in the current context, if any
+CURRENT = contextvars.ContextVar("fetcher_stats", default=None)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Add the time spent in the block to the current fetcher's `name` stage"""
+    stats = CURRENT.get()
+    if stats is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_time(name, time.perf_counter() - start)
+
+
+def count(counter, amount=1):
+    """Add to one of the current fetcher's counters"""
+    stats = CURRENT.get()
+    if stats is not None:
+        stats.count(counter, amount)
+
+
+class Throughput:
+    """The number of items passed through a stage of the ingest pipeline, and
+    the time its workers spent on them, as opposed to waiting for work
+    """
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def timed(self):
+        """Count the time spent in the block as busy"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.busy += seconds
+
+    def add(self, items=1):
+        with self._lock:
+            self.items += items
+
+    @property
+    def rate(self):
+        """Items per busy second"""
+        return self.items / self.busy if self.busy else 0.0
+
+    def as_dict(self):
+        return {
+            "unit": self.unit,
+            "items": self.items,
+            "busy": self.busy,
+            "rate": self.rate,
+        }
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_label(value)}"' for key, value in pairs) + "}"
+
+
+class RunReport:
+    """The stats of every fetcher in an ingest run"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.fetchers = []
+        self.pipeline = []
+
+    def add(self, stats):
+        self.fetchers.append(stats)
+
+    def add_stage(self, throughput):
+        self.pipeline.append(throughput)
+
+    def as_dict(self):
+        return {
+            "started_at": self.started_at,
+            "elapsed": time.time() - self.started_at,
+            "fetchers": [stats.as_dict() for stats in self.fetchers],
+            "pipeline": {stage.name: stage.as_dict() for stage in self.pipeline},
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as outfile:
+            json.dump(self.as_dict(), outfile, indent=2)
+
+    def prometheus(self):
+        """The report in the Prometheus text format, suitable for the node
+        exporter's textfile collector or for pushing to a pushgateway
+        """
+        metric = "whatson_ingest_stage_seconds"
+        lines = [
+            f"# HELP {metric} Time spent in each stage of the last ingest",
+            f"# TYPE {metric} gauge",
+        ]
+        for stats in self.fetchers:
+            theatre = _label(stats.name)
+            for stage_name, seconds in stats.stages.items():
+                lines.append(
+                    f'{metric}{{theatre="{theatre}",stage="{stage_name}"}} {seconds:f}'
+                )
+
+        for counter in COUNTERS:
+            metric = f"whatson_ingest_{counter}"
+            lines.append(f"# HELP {metric} Number of {counter} in the last ingest")
+            lines.append(f"# TYPE {metric} gauge")
+            for stats in self.fetchers:
+                theatre = _label(stats.name)
+                lines.append(f'{metric}{{theatre="{theatre}"}} {stats.counts[counter]}')
+
+        for metric, description, attr, fmt in (
+            ("whatson_ingest_pipeline_items", "Items passed through", "items", "d"),
+            ("whatson_ingest_pipeline_busy_seconds", "Time spent busy in", "busy", "f"),
+        ):
+            lines.append(
+                f"# HELP {metric} {description} each pipeline stage in the last ingest"
+            )
+            lines.append(f"# TYPE {metric} gauge")
+            for stage_stats in self.pipeline:
+                name = _label(stage_stats.name)
+                value = getattr(stage_stats, attr)
+                lines.append(f'{metric}{{stage="{name}"}} {value:{fmt}}')
+
+        metric = "whatson_ingest_last_run_seconds"
+        lines.append(f"# HELP {metric} Duration of the last ingest")
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {time.time() - self.started_at:f}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # The textfile collector may read the file at any moment, so replace it
+        # in one go
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as outfile:
+            outfile.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+    def summary(self):
+        """A table of the report, one row per fetcher, followed by the throughput
+        of each stage of the pipeline
+        """
+        header = (
+            f"{'theatre':<22} {'pages':>5} {'KB':>7} {'shows':>5} {'dups':>4} "
+            f"{'errs':>4}"
+            + "".join(f" {name:>8}" for name in STAGES)
+            + f" {'total':>8}"
+        )
+        rows = [header, "-" * len(header)]
+        for stats in sorted(self.fetchers, key=lambda stats: stats.name):
+            counts = stats.counts
+            rows.append(
+                f"{stats.name[:22]:<22} {counts['pages']:>5} "
+                f"{counts['bytes'] / 1024:>7.0f} {counts['shows']:>5} "
+                f"{counts['duplicates']:>4} {counts['errors']:>4}"
+                + "".join(f" {stats.stages[name]:>7.2f}s" for name in STAGES)
+                + f" {stats.elapsed:>7.2f}s"
+            )
+
+        if self.pipeline:
+            rows.append("")
+        for stage_stats in self.pipeline:
+            rows.append(
+                f"{stage_stats.name:<6} {stage_stats.items:>6} {stage_stats.unit:<6} "
+                f"{stage_stats.busy:>7.2f}s busy {stage_stats.rate:>8.1f}/s"
+            )
+        return "\n".join(rows)
+
+
+# Upper bounds (in seconds) of the default histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Counts of observations falling in each of `buckets`, plus their sum"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # The last count is for observations above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def merge(self, counts, total):
+        """Add the counts and sum of a histogram with the same buckets"""
+        for index, count in enumerate(counts):
+            self.counts[index] += count
+        self.sum += total
+
+    def as_dict(self):
+        return {"buckets": self.buckets, "counts": self.counts, "sum": self.sum}
+
+    def prometheus(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {cumulative}')
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum:f}")
+        lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Histograms and counters, by name and labels, shared between threads.
+    Labels are given as keyword arguments.
+
+    Each process has its own registry, so a webapp served by several worker
+    processes gives each a `directory` to share. Every registry then writes its
+    metrics to a file there, at most `flush_seconds` after they change, and
+    `prometheus` reports the totals over every file, whichever worker serves
+    it. Files are named after the process, so the directory should be emptied
+    whenever the webapp starts.
+    """
+
+    def __init__(self, directory=None, flush_seconds=1.0):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._flusher = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def describe(self, name, kind, description):
+        """Declare the metric `name`, of `kind` "histogram" or "counter" """
+        with self._lock:
+            self._metrics.setdefault(name, (kind, description, {}))
+
+    def observe(self, name, value, **labels):
+        """Add `value` to a histogram"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._metrics[name][2]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+            self._changed()
+
+    def inc(self, name, amount=1, **labels):
+        """Add `amount` to a counter"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._metrics[name][2]
+            series[key] = series.get(key, 0) + amount
+            self._changed()
+
+    def _changed(self):
+        # Called with the lock held. The thread is started on first use rather
+        # than in `__init__`, so that it runs in the worker process.
+        if self.directory is None:
+            return
+        self._dirty.set()
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_forever, daemon=True)
+            self._flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.flush_seconds)
+            self._dirty.clear()
+            self.flush()
+
+    def flush(self):
+        """Write this process' metrics to its file in `directory`"""
+        with self._lock:
+            snapshot = {
+                name: [
+                    kind,
+                    description,
+                    [
+                        [labels, value.as_dict() if kind == "histogram" else value]
+                        for labels, value in series.items()
+                    ],
+                ]
+                for name, (kind, description, series) in self._metrics.items()
+            }
+
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with self._flush_lock:
+            with open(f"{path}.tmp", "w") as outfile:
+                json.dump(snapshot, outfile)
+            os.replace(f"{path}.tmp", path)
+
+    def _collect(self):
+        """The metrics of every process writing to `directory`, added up"""
+        self.flush()
+        metrics = {}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            with open(path) as infile:
+                snapshot = json.load(infile)
+
+            for name, (kind, description, series) in snapshot.items():
+                totals = metrics.setdefault(name, (kind, description, {}))[2]
+                for labels, value in series:
+                    key = tuple(tuple(pair) for pair in labels)
+                    if kind == "histogram":
+                        histogram = totals.get(key)
+                        if histogram is None:
+                            histogram = totals[key] = Histogram(tuple(value["buckets"]))
+                        histogram.merge(value["counts"], value["sum"])
+                    else:
+                        totals[key] = totals.get(key, 0) + value
+        return metrics
+
+    def prometheus(self):
+        """Every metric, in the Prometheus text format"""
+        if self.directory is not None:
+            return _prometheus(self._collect())
+        with self._lock:
+            return _prometheus(self._metrics)
+
+
+def _prometheus(metrics):
+    lines = []
+    for name, (kind, description, series) in sorted(metrics.items()):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(series.items()):
+            if kind == "histogram":
+                lines.extend(value.prometheus(name, labels))
+            else:
+                lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,53 @@
+"""
+Whatson models
+
+The records passed between the stages of ingest. Shows are tuples rather than
+dicts, so holding a theatre's whole listings, or sending them between
+processes, takes a fraction of the memory.
+"""
+
+import datetime
+from typing import NamedTuple
+
+
+class ValidationError(ValueError):
+    pass
+
+
+class ShowFields(NamedTuple):
+    """The details of a show as extracted from a page, before they are checked"""
+
+    title: str
+    image_url: str
+    link_url: str
+    start_date: datetime.date
+    end_date: datetime.date
+
+
+class Show(ShowFields):
+    """A show, as listed by a theatre. The fields are checked on construction,
+    raising `ValidationError` if they do not make sense.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, title, image_url, link_url, start_date, end_date):
+        if not isinstance(title, str) or not title.strip():
+            raise ValidationError(f"show without a title: {title!r}")
+
+        if not isinstance(image_url, str) or not isinstance(link_url, str):
+            raise ValidationError(
+                f"{title}: urls must be strings, not {image_url!r} and {link_url!r}"
+            )
+
+        for date in (start_date, end_date):
+            # `datetime` is a subclass of `date`, but cannot be compared to one
+            if not isinstance(date, datetime.date) or isinstance(
+                date, datetime.datetime
+            ):
+                raise ValidationError(f"{title}: {date!r} is not a date")
+
+        if end_date < start_date:
+            raise ValidationError(f"{title}: ends on {end_date}, before {start_date}")
+
+        return super().__new__(cls, title, image_url, link_url, start_date, end_date)
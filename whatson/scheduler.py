@@ -0,0 +1,182 @@
+"""
+Whatson fetch scheduler
+
+Limits how hard ingest hits each theatre's server: how many requests may be in
+flight to a host at once, and how many may start each second. Requests time
+out rather than hanging, and failures which are likely to be temporary are
+retried with a jittered exponential backoff, honouring any `Retry-After` the
+server sends.
+"""
+
+import contextlib
+import datetime
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import NamedTuple
+from urllib.parse import urlsplit
+import requests
+
+LOG = logging.getLogger("whatson.scheduler")
+
+# Responses worth trying again, as the server may recover
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class FetchPolicy(NamedTuple):
+    """How requests to a host are limited and retried"""
+
+    # Maximum number of requests in flight at once
+    concurrency: int = 2
+    # Maximum number of requests started per second
+    rate: float = 4.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    # Number of times to retry a request after the first attempt
+    retries: int = 3
+    # Delay before the first retry, doubling for each retry after
+    backoff: float = 1.0
+    # Longest time to wait before a retry, including for `Retry-After`
+    max_backoff: float = 60.0
+
+
+class HostLimiter:
+    """Concurrency and rate limits for the requests to a single host"""
+
+    def __init__(self, policy, clock=time.monotonic, sleep=time.sleep):
+        self.policy = policy
+        self._slots = threading.BoundedSemaphore(policy.concurrency)
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+        self._clock = clock
+        self._sleep = sleep
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Block until a request may be made, and hold its slot for the block"""
+        with self._slots:
+            with self._lock:
+                now = self._clock()
+                start = max(now, self._next_start)
+                self._next_start = start + 1 / self.policy.rate
+
+            if start > now:
+                self._sleep(start - now)
+            yield
+
+
+def retry_after(response, now=None):
+    """The number of seconds the server asked us to wait in its `Retry-After`
+    header, or `None`
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (when - now).total_seconds())
+
+
+def backoff(policy, attempt):
+    """The delay before retrying a request for the `attempt`th time"""
+    # "Full jitter", so that retries from many threads spread out
+    return random.uniform(0, min(policy.max_backoff, policy.backoff * 2 ** attempt))
+
+
+class Scheduler:
+    """Makes requests through per-host limiters, retrying them on failure.
+    Hosts use the default policy unless given another with `configure`.
+    """
+
+    def __init__(self, default=FetchPolicy(), sleep=time.sleep):
+        self.default = default
+        self._sleep = sleep
+        self._policies = {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def configure(self, url, policy):
+        """Use `policy` for requests to the host of `url`"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            if self._policies.get(host) != policy:
+                self._policies[host] = policy
+                self._limiters.pop(host, None)
+
+    def policy(self, url):
+        """The policy for requests to the host of `url`"""
+        with self._lock:
+            return self._policies.get(urlsplit(url).netloc, self.default)
+
+    def _limiter(self, host):
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                policy = self._policies.get(host, self.default)
+                limiter = self._limiters[host] = HostLimiter(policy, sleep=self._sleep)
+            return limiter
+
+    def get(self, session, url, headers=None):
+        """GET `url` with `session`, within the limits for its host. Returns the
+        last response, or raises the last connection error or timeout, once
+        the retries are used up.
+        """
+        limiter = self._limiter(urlsplit(url).netloc)
+        policy = limiter.policy
+
+        attempt = 0
+        while True:
+            last_attempt = attempt >= policy.retries
+            try:
+                with limiter.slot():
+                    response = session.get(
+                        url,
+                        headers=headers,
+                        timeout=(policy.connect_timeout, policy.read_timeout),
+                    )
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if last_attempt:
+                    raise
+                delay = backoff(policy, attempt)
+                LOG.warning("%s: %s, retrying in %.1fs", url, exc, delay)
+            else:
+                if response.status_code not in RETRY_STATUSES or last_attempt:
+                    return response
+
+                delay = retry_after(response)
+                if delay is None:
+                    delay = backoff(policy, attempt)
+                delay = min(delay, policy.max_backoff)
+                LOG.warning(
+                    "%s: status %d, retrying in %.1fs", url, response.status_code, delay
+                )
+
+            self._sleep(delay)
+            attempt += 1
+
+    def session(self, session):
+        """Wrap `session` so that its `get` goes through the scheduler"""
+        return ScheduledSession(self, session)
+
+
+class ScheduledSession:
+    """A session whose requests are limited and retried by a `Scheduler`"""
+
+    def __init__(self, scheduler, session):
+        self.scheduler = scheduler
+        self.session = session
+
+    def get(self, url, headers=None):
+        return self.scheduler.get(self.session, url, headers=headers)
@@ -1,50 +1,207 @@
-from flask import jsonify, Flask, render_template, request
-import json
-from typing import NamedTuple
-from .db import DB
+from flask import g, jsonify, Flask, render_template, request
 import datetime
+import gzip
+import hashlib
+import logging
+import os
+import re
+import time
+from typing import NamedTuple
+from .cache import DataVersion, LRUCache, ResponseCache
+from .db import DB, get_data_version
+from .metrics import Registry
 from functools import wraps
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LOG = logging.getLogger("whatson.webapp")
+
+DEFAULT_CONFIG = {
+    # Maximum number of API responses to keep in memory, 0 to disable caching
+    "CACHE_SIZE": 256,
+    # How often (in seconds) to check the database for a new data version
+    "DATA_VERSION_TTL": 5.0,
+    # Record request, query and serialisation times, and serve them at /metrics
+    "METRICS_ENABLED": True,
+    # Directory shared by the webapp's worker processes, so that /metrics
+    # reports all of them, or None to report only the worker serving it
+    "METRICS_DIR": os.getenv("METRICS_DIR"),
+    # Requests taking longer than this (in seconds) are logged with their SQL
+    "SLOW_REQUEST_SECONDS": 0.5,
+    # How long (in seconds) browsers may use API responses without revalidating
+    "CACHE_MAX_AGE": 300,
+    # API responses smaller than this (in bytes) are not compressed
+    "COMPRESS_MIN_SIZE": 1024,
+    # Largest number of months which may be requested from `/api/shows` at once
+    "MAX_RANGE_MONTHS": 24,
+}
+
+# A show, as JSON built by Postgres, in the shape the frontend expects
+SHOW_JSON = """json_build_object(
+    'name', shows.title,
+    'theatre', shows.theatre,
+    'image_url', shows.image_url,
+    'link_url', shows.link_url,
+    'start_date', shows.start_date,
+    'end_date', shows.end_date
+)"""
+
+MONTH_PARAM = re.compile(r"^(\d{4})-(\d{2})$")
+
+
+class InvalidParameter(ValueError):
+    """A request parameter which is malformed or out of range, answered with a
+    400 rather than a 500
+    """
+
+
+def parse_month(text):
+    """Parse a `YYYY-MM` query parameter to a year and month"""
+    match = MONTH_PARAM.match(text)
+    if match is None or not 1 <= int(match.group(2)) <= 12:
+        raise InvalidParameter(f"invalid month {text!r}, expected YYYY-MM")
+    return {"year": int(match.group(1)), "month": int(match.group(2))}
+
+
+def compress(body, encoding):
+    """Compress a response body with the `Content-Encoding` `encoding`"""
+    if encoding == "br":
+        return brotli.compress(body)
+    return gzip.compress(body)
+
+
+def choose_encoding(accept_encodings):
+    """The best compression the client accepts, or `None`"""
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def instrument(app, registry, slow_request_seconds):
+    """Record the latency of every request to `app` in `registry`, and log
+    requests slower than `slow_request_seconds` along with their queries.
+    Queries and serialisation are timed by wrapping them in `timed_query` and
+    `timed_serialise`.
+    """
+    registry.describe(
+        "whatson_request_duration_seconds", "histogram", "Time taken by requests"
+    )
+    registry.describe("whatson_requests_total", "counter", "Number of requests")
+    registry.describe(
+        "whatson_query_duration_seconds", "histogram", "Time taken by SQL queries"
+    )
+    registry.describe(
+        "whatson_query_rows_total",
+        "counter",
+        "Number of rows returned by queries, counting each row aggregated into JSON",
+    )
+    registry.describe(
+        "whatson_serialise_duration_seconds",
+        "histogram",
+        "Time taken to serialise responses",
+    )
+
+    def endpoint():
+        return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.queries = []
+
+    @app.after_request
+    def record_request(response):
+        elapsed = time.perf_counter() - g.request_start
+        registry.observe("whatson_request_duration_seconds", elapsed, path=endpoint())
+        registry.inc(
+            "whatson_requests_total", path=endpoint(), status=response.status_code
+        )
+
+        if elapsed > slow_request_seconds:
+            LOG.warning(
+                "slow request %s %s took %.3fs: %s",
+                request.method,
+                request.full_path,
+                elapsed,
+                "; ".join(
+                    f"{sql} ({seconds:.3f}s, {rows} rows)"
+                    for sql, seconds, rows in g.queries
+                )
+                or "no queries",
+            )
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return app.response_class(
+            registry.prometheus(), mimetype="text/plain; version=0.0.4"
+        )
+
+    def timed_query(query):
+        @wraps(query)
+        def inner(sql, params=None):
+            start = time.perf_counter()
+            rows = query(sql, params)
+            elapsed = time.perf_counter() - start
+
+            # Queries which build JSON return a row per month, or a single row,
+            # so they give the number of rows aggregated in a `row_count`
+            count = sum(row.get("row_count", 1) for row in rows)
+            registry.observe("whatson_query_duration_seconds", elapsed, path=endpoint())
+            registry.inc("whatson_query_rows_total", count, path=endpoint())
+            g.queries.append((" ".join(sql.split()), elapsed, count))
+            return rows
+
+        return inner
+
+    def timed_serialise(serialise):
+        @wraps(serialise)
+        def inner(*args, **kwargs):
+            start = time.perf_counter()
+            response = serialise(*args, **kwargs)
+            registry.observe(
+                "whatson_serialise_duration_seconds",
+                time.perf_counter() - start,
+                path=endpoint(),
+            )
+            return response
+
+        return inner
+
+    return timed_query, timed_serialise
+
 
-def create_app(db=None):
+def create_app(db=None, config=None):
     if db is None:
         db = DB
 
     app = Flask("whatson")
+    app.config.update(DEFAULT_CONFIG)
+    if config is not None:
+        app.config.update(config)
+
+    cache = ResponseCache(LRUCache(app.config["CACHE_SIZE"]))
+    data_version = DataVersion(
+        lambda: get_data_version(db), ttl=app.config["DATA_VERSION_TTL"]
+    )
 
     @app.route("/")
     def index():
         return render_template("index.html")
 
-    class ShowPresenter(object):
-        def __init__(self, show):
-            self.show = show
-
-        def serialise(self):
-            return {
-                "name": self.show["title"],
-                "theatre": self.show["theatre"],
-                "image_url": self.show["image_url"],
-                "link_url": self.show["link_url"],
-                "start_date": self.show["start_date"].isoformat(),
-                "end_date": self.show["end_date"].isoformat(),
-            }
-
-    class ShowEncoder(json.JSONEncoder):
-        def default(self, o):
-            if isinstance(o, ShowPresenter):
-                return o.serialise()
-            else:
-                return super().default(o)
-
-    app.json_encoder = ShowEncoder
-
     # Wrapper decorator that turns any exceptions into JSON messages
     def json_errors(fn):
         @wraps(fn)
         def inner(*args, **kwargs):
             try:
                 return fn(*args, **kwargs)
+            except InvalidParameter as e:
+                return jsonify(status="error", msg=str(e)), 400
             except Exception as e:
                 return jsonify(status="error", msg=str(e)), 500
 
@@ -56,52 +213,168 @@ def create_app(db=None):
         kwargs.pop("status", None)
         return jsonify(status="ok", **kwargs)
 
-    @app.route("/api/shows", methods=["POST"])
-    @json_errors
-    def get_by_month():
-        month = int(request.json["month"])
-        year = int(request.json["year"])
+    def raw_json_ok(**fragments):
+        """Like `jsonify_ok`, but for values which are already encoded as JSON"""
+        fragments["status"] = '"ok"'
+        body = ",".join(f'"{key}":{value}' for key, value in sorted(fragments.items()))
+        return app.response_class("{" + body + "}", mimetype="application/json")
 
+    def query(sql, params=None):
+        """Run `sql` and return all of the rows"""
         with db as conn:
             with conn.cursor() as cursor:
-                cursor.execute(
-                    """SELECT * FROM shows
-                        WHERE total_months(start_date) <= total_months(%(date_ref)s)
-                        AND total_months(end_date) >= total_months(%(date_ref)s)
-                        ORDER BY start_date ASC
-                        """,
-                    {"date_ref": datetime.date(year, month, 1)},
-                )
-                rows = cursor.fetchall()
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+
+    # With metrics disabled, nothing is wrapped and nothing is recorded
+    if app.config["METRICS_ENABLED"]:
+        timed_query, timed_serialise = instrument(
+            app,
+            Registry(app.config["METRICS_DIR"]),
+            app.config["SLOW_REQUEST_SECONDS"],
+        )
+        query = timed_query(query)
+        jsonify_ok = timed_serialise(jsonify_ok)
+        raw_json_ok = timed_serialise(raw_json_ok)
+
+    def cached_response(key, build):
+        """Return the JSON response for `key`, calling `build` to create it if
+        it is not cached for the current data version. The response carries an
+        `ETag` and `Last-Modified` so that clients can revalidate cheaply, and
+        is compressed if the client accepts it.
+        """
+        version, updated_at = data_version.current()
+
+        # The body in each encoding, compressed on first request
+        bodies = cache.get(version, key)
+        if bodies is None:
+            bodies = {None: build().get_data()}
+            cache.set(version, key, bodies)
+
+        encoding = None
+        if len(bodies[None]) >= app.config["COMPRESS_MIN_SIZE"]:
+            encoding = choose_encoding(request.accept_encodings)
+        if encoding not in bodies:
+            # Other threads may be reading the cached dict, so it is replaced
+            # rather than changed
+            bodies = {**bodies, encoding: compress(bodies[None], encoding)}
+            cache.set(version, key, bodies)
+
+        response = app.response_class(bodies[encoding], mimetype="application/json")
+        etag = hashlib.sha1(repr((version,) + key).encode()).hexdigest()
+        if encoding is not None:
+            response.content_encoding = encoding
+            etag = f"{etag}-{encoding}"
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config["CACHE_MAX_AGE"]
+        if updated_at is not None:
+            response.last_modified = updated_at
+        return response.make_conditional(request)
+
+    @app.route("/api/shows", methods=["GET", "POST"])
+    @json_errors
+    def get_by_month():
+        params = request.args if request.method == "GET" else request.json
+        if "from" in params:
+            return get_range(params)
+
+        month = int(params["month"])
+        year = int(params["year"])
+
+        return cached_response(("shows", year, month), lambda: shows_for(year, month))
+
+    def get_range(params):
+        first = parse_month(params["from"])
+        last = parse_month(params.get("to", params["from"]))
+        months = (last["year"] - first["year"]) * 12 + last["month"] - first["month"]
+        if not 0 <= months < app.config["MAX_RANGE_MONTHS"]:
+            raise InvalidParameter(
+                f"cannot request more than {app.config['MAX_RANGE_MONTHS']} months"
+            )
 
-        return jsonify_ok(shows=[ShowPresenter(show) for show in rows])
+        return cached_response(
+            ("range", params["from"], params.get("to")),
+            lambda: shows_between(first, last),
+        )
+
+    @app.route("/api/season", methods=["GET"])
+    @json_errors
+    def get_season():
+        # Every month with shows from the current one on, for loading all of
+        # the listings in one request
+        return cached_response(("season", datetime.date.today()), season)
+
+    def season():
+        rows = available_months()
+        if not rows:
+            return raw_json_ok(months="[]")
+        return shows_between(rows[0], rows[-1])
+
+    def shows_for(year, month):
+        # Postgres builds the JSON for the shows, in the shape the frontend
+        # expects, which is much quicker than serialising each row in Python
+        rows = query(
+            f"""SELECT COALESCE(
+                    json_agg({SHOW_JSON} ORDER BY shows.start_date ASC),
+                    '[]'
+                )::text AS shows,
+                COUNT(*) AS row_count
+                FROM show_months
+                JOIN shows ON shows.id = show_months.show_id
+                WHERE show_months.year = %(year)s
+                AND show_months.month = %(month)s
+                """,
+            {"year": year, "month": month},
+        )
+
+        return raw_json_ok(shows=rows[0]["shows"])
+
+    def shows_between(first, last):
+        """The shows for every month from `first` to `last` inclusive, grouped
+        by month, in a single query
+        """
+        rows = query(
+            f"""SELECT
+                    show_months.year,
+                    show_months.month,
+                    json_agg({SHOW_JSON} ORDER BY shows.start_date ASC)::text AS shows,
+                    COUNT(*) AS row_count
+                FROM show_months
+                JOIN shows ON shows.id = show_months.show_id
+                WHERE (show_months.year, show_months.month)
+                    >= (%(first_year)s, %(first_month)s)
+                AND (show_months.year, show_months.month)
+                    <= (%(last_year)s, %(last_month)s)
+                GROUP BY show_months.year, show_months.month
+                """,
+            {
+                "first_year": first["year"],
+                "first_month": first["month"],
+                "last_year": last["year"],
+                "last_month": last["month"],
+            },
+        )
+        shows = {(row["year"], row["month"]): row["shows"] for row in rows}
+
+        # Months without any shows are included, with an empty list
+        months = ",".join(
+            '{{"year":{year},"month":{month},"shows":{shows}}}'.format(
+                shows=shows.get((month["year"], month["month"]), "[]"), **month
+            )
+            for month in interpolate_months([first, last])
+        )
+        return raw_json_ok(months=f"[{months}]")
 
     @app.route("/api/months", methods=["GET"])
     @json_errors
     def get_months():
-        with db as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    """(SELECT
-                            EXTRACT(MONTH FROM start_date)::int AS month,
-                            EXTRACT(YEAR FROM start_date)::int AS year
-                        FROM shows
-                        WHERE end_date > CURRENT_DATE
-                        )
-                        UNION
-                        (
-                        SELECT
-                            EXTRACT(MONTH FROM end_date)::int AS month,
-                            EXTRACT(YEAR FROM end_date)::int AS year
-                        FROM shows
-                        WHERE end_date > CURRENT_DATE
-                        )
-                    ORDER BY year, month
-                    """
-                )
-                rows = cursor.fetchall()
+        # Months are listed from the current date, so the answer changes daily
+        return cached_response(("months", datetime.date.today()), months)
 
-        print(rows)
+    def months():
+        rows = available_months()
 
         if not rows:
             # We do not have anything in the database
@@ -111,6 +384,32 @@ def create_app(db=None):
 
         return jsonify_ok(dates=list(dates))
 
+    def available_months():
+        """Every month with shows, from the current month on"""
+        # Equivalent to a `SELECT DISTINCT year, month`, but jumps from one
+        # month to the next through the index rather than reading every show,
+        # so it takes the same time however many shows there are
+        today = datetime.date.today()
+        return query(
+            """WITH RECURSIVE months AS (
+                    (SELECT year, month FROM show_months
+                        WHERE (year, month) >= (%(year)s, %(month)s)
+                        ORDER BY year, month
+                        LIMIT 1)
+                    UNION ALL
+                    SELECT following.year, following.month FROM months,
+                        LATERAL (
+                            SELECT year, month FROM show_months
+                            WHERE (year, month) > (months.year, months.month)
+                            ORDER BY year, month
+                            LIMIT 1
+                        ) AS following
+                )
+                SELECT year::int, month::int FROM months
+                """,
+            {"year": today.year, "month": today.month},
+        )
+
     return app
 
 
@@ -137,6 +436,3 @@ def interpolate_months(seen_months):
         if current_month > 12:
             current_month = 1
             current_year += 1
-
-
-app = create_app()
@@ -1,4 +1,6 @@
-from .webapp import app
+from .webapp import create_app
+
+app = create_app()
 
 
 if __name__ == "__main__":